@@ -9,10 +9,15 @@ out vec3 normal;
 out vec3 fragPos;
 out vec4 shadow_coord;
 
-uniform mat4 m_proj;
-uniform mat4 m_view;
+// Shared by every program, see UniformBuffer
+layout (std140, binding = 0) uniform Camera {
+    mat4 m_proj;
+    mat4 m_view;
+    mat4 m_view_global_light;
+    vec3 cam_pos;
+};
+
 uniform mat4 m_model;
-uniform mat4 m_view_global_light;
 
 // Bias offset to remove shadow acne
 const float tiny = -0.0005;
@@ -2,10 +2,16 @@
 
 layout (location = 1) in vec3 in_position;
 
-uniform mat4 m_proj;
-uniform mat4 m_view_light;
+// Shared by every program, see UniformBuffer
+layout (std140, binding = 0) uniform Camera {
+    mat4 m_proj;
+    mat4 m_view;
+    mat4 m_view_global_light;
+    vec3 cam_pos;
+};
+
 uniform mat4 m_model;
 
 void main() {
-    gl_Position = m_proj * m_view_light * m_model * vec4(in_position, 1.0);
+    gl_Position = m_proj * m_view_global_light * m_model * vec4(in_position, 1.0);
 }
\ No newline at end of file
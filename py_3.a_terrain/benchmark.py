@@ -0,0 +1,246 @@
+import os
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"  # noqa: E402
+
+import sys
+import time
+import glm
+import numpy
+import pygame
+
+from core import (delta_ab, generate_vertex_data, get_terrain_heights, get_terrain_quads,
+                  generate_terrain_vertex_data, get_terrain_grid, generate_terrain_indexed_data,
+                  uniform_points_in_3d_triangles, get_grass_blades, get_frustum_planes, boxes_in_frustum,
+                  boxes_in_sphere, Camera, TerrainLOD, ProceduralHeightMap, BoundingVolumeHierarchy)
+
+# Terrain defaults, see TerrainChunk.add_chunk
+max_height = 100.0
+scale = 1.0
+rounding_factor = 6
+grass_density = 10
+seed = 0
+# The loop keeps every grass point as a Python tuple, larger terrains run out of memory
+grass_loop_limit = 256
+
+
+def get_image_data(path):
+    '''Same as Texture.get_image_data, without needing an OpenGL context.'''
+    image = pygame.image.load(path)
+    image = pygame.transform.flip(image, flip_x=False, flip_y=True)
+    width, height = image.get_rect().size
+    image = pygame.surfarray.array3d(image)
+    return image, width, height
+
+
+def random_quad():
+    '''Same as Texture.random_quad.'''
+    return [[(0, 0), (1, 0), (1, 1), (0, 1)],
+            [(1, 0), (1, 1), (0, 1), (0, 0)],
+            [(1, 1), (0, 1), (0, 0), (1, 0)],
+            [(0, 1), (0, 0), (1, 0), (1, 1)]][numpy.random.randint(4)]
+
+
+def loop_vertex_data(height_map, size, offset_h, half_size):
+    '''The original per-quad loop from Terrain.get_vertices and Terrain.generate_vertex_data.'''
+    half_scale = scale * 0.5
+    vertices = []
+    offset_w = half_size * scale
+    offset_d = half_size * scale
+    for z in range(1, size):
+        for x in range(1, size):
+            y1 = round((height_map[z][x-1][0] / 255) * max_height - offset_h, rounding_factor)
+            y2 = round((height_map[z][x][0] / 255) * max_height - offset_h, rounding_factor)
+            y3 = round((height_map[z-1][x][0] / 255) * max_height - offset_h, rounding_factor)
+            y4 = round((height_map[z-1][x-1][0] / 255) * max_height - offset_h, rounding_factor)
+            x_pos = x * scale
+            z_pos = z * scale
+            vertices.append((x_pos-half_scale-offset_w, y1, z_pos+half_scale-offset_d))
+            vertices.append((x_pos+half_scale-offset_w, y2, z_pos+half_scale-offset_d))
+            vertices.append((x_pos+half_scale-offset_w, y3, z_pos-half_scale-offset_d))
+            vertices.append((x_pos-half_scale-offset_w, y4, z_pos-half_scale-offset_d))
+    indices = []
+    texture_coords = []
+    texture_indices = []
+    normals = []
+    for i in range(0, len(vertices) - 1, 4):
+        v1 = vertices[i]
+        v2 = vertices[i + 1]
+        v3 = vertices[i + 2]
+        v4 = vertices[i + 3]
+        indices.append((i, i + 2, i + 3))
+        indices.append((i, i + 1, i + 2))
+        texture_coords.extend(random_quad())
+        texture_indices.append((0, 2, 3))
+        texture_indices.append((0, 1, 2))
+        normal_1 = glm.normalize(glm.cross(delta_ab(v1, v3), delta_ab(v1, v4)))
+        new_normals = [[normal_1] * 3]
+        normal_2 = glm.normalize(glm.cross(delta_ab(v1, v2), delta_ab(v1, v3)))
+        new_normals.extend([[normal_2] * 3])
+        normals.append(new_normals)
+    texture_coord_data = generate_vertex_data(texture_coords, texture_indices)
+    vertex_data = generate_vertex_data(vertices, indices)
+    vertex_data = numpy.hstack([texture_coord_data, vertex_data])
+    normals = numpy.array(normals, dtype='f4').reshape(int(len(normals * 6)), 3)
+    vertex_data = numpy.hstack([vertex_data, normals])
+    return numpy.array(vertex_data, dtype='f4')
+
+
+def array_vertex_data(height_map, size, offset_h, half_size):
+    '''The NumPy builder used by Terrain.'''
+    heights = get_terrain_heights(height_map, size, size, max_height, offset_h, rounding_factor)
+    quads = get_terrain_quads(heights, scale, half_size * scale, half_size * scale)
+    return generate_terrain_vertex_data(quads, random_quad())
+
+
+def indexed_vertex_data(height_map, size, offset_h, half_size):
+    '''The indexed builder used by Terrain(indexed=True).'''
+    heights = get_terrain_heights(height_map, size, size, max_height, offset_h, rounding_factor)
+    grid = get_terrain_grid(heights, scale, half_size * scale, half_size * scale)
+    return generate_terrain_indexed_data(grid)
+
+
+def uniform_points_in_3d_triangle(p1, p2, p3, n):
+    '''The original per-triangle grass point loop.'''
+    points = []
+    for i in range(n):
+        for j in range(n - i):
+            k = n - i - j
+            x = (i * p1[0] + j * p2[0] + k * p3[0]) / n
+            y = (i * p1[1] + j * p2[1] + k * p3[1]) / n
+            z = (i * p1[2] + j * p2[2] + k * p3[2]) / n
+            points.append((x, y, z))
+    return points
+
+
+def loop_grass_points(quads):
+    '''The original grass loop from Terrain.generate_vertex_data.'''
+    grass_vertices = []
+    for v1, v2, v3, v4 in quads.tolist():
+        grass_vertices.append(uniform_points_in_3d_triangle(v1, v2, v3, grass_density))
+        grass_vertices.append(uniform_points_in_3d_triangle(v1, v3, v4, grass_density))
+    return numpy.array(grass_vertices, dtype='f4')
+
+
+def array_grass_points(quads, jitter=0.0):
+    '''The batched grass points used by Terrain.'''
+    p1 = numpy.repeat(quads[:, 0], 2, axis=0)
+    p2 = quads[:, [1, 2]].reshape(-1, 3)
+    p3 = quads[:, [2, 3]].reshape(-1, 3)
+    return uniform_points_in_3d_triangles(p1, p2, p3, grass_density, jitter, seed=seed)
+
+
+def timed(function, *args):
+    numpy.random.seed(seed)
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def bench_terrain_mesh(height_map, sizes):
+    print("terrain mesh (2f 3f 3f)")
+    for size in sizes:
+        half_size = size // 2
+        offset_h = round(height_map[half_size][half_size][0] / 255 * max_height, rounding_factor) + 1
+        loop_data, loop_time = timed(loop_vertex_data, height_map, size, offset_h, half_size)
+        array_data, array_time = timed(array_vertex_data, height_map, size, offset_h, half_size)
+        identical = loop_data.tobytes() == array_data.tobytes()
+        print(f"  {size:>5}^2: loop {loop_time:9.3f}s, numpy {array_time:8.3f}s, "
+              f"x{loop_time / array_time:7.1f}, identical: {identical}")
+
+
+def bench_terrain_indexed(height_map, sizes):
+    print("terrain mesh, flat vs indexed")
+    for size in sizes:
+        half_size = size // 2
+        offset_h = round(height_map[half_size][half_size][0] / 255 * max_height, rounding_factor) + 1
+        flat_data, flat_time = timed(array_vertex_data, height_map, size, offset_h, half_size)
+        (vertex_data, index_data), indexed_time = timed(indexed_vertex_data, height_map, size, offset_h, half_size)
+        flat_bytes = flat_data.nbytes
+        indexed_bytes = vertex_data.nbytes + index_data.nbytes
+        print(f"  {size:>5}^2: flat {flat_time:8.3f}s {flat_bytes / 2**20:8.1f} MB {len(flat_data):>9} vertices, "
+              f"indexed {indexed_time:8.3f}s {indexed_bytes / 2**20:8.1f} MB {len(vertex_data):>9} vertices "
+              f"(x{flat_bytes / indexed_bytes:.1f} memory, x{len(flat_data) / len(vertex_data):.1f} vertices)")
+
+
+def bench_grass_points(height_map, sizes):
+    print(f"grass points (3f, density {grass_density}), blades (3f + 4 bytes)")
+    for size in sizes:
+        half_size = size // 2
+        offset_h = round(height_map[half_size][half_size][0] / 255 * max_height, rounding_factor) + 1
+        heights = get_terrain_heights(height_map, size, size, max_height, offset_h, rounding_factor)
+        quads = get_terrain_quads(heights, scale, half_size * scale, half_size * scale)
+        array_data, array_time = timed(array_grass_points, quads)
+        _, jitter_time = timed(array_grass_points, quads, 0.5)
+        blades, blades_time = timed(get_grass_blades, array_data.reshape(-1, 3), seed)
+        result = f"  {size:>5}^2: numpy {array_time:8.3f}s, jitter {jitter_time:8.3f}s, " \
+                 f"blades {blades_time:8.3f}s, {blades.nbytes / 2**20:8.1f} MB"
+        if size <= grass_loop_limit:
+            loop_data, loop_time = timed(loop_grass_points, quads)
+            identical = loop_data.tobytes() == array_data.tobytes()
+            result += f", loop {loop_time:9.3f}s, x{loop_time / array_time:7.1f}, identical: {identical}"
+        else:
+            result += ", loop skipped"
+        print(result)
+
+
+def bench_terrain_lod(height_map, sizes):
+    print(f"terrain lod, camera {Camera.far} far")
+    position, forward = glm.vec3(0, 5, 0), glm.normalize(glm.vec3(0, -0.3, -1))
+    for size in sizes:
+        terrain_lod, build_time = timed(TerrainLOD, (height_map[:size, :size], size, size), (size // 2, size // 2))
+        (patches, _), select_time = timed(terrain_lod.select, position, forward, Camera.fov, 16 / 9, Camera.far)
+        triangles = sum(2 * quads * quads for *_, quads in patches)
+        print(f"  {size:>5}^2: build {build_time:8.3f}s, select {select_time * 1000:6.2f}ms, "
+              f"{len(patches):>4} patches, {triangles:>7} triangles (full mesh {2 * (size - 1) ** 2})")
+
+
+def bench_procedural_heights(sizes):
+    height_source = ProceduralHeightMap(seed=seed)
+    print(f"procedural heights, {height_source.octaves} octaves")
+    for size in sizes:
+        heights, generate_time = timed(height_source.get_heights, (-size // 2, -size // 2), size, size)
+        print(f"  {size:>5}^2: generate {generate_time * 1000:9.2f}ms, "
+              f"{len(numpy.unique(heights)):>9} distinct heights (8-bit image 256)")
+
+
+def loop_view_test(centers, position, forward):
+    '''The original per-object view cone test from Scene.update.'''
+    visible = []
+    for center in centers.tolist():
+        pos = glm.vec3(center)
+        angle_from_camera = glm.degrees(glm.acos(glm.dot(glm.normalize(pos - position), forward)))
+        visible.append(angle_from_camera <= 120.0 or glm.distance(position, pos) <= 10.0)
+    return visible
+
+
+def bench_frustum_culling(counts):
+    print(f"frustum culling, boxes within {Camera.far} of the camera")
+    position, forward = glm.vec3(0, 5, 0), glm.normalize(glm.vec3(0, -0.3, -1))
+    m_proj = glm.perspective(glm.radians(Camera.fov), 16 / 9, Camera.near, Camera.far)
+    m_view = glm.lookAt(position, position + forward, glm.vec3(0, 1, 0))
+    for count in counts:
+        numpy.random.seed(seed)
+        centers = numpy.random.uniform(-Camera.far, Camera.far, (count, 3)).astype('f4')
+        extents = numpy.random.uniform(0.5, 16.0, (count, 3)).astype('f4')
+        bounds = numpy.stack([centers - extents, centers + extents], axis=1)
+        planes = get_frustum_planes(m_proj * m_view)
+        visible, cull_time = timed(boxes_in_frustum, planes, bounds)
+        _, loop_time = timed(loop_view_test, centers, position, forward)
+        bvh, build_time = timed(BoundingVolumeHierarchy, bounds, range(count))
+        _, refit_time = timed(bvh.refit)
+        _, query_time = timed(bvh.query, lambda node_bounds: boxes_in_frustum(planes, node_bounds))
+        near, radius_time = timed(bvh.query, lambda node_bounds: boxes_in_sphere(position, 10.0, node_bounds))
+        print(f"  {count:>6} boxes: numpy {cull_time * 1000:6.2f}ms, {visible.sum():>6} visible, "
+              f"view cone loop {loop_time * 1000:8.2f}ms, bvh build {build_time * 1000:7.2f}ms, "
+              f"refit {refit_time * 1000:5.2f}ms, query {query_time * 1000:5.2f}ms, "
+              f"radius 10 query {radius_time * 1000:5.2f}ms ({len(near)} boxes)")
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [64, 256, 1024]
+    height_map, _, _ = get_image_data('../textures/height_map.png')
+    bench_terrain_mesh(height_map, sizes)
+    bench_terrain_indexed(height_map, sizes)
+    bench_grass_points(height_map, sizes)
+    bench_terrain_lod(height_map, sizes)
+    bench_procedural_heights(sizes)
+    bench_frustum_culling([1000, 10000, 50000])
@@ -3,6 +3,9 @@ import moderngl
 import glm
 import pygame
 import math
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 mat_4 = glm.mat4(1)
 
@@ -25,18 +28,278 @@ def angle_between_vectors(a, b):
     return math.acos(dot_product(a, b))
 
 
-def uniform_points_in_3d_triangle(p1, p2, p3, n):
-    points = []
-    for i in range(n):
-        for j in range(n - i):
-            k = n - i - j
-            x = (i * p1[0] + j * p2[0] + k * p3[0]) / n
-            y = (i * p1[1] + j * p2[1] + k * p3[1]) / n
-            z = (i * p1[2] + j * p2[2] + k * p3[2]) / n
-            points.append((x, y, z))
+def uniform_points_in_3d_triangles(p1, p2, p3, n, jitter=0.0, seed=None):
+    '''Barycentric lattice of n * (n + 1) / 2 points in every (count, 3) triangle, returns (count, points, 3).'''
+    count = len(p1)
+    weights = [(i, j) for i in range(n) for j in range(n - i)]
+    points = numpy.empty((count, len(weights), 3), dtype='f4')
+    rng = numpy.random.default_rng(seed) if jitter else None
+    for point, (i, j) in enumerate(weights):
+        if jitter:
+            # Move the lattice point by up to jitter cells, folding it back over the far edge when it leaves
+            i = numpy.clip(i + (rng.random(count) - 0.5) * jitter, 0, n)
+            j = numpy.clip(j + (rng.random(count) - 0.5) * jitter, 0, n)
+            outside = i + j > n
+            i[outside], j[outside] = n - j[outside], n - i[outside]
+            i, j = i[:, None], j[:, None]
+        k = n - i - j
+        # One lattice point of every triangle at a time keeps the float64 temporaries small
+        points[:, point] = (i * p1 + j * p2 + k * p3) / n
     return points
 
 
+def grass_color_noise(st, octaves=3):
+    '''Fractal Brownian motion of value noise in [0, 1] at (n, 2) points, the noise grass.vert used for the colour.
+
+    In float32 like the shader, which also halves the temporaries.'''
+    def random(st):
+        hashed = numpy.sin(st @ numpy.array((12.9898, 78.233), dtype='f4')) * numpy.float32(43758.5453123)
+        return hashed - numpy.floor(hashed)
+
+    corners = numpy.array([(1, 0), (0, 1), (1, 1)], dtype='f4')
+
+    def noise(st):
+        i = numpy.floor(st)
+        f = st - i
+        a, b = random(i), random(i + corners[0])
+        c, d = random(i + corners[1]), random(i + corners[2])
+        u_x, u_y = (f * f * (3 - 2 * f)).T
+        return a + (b - a) * u_x + (c - a) * u_y * (1 - u_x) + (d - b) * u_x * u_y
+
+    rotation = numpy.array([[math.cos(0.5), math.sin(0.5)], [-math.sin(0.5), math.cos(0.5)]], dtype='f4')
+    st = numpy.asarray(st, dtype='f4')
+    value = numpy.zeros(len(st), dtype='f4')
+    amplitude = 0.5
+    for _ in range(octaves):
+        value += amplitude * noise(st)
+        st = st @ rotation * 2 + 100
+        amplitude *= 0.5
+    return value
+
+
+# A row of the grass buffer, the shape packs normalized bytes of size, yaw and colour variation, see get_grass_blades
+grass_blade = numpy.dtype([('position', 'f4', 3), ('shape', '<u4')])
+
+
+def get_grass_blades(points, seed=None):
+    '''Rows of the grass buffer, (n, 3) points with the attributes of their blades as grass_blade.
+
+    The shape holds the size between its smallest and largest, the yaw over half a turn, and the colour
+    variation, as the bytes read by unpackUnorm4x8 in grass_cull.comp and grass.vert. The wind phase, where
+    the blade starts on the flow map, follows from the position in grass.vert.'''
+    rng = numpy.random.default_rng(seed)
+    blades = numpy.empty(len(points), dtype=grass_blade)
+    blades['position'] = points
+    shape = numpy.zeros((len(points), 4), dtype='u1')
+    shape[:, :2] = rng.integers(0, 256, (len(points), 2), dtype='u1')
+    shape[:, 2] = numpy.round(grass_color_noise(points[:, [0, 2]]) * 255)
+    blades['shape'] = shape.view('<u4')[:, 0]
+    return blades
+
+
+def get_terrain_heights(height_map, height_map_w, height_map_d, max_h, offset_h, r_factor=5):
+    '''Return the rounded height of every height map texel as a (depth, width) array.'''
+    heights = height_map[:height_map_d, :height_map_w, 0] / 255 * max_h - offset_h
+    return numpy.round(heights, r_factor)
+
+
+def get_terrain_quads(heights, scale, offset_w, offset_d):
+    '''Return the four corners of every terrain quad as a (n, 4, 3) array, row by row.'''
+    depth, width = heights.shape
+    half_scale = scale * 0.5
+    x_pos = numpy.arange(1, width) * scale
+    z_pos = numpy.arange(1, depth) * scale
+    left = x_pos - half_scale - offset_w
+    right = x_pos + half_scale - offset_w
+    front = z_pos + half_scale - offset_d
+    back = z_pos - half_scale - offset_d
+    # Corner order matches the old loop: (x-1, z), (x, z), (x, z-1), (x-1, z-1)
+    corners_x = (left, right, right, left)
+    corners_y = (heights[1:, :-1], heights[1:, 1:], heights[:-1, 1:], heights[:-1, :-1])
+    corners_z = (front, front, back, back)
+    quads = numpy.empty((depth - 1, width - 1, 4, 3))
+    for i in range(4):
+        quads[:, :, i, 0] = corners_x[i]
+        quads[:, :, i, 1] = corners_y[i]
+        quads[:, :, i, 2] = corners_z[i][:, None]
+    return quads.reshape(-1, 4, 3)
+
+
+def get_flat_normals(a, b, c):
+    '''Return normalize(cross(b - a, c - a)) for arrays of triangles, in float32 like glm.'''
+    normals = numpy.cross((b - a).astype('f4'), (c - a).astype('f4'))
+    length_sq = (normals * normals).sum(axis=1, keepdims=True, dtype='f4')
+    return normals * (numpy.float32(1) / numpy.sqrt(length_sq))
+
+
+def generate_terrain_vertex_data(quads, texture_coords):
+    '''Pack (n, 4, 3) terrain quads into the interleaved 2f 3f 3f triangle buffer.'''
+    corners = numpy.array([0, 2, 3, 0, 1, 2])  # Triangle 1, Triangle 2
+    texture_coords = numpy.array(texture_coords, dtype='f4')[corners]
+    texture_coord_data = numpy.tile(texture_coords, (len(quads), 1))
+    vertex_data = quads[:, corners].reshape(-1, 3).astype('f4')
+    v1, v2, v3, v4 = quads[:, 0], quads[:, 1], quads[:, 2], quads[:, 3]
+    normals = numpy.stack([get_flat_normals(v1, v3, v4), get_flat_normals(v1, v2, v3)], axis=1)
+    normals = numpy.repeat(normals, 3, axis=1).reshape(-1, 3)
+    return numpy.hstack([texture_coord_data, vertex_data, normals])
+
+
+def get_terrain_grid(heights, scale, offset_w, offset_d):
+    '''Return one position per height sample as a (depth, width, 3) array, shared by neighbouring quads.'''
+    depth, width = heights.shape
+    half_scale = scale * 0.5
+    grid = numpy.empty((depth, width, 3))
+    grid[:, :, 0] = numpy.arange(1, width + 1) * scale - half_scale - offset_w
+    grid[:, :, 1] = heights
+    grid[:, :, 2] = (numpy.arange(1, depth + 1) * scale - half_scale - offset_d)[:, None]
+    return grid
+
+
+def get_terrain_indices(width, depth):
+    '''Return the uint32 triangle indices of a (depth, width) vertex grid, in the quad order of the flat mesh.'''
+    ids = numpy.arange(width * depth, dtype='u4').reshape(depth, width)
+    v1, v2, v3, v4 = ids[1:, :-1], ids[1:, 1:], ids[:-1, 1:], ids[:-1, :-1]
+    return numpy.stack([v1, v3, v4, v1, v2, v3], axis=-1).reshape(-1)
+
+
+def get_smooth_normals(grid):
+    '''Return area-weighted vertex normals of a (depth, width, 3) grid as float32.'''
+    v1, v2, v3, v4 = grid[1:, :-1], grid[1:, 1:], grid[:-1, 1:], grid[:-1, :-1]
+    # Un-normalized cross products are twice the triangle area, so summing them weights by area
+    normal_1 = numpy.cross(v3 - v1, v4 - v1)
+    normal_2 = numpy.cross(v2 - v1, v3 - v1)
+    normals = numpy.zeros_like(grid)
+    normals[1:, :-1] += normal_1 + normal_2
+    normals[:-1, 1:] += normal_1 + normal_2
+    normals[:-1, :-1] += normal_1
+    normals[1:, 1:] += normal_2
+    normals /= numpy.linalg.norm(normals, axis=2, keepdims=True)
+    return normals.astype('f4')
+
+
+def generate_terrain_indexed_data(grid, normals=None):
+    '''Pack a (depth, width, 3) grid into a 2f 3f 3f vertex buffer and a uint32 index buffer.'''
+    depth, width, _ = grid.shape
+    if normals is None:
+        normals = get_smooth_normals(grid)
+    # Texture repeats once per quad, in the same orientation as the flat mesh
+    texture_coords = numpy.empty((depth, width, 2), dtype='f4')
+    texture_coords[:, :, 0] = numpy.arange(width)
+    texture_coords[:, :, 1] = -numpy.arange(depth)[:, None]
+    vertex_data = numpy.concatenate([texture_coords, grid.astype('f4'), normals], axis=2)
+    return vertex_data.reshape(-1, 8), get_terrain_indices(width, depth)
+
+
+def bilinear_ground(lookup, sample_x, sample_z, scale):
+    '''Return the heights and (..., 3) normals at float height map samples, bilinear between whole samples.
+
+    lookup(x, z) returns the heights of arrays of whole samples.'''
+    sample_x, sample_z = numpy.asarray(sample_x, dtype='f8'), numpy.asarray(sample_z, dtype='f8')
+    x, z = numpy.floor(sample_x), numpy.floor(sample_z)
+    u, v = sample_x - x, sample_z - z
+    x, z = x.astype('i8'), z.astype('i8')
+    a, b = lookup(x, z), lookup(x + 1, z)
+    c, d = lookup(x, z + 1), lookup(x + 1, z + 1)
+    twist = a - b - c + d
+    heights = a + (b - a) * u + (c - a) * v + twist * u * v
+    # Slopes per sample, then per world unit
+    slope_x = (b - a + twist * v) / scale
+    slope_z = (c - a + twist * u) / scale
+    normals = numpy.stack([-slope_x, numpy.ones_like(slope_x), -slope_z], axis=-1)
+    normals /= numpy.linalg.norm(normals, axis=-1, keepdims=True)
+    return heights, normals
+
+
+def hash_lattice(lattice_x, lattice_z, seed):
+    '''Return a repeatable random value in [0, 1) for every integer lattice point.'''
+    # Integer hash on wrapping uint32 arithmetic, negative lattice points wrap too; single points are
+    # numpy scalars, which warn on the wrap
+    with numpy.errstate(over='ignore'):
+        h = lattice_x.astype('u4') * numpy.uint32(0x8da6b343) ^ lattice_z.astype('u4') * numpy.uint32(0xd8163841)
+        h ^= numpy.uint32(seed * 0xcb1ab31f & 0xffffffff)
+        h ^= h >> numpy.uint32(13)
+        h *= numpy.uint32(0x5bd1e995)
+        h ^= h >> numpy.uint32(15)
+    return h / 2 ** 32
+
+
+def value_noise(x, z, seed):
+    '''Smoothly interpolated lattice noise in [0, 1] at arrays of float positions.'''
+    lattice_x, lattice_z = numpy.floor(x), numpy.floor(z)
+    # Smoothstep, so the slope is continuous across lattice cells
+    u = x - lattice_x
+    v = z - lattice_z
+    u = u * u * (3 - 2 * u)
+    v = v * v * (3 - 2 * v)
+    lattice_x, lattice_z = lattice_x.astype('i8'), lattice_z.astype('i8')
+    a = hash_lattice(lattice_x, lattice_z, seed)
+    b = hash_lattice(lattice_x + 1, lattice_z, seed)
+    c = hash_lattice(lattice_x, lattice_z + 1, seed)
+    d = hash_lattice(lattice_x + 1, lattice_z + 1, seed)
+    return a + (b - a) * u + (c - a) * v + (a - b - c + d) * u * v
+
+
+def fbm_noise(x, z, seed, octaves=6, persistence=0.5, lacunarity=2.0):
+    '''Fractal Brownian motion of value noise in [0, 1], every octave has its own seed.'''
+    total = numpy.zeros(numpy.broadcast(x, z).shape)
+    amplitude, frequency, amplitudes = 1.0, 1.0, 0.0
+    for octave in range(octaves):
+        total += amplitude * value_noise(x * frequency, z * frequency, seed + octave)
+        amplitudes += amplitude
+        amplitude *= persistence
+        frequency *= lacunarity
+    return total / amplitudes
+
+
+def get_vertex_bounds(positions):
+    '''AABB (2, 3) of (n, 3) vertex positions, as the min and max corner.'''
+    return numpy.array([positions.min(axis=0), positions.max(axis=0)], dtype='f4')
+
+
+def get_world_bounds(bounds, m_model):
+    '''AABB (2, 3) around a local AABB placed by a model matrix.'''
+    m_model = numpy.asarray(m_model, dtype='f4')  # Rows of the matrix, translation in the last column
+    center = m_model[:3, :3] @ ((bounds[0] + bounds[1]) * 0.5) + m_model[:3, 3]
+    extent = numpy.abs(m_model[:3, :3]) @ ((bounds[1] - bounds[0]) * 0.5)
+    return numpy.array([center - extent, center + extent], dtype='f4')
+
+
+def get_frustum_planes(m_proj_view):
+    '''The six planes (a, b, c, d) of the view frustum facing inwards, from a projection * view matrix.'''
+    m = numpy.asarray(m_proj_view, dtype='f4')
+    planes = numpy.array([m[3] + m[0], m[3] - m[0], m[3] + m[1], m[3] - m[1], m[3] + m[2], m[3] - m[2]])
+    return planes / numpy.linalg.norm(planes[:, :3], axis=1)[:, None]
+
+
+def boxes_in_frustum(planes, bounds):
+    '''True for each AABB of bounds (n, 2, 3) that is at least partly inside all the planes.'''
+    # Twice the distance of the box corner furthest along each plane normal, center * n + extent * |n| written
+    # as min * (n - |n|) + max * (n + |n|), so one (n, 6) x (6, 6) product tests every box against every plane
+    normals = planes[:, :3]
+    weights = numpy.concatenate([normals - numpy.abs(normals), normals + numpy.abs(normals)], axis=1).T
+    return (bounds.reshape(-1, 6) @ weights >= -2 * planes[:, 3]).all(axis=1)
+
+
+def boxes_cast_into_frustum(planes, bounds, light_direction):
+    '''True for each AABB of bounds (n, 2, 3) whose shadow, cast away from light_direction (pointing towards the
+    light), can reach inside all the planes.'''
+    normals = planes[:, :3]
+    centers = (bounds[:, 0] + bounds[:, 1]) * 0.5
+    extents = (bounds[:, 1] - bounds[:, 0]) * 0.5
+    # Distance of the box corner furthest along each plane normal
+    distances = centers @ normals.T + extents @ numpy.abs(normals).T + planes[:, 3]
+    # A box outside a plane only throws its shadow further outside, unless the light shines across the plane
+    # from the outside
+    return ~((distances < 0) & (normals @ numpy.asarray(light_direction, dtype='f4') >= 0)).any(axis=1)
+
+
+def boxes_in_sphere(center, radius, bounds):
+    '''True for each AABB of bounds (n, 2, 3) that is at least partly within radius of center.'''
+    center = numpy.asarray(center, dtype='f4')
+    nearest = numpy.clip(center, bounds[:, 0], bounds[:, 1])
+    return numpy.square(nearest - center).sum(axis=1) <= radius * radius
+
+
 class Camera:
     yaw = -90
     pitch = 0
@@ -45,6 +308,8 @@ class Camera:
     far = 100
     sensitivity = 0.1
     speed = 0.005
+    follow_ground = False  # Keep eye_height above TerrainChunk.get_height while moving
+    eye_height = 1.0  # The terrain center sample sits one unit under the camera
 
     position = None
     up = glm.vec3(0, 1, 0)
@@ -78,6 +343,9 @@ class Camera:
     def set_aspect_and_projection(self):
         self.aspect_ratio = self.app.win_size[0] / self.app.win_size[1]
         self.m_proj = self.get_projection_matrix()
+        # Culling uses the planes of the new frustum, the first call is made before the scene exists
+        if hasattr(self.app, 'scene'):
+            self.app.scene.moved = True
 
     def rotate(self):
         old_yaw, old_pitch = self.yaw, self.pitch
@@ -119,6 +387,8 @@ class Camera:
             self.position += self.up * self.velocity
         if keys[self.key_bindings["down"]]:
             self.position -= self.up * self.velocity
+        if self.follow_ground:
+            self.position.y = float(self.app.terrain.get_height(self.position.x, self.position.z)) + self.eye_height
         if self.position.x != old_x or self.position.y != old_y or self.position.z != old_z:
             self.app.scene.moved = True
 
@@ -148,13 +418,17 @@ class DirectionalLight:
         self.color = glm.vec3(color)
         self.strength = strength
         self.m_view_light = self.get_view_matrix()
+        self.version = 0  # Counts the turns, part of the shadow stamps, see Scene.update
 
     def get_view_matrix(self):
         return glm.lookAt(self.position, self.direction, glm.vec3(0, 1, 0))
 
     def rotate(self, time):
+        if time == 0:
+            return
         self.position = glm.rotateY(self.position, time)
         self.m_view_light = self.get_view_matrix()
+        self.version += 1
 
 
 class SpotLight:
@@ -190,6 +464,111 @@ class CameraSpotLight:
         self.direction = self.camera.forward
 
 
+class UniformBuffer:
+    '''Camera and Lights uniform blocks, packed once per frame and bound to every shader program.
+
+    The structured arrays follow the std140 layout of the blocks declared in the shaders.'''
+    camera_binding = 0
+    lights_binding = 1
+    max_lights = 99  # Same as max_lights in the fragment shaders
+
+    point_light = numpy.dtype({'names': ['position', 'color', 'strength'],
+                               'formats': [('f4', 3), ('f4', 3), 'f4'],
+                               'offsets': [0, 16, 28], 'itemsize': 32})
+    directional_light = numpy.dtype({'names': ['position', 'direction', 'color', 'strength'],
+                                     'formats': [('f4', 3), ('f4', 3), ('f4', 3), 'f4'],
+                                     'offsets': [0, 16, 32, 44], 'itemsize': 48})
+    spot_light = numpy.dtype({'names': ['position', 'direction', 'color', 'strength', 'cutoff', 'softness'],
+                              'formats': [('f4', 3), ('f4', 3), ('f4', 3), 'f4', 'f4', 'f4'],
+                              'offsets': [0, 16, 32, 44, 48, 52], 'itemsize': 64})
+    camera_block = numpy.dtype({'names': ['m_proj', 'm_view', 'm_shadow', 'cascade_splits', 'cam_pos',
+                                          'num_cascades'],
+                                'formats': [('f4', (4, 4)), ('f4', (4, 4)), ('f4', (4, 4, 4)), ('f4', 4), ('f4', 3),
+                                            'f4'],
+                                'offsets': [0, 64, 128, 384, 400, 412], 'itemsize': 416})
+    lights_block = numpy.dtype({'names': ['num_lights', 'global_light', 'flash_light', 'lights'],
+                                'formats': ['f4', directional_light, spot_light, (point_light, max_lights)],
+                                'offsets': [0, 16, 64, 128], 'itemsize': 128 + 32 * max_lights})
+
+    def __init__(self, app):
+        self.app = app
+        self.ctx = app.ctx
+        self.camera_data = numpy.zeros((), dtype=self.camera_block)
+        self.lights_data = numpy.zeros((), dtype=self.lights_block)
+        self.camera_ubo = self.ctx.buffer(reserve=self.camera_block.itemsize)
+        self.lights_ubo = self.ctx.buffer(reserve=self.lights_block.itemsize)
+        # Programs pick the blocks up by the binding points in their layout qualifiers
+        self.camera_ubo.bind_to_uniform_block(self.camera_binding)
+        self.lights_ubo.bind_to_uniform_block(self.lights_binding)
+
+    def update(self):
+        # glm matrices convert to NumPy row by row, GLSL reads them column by column
+        camera = self.camera_data
+        camera['m_proj'] = numpy.asarray(self.app.camera.m_proj).T
+        camera['m_view'] = numpy.asarray(self.app.camera.m_view).T
+        shadow = self.app.shadow
+        camera['m_shadow'][:shadow.cascades] = [numpy.asarray(m_shadow).T for m_shadow in shadow.m_shadow]
+        camera['cascade_splits'] = shadow.splits
+        camera['cam_pos'] = self.app.camera.position
+        camera['num_cascades'] = shadow.cascades
+        self.camera_ubo.write(camera)
+
+        lights = self.lights_data
+        lights['num_lights'] = len(self.app.lights)
+        if self.app.lights:
+            # One assignment per member for all the point lights, not one per light
+            point_lights = lights['lights'][:len(self.app.lights)]
+            point_lights['position'] = [light.position for light in self.app.lights]
+            point_lights['color'] = [light.color for light in self.app.lights]
+            point_lights['strength'] = [light.strength for light in self.app.lights]
+        global_light = self.app.global_light
+        lights['global_light'] = (global_light.position, global_light.direction, global_light.color,
+                                  global_light.strength)
+        flash_light = self.app.flash_light
+        lights['flash_light'] = (flash_light.position, flash_light.direction, flash_light.color,
+                                 flash_light.strength, flash_light.cutoff, flash_light.softness)
+        self.lights_ubo.write(lights)
+
+    def destroy(self):
+        self.camera_ubo.release()
+        self.lights_ubo.release()
+
+
+class UniformCache:
+    '''Last value written to each uniform of a shader program, so a write of the same value is skipped.
+
+    glm values are compared by their bytes; numbers and tuples by value, since moderngl packs those
+    for the uniform type.'''
+
+    def __init__(self, shader_program):
+        self.shader_program = shader_program
+        # Resolved once here instead of looking the name up in the program on every write
+        self.members = {name: shader_program[name] for name in shader_program
+                        if isinstance(shader_program[name], moderngl.Uniform)}
+        self.values = {}
+        self.writes = 0
+        self.elided = 0
+
+    def __setitem__(self, name, value):
+        if isinstance(value, (int, float, tuple)):
+            data = value
+        else:
+            data = value.to_bytes()  # Column major, bytes(value) is row major
+        if self.values.get(name) == data:
+            self.elided += 1
+            return
+        if data is value:
+            self.members[name].value = value
+        else:
+            self.members[name].write(data)
+        self.values[name] = data
+        self.writes += 1
+
+    def get_uniform(self, name: str) -> moderngl.Uniform:
+        '''Uniform resolved when the program was loaded, for writes that do not go through the cache.'''
+        return self.members[name]
+
+
 class Shader():
     def __init__(self, app):
         self.app = app
@@ -197,16 +576,22 @@ class Shader():
         self.programs = []
         self.programs_count = -1
         self.programs_map = {}
-
-    def get_shader(self, shader_name, geometry=False):
+        self.uniform_caches = {}
+        # Uniform writes issued and skipped in the last frame
+        self.uniform_writes = 0
+        self.uniform_elided = 0
+
+    def get_shader(self, shader_name, geometry=False, fragment_name=None, vertex_name=None, defines=()):
+        # fragment_name and vertex_name share another program's fragment or vertex shader,
+        # defines are the names defined for this program's variant of its shaders
         if shader_name in self.programs_map:
             # print(f"Reuse shader: {shader_name} at index: {self.programs_map[shader_name]}")
             return self.programs[self.programs_map[shader_name]]
 
-        with open(f'{self.app.base_path}/{self.app.shader_path}/{shader_name}.vert', 'r') as f:
-            vertex_shader_source = f.read()
-        with open(f'{self.app.base_path}/{self.app.shader_path}/{shader_name}.frag', 'r') as f:
-            fragment_shader_source = f.read()
+        with open(f'{self.app.base_path}/{self.app.shader_path}/{vertex_name or shader_name}.vert', 'r') as f:
+            vertex_shader_source = self.add_defines(f.read(), defines)
+        with open(f'{self.app.base_path}/{self.app.shader_path}/{fragment_name or shader_name}.frag', 'r') as f:
+            fragment_shader_source = self.add_defines(f.read(), defines)
 
         if geometry is True:
             with open(f'{self.app.base_path}/{self.app.shader_path}/{shader_name}.geom', 'r') as f:
@@ -224,9 +609,45 @@ class Shader():
         self.programs_count += 1
         self.programs_map[shader_name] = self.programs_count
         self.programs.append(shader_program)
+        self.uniform_caches[shader_program.glo] = UniformCache(shader_program)
         print(f"loaded shader: {shader_name} at index: {self.programs_count}")
         return shader_program
 
+    def add_defines(self, source, defines):
+        '''Shader source with a #define for each name, after its #version line.'''
+        if not defines:
+            return source
+        version, source = source.split('\n', 1)
+        return '\n'.join([version, *(f'#define {name}' for name in defines), source])
+
+    def get_compute_shader(self, shader_name):
+        if shader_name in self.programs_map:
+            return self.programs[self.programs_map[shader_name]]
+
+        with open(f'{self.app.base_path}/{self.app.shader_path}/{shader_name}.comp', 'r') as f:
+            compute_shader_source = f.read()
+        shader_program = self.ctx.compute_shader(compute_shader_source)
+        self.programs_count += 1
+        self.programs_map[shader_name] = self.programs_count
+        self.programs.append(shader_program)
+        self.uniform_caches[shader_program.glo] = UniformCache(shader_program)
+        print(f"loaded compute shader: {shader_name} at index: {self.programs_count}")
+        return shader_program
+
+    def get_uniforms(self, shader_program):
+        '''Uniform cache of a program from get_shader, shared by every object drawn with it.'''
+        return self.uniform_caches[shader_program.glo]
+
+    def count_uniform_writes(self):
+        '''Keep the uniform writes issued and skipped since the last call, called once per frame.'''
+        self.uniform_writes = 0
+        self.uniform_elided = 0
+        for uniforms in self.uniform_caches.values():
+            self.uniform_writes += uniforms.writes
+            self.uniform_elided += uniforms.elided
+            uniforms.writes = 0
+            uniforms.elided = 0
+
     def destroy(self):
         for program in self.programs:
             program.release()
@@ -239,6 +660,15 @@ class Texture:
         self.textures = []
         self.texture_count = -1
         self.texture_map = {}
+        self.bound = set()
+
+    def use(self, tex_id):
+        '''Bind a texture to the unit of its index, once; no other texture is bound to that unit.
+        moderngl uploads new textures on ctx.default_texture_unit (the last unit), far above these.'''
+        if tex_id in self.bound:
+            return
+        self.textures[tex_id].use(location=tex_id)
+        self.bound.add(tex_id)
 
     def get_texture(self, path):
         if path in self.texture_map:
@@ -323,6 +753,26 @@ class Texture:
         image = pygame.surfarray.array3d(image)  # Convert image to numpy array
         return image, width, height
 
+    def get_height_texture(self, path, image=None):
+        '''Get the red channel of a height map as a single channel float texture in [0, 1], for texelFetch.'''
+        if path in self.texture_map:
+            return self.texture_map[path]
+        if image is None:
+            image, _, _ = self.get_image_data(path)
+        # Rows are indexed like the height map arrays, so texel (x, z) is image[z][x]
+        heights = numpy.ascontiguousarray(image[:, :, 0] / 255, dtype='f4')
+        texture = self.ctx.texture(size=(heights.shape[1], heights.shape[0]), components=1,
+                                   data=heights, dtype='f4')
+        texture.filter = (moderngl.NEAREST, moderngl.NEAREST)
+        texture.repeat_x = False
+        texture.repeat_y = False
+        # Add to list
+        self.texture_count += 1
+        self.texture_map[path] = self.texture_count
+        self.textures.append(texture)
+        print(f"loaded height texture: {path} at index: {self.texture_count}")
+        return self.texture_count
+
     def random_quad(self):
         '''Return random texture coordinates for a quad.'''
         rand_int = numpy.random.randint(4)
@@ -377,17 +827,29 @@ class Texture:
 
 
 class Shadow():
-    def __init__(self, app, name="depth_texture", depth_size=[4096, 4096]):
+    '''Cascaded shadow map of the global light, each cascade covering one split of the camera's view depth.
+
+    A cascade is an orthographic projection around the bounding sphere of its split, snapped to whole texels so
+    the shadows do not shimmer as the camera moves. The cascades sit side by side in one depth texture.
+    With a single cascade the map is the one from before the cascades: the camera's projection from the light,
+    covering the whole view without splits.'''
+    max_cascades = 4  # Same as max_cascades in the shaders
+    split_blend = 0.75  # Share of logarithmic split distances, the rest are even
+    caster_distance = 100.0  # How far towards the light a cascade keeps its casters
+
+    def __init__(self, app, name="depth_texture", depth_size=[1024, 1024], cascades=4):
         self.app = app
         self.ctx = app.ctx
+        self.depth_size = depth_size
+        self.cascades = min(cascades, self.max_cascades)
 
-        print(f"shadow depth texture: {depth_size}")
+        print(f"shadow depth texture: {depth_size} x {self.cascades} cascades")
         # Assuming the depth buffer is a single float (4 bytes)
-        # for 4096x it is 16,777,216 pixels × 4 bytes/pixel = 67,108,864 bytes
-        # or 67,108,864 bytes ÷ (1024 × 1024) = 64 MB.
+        # for 4 cascades of 1024x it is 4,194,304 pixels × 4 bytes/pixel = 16,777,216 bytes
+        # or 16,777,216 bytes ÷ (1024 × 1024) = 16 MB, a quarter of a single 4096x map.
 
         # Using a texture here not a renderbuffer because we pass it to the shader
-        self.depth_tex_id = self.app.texture.get_depth_texture(depth_size, name)
+        self.depth_tex_id = self.app.texture.get_depth_texture((depth_size[0] * self.cascades, depth_size[1]), name)
         self.depth_texture = self.app.texture.textures[self.depth_tex_id]
         # self.depth_buffer = self.ctx.depth_renderbuffer(size=depth_size)
 
@@ -396,8 +858,70 @@ class Shadow():
 
         # Shadow depth map
         self.shader_program = app.shader.get_shader("default")
-        self.shader_program['shadow_map_tex'] = self.depth_tex_id
-        self.app.texture.textures[self.depth_tex_id].use(location=self.depth_tex_id)
+        app.shader.get_uniforms(self.shader_program)['shadow_map_tex'] = self.depth_tex_id
+        self.app.texture.use(self.depth_tex_id)
+        # Programs of the depth pass, each draws into the cascade of use
+        self.shadow_uniforms = [app.shader.get_uniforms(app.shader.get_shader("shadow")),
+                                app.shader.get_uniforms(app.shader.get_shader("grass_shadow", vertex_name="grass",
+                                                                              defines=("SHADOW",)))]
+
+        # Far distance of each split, then the matrices of the cascades, see update
+        self.splits = numpy.zeros(self.max_cascades, dtype='f4')
+        self.m_shadow = [glm.mat4(1)] * self.cascades
+        # What each tile was last drawn for, see is_current
+        self.stamps = [None] * self.cascades
+        self.cascade = 0  # Tile of the last use, the casters draw into it
+
+    def update(self):
+        '''Fit the cascades to the camera's view and the direction of the global light.'''
+        camera = self.app.camera
+        light = self.app.global_light
+        if self.cascades == 1:
+            self.splits[:] = camera.far
+            self.m_shadow = [camera.m_proj * light.m_view_light]
+            return
+        # Split distances between logarithmic, for even texel density, and even
+        steps = numpy.arange(1, self.cascades + 1) / self.cascades
+        far = self.split_blend * camera.near * (camera.far / camera.near) ** steps + \
+            (1 - self.split_blend) * (camera.near + (camera.far - camera.near) * steps)
+        near = numpy.concatenate([[camera.near], far[:-1]])
+        self.splits[:] = far[-1]
+        self.splits[:self.cascades] = far
+
+        # The cascades are fit in the light's view, only its rotation matters
+        m_view_light = light.m_view_light
+        # Distance from the view axis to the frustum corners, per unit of view depth
+        corner = math.tan(math.radians(camera.fov) / 2) * math.sqrt(1 + camera.aspect_ratio ** 2)
+        self.m_shadow = []
+        for split_near, split_far in zip(near.tolist(), far.tolist()):
+            # Smallest sphere around the split, its size does not change as the camera turns
+            center = min((split_near + split_far) * (1 + corner ** 2) / 2, split_far)
+            radius = math.hypot(split_far - center, split_far * corner)
+            x, y, z = (m_view_light * (camera.position + camera.forward * center)).xyz
+            # Move in whole texels of the cascade
+            texel = 2 * radius / self.depth_size[0]
+            x, y = math.floor(x / texel) * texel, math.floor(y / texel) * texel
+            m_proj_light = glm.ortho(x - radius, x + radius, y - radius, y + radius,
+                                     -z - radius - self.caster_distance, -z + radius)
+            self.m_shadow.append(m_proj_light * m_view_light)
+
+    def is_current(self, cascade, stamp):
+        '''Whether the tile of the cascade was drawn for the same stamp, else keep the stamp to draw it again.'''
+        if self.stamps[cascade] == stamp:
+            return True
+        self.stamps[cascade] = stamp
+        return False
+
+    def use(self, cascade):
+        '''Clear the tile of the cascade and draw the next shadow casters into it.'''
+        width, height = self.depth_size
+        viewport = (cascade * width, 0, width, height)
+        self.depth_fbo.viewport = viewport
+        self.depth_fbo.use()
+        self.depth_fbo.clear(viewport=viewport)
+        self.cascade = cascade
+        for uniforms in self.shadow_uniforms:
+            uniforms['u_cascade'] = cascade
 
     def destroy(self):
         self.depth_fbo.release()
@@ -437,117 +961,36 @@ class Prototype:
         return base_object
 
     def common_render_update(self):
+        # Camera and lights for every shader program #
+        self.app.uniform_buffer.update()
+
         # Default shader #
-        shader_program = self.app.shader.get_shader('default')
+        shader_uniforms = self.app.shader.get_uniforms(self.app.shader.get_shader('default'))
         # Resolution
-        # shader_program['u_resolution'].write(glm.vec2(self.app.win_size))
-
-        # Position
-        shader_program['cam_pos'].write(self.app.camera.position)
-        shader_program['m_proj'].write(self.app.camera.m_proj)
-        shader_program['m_view'].write(self.app.camera.m_view)
-
-        # Send lights into uniform array of Light struct
-        shader_program['num_lights'].value = len(self.app.lights)
-        for i, light in enumerate(self.app.lights):
-            shader_program[f'lights[{i}].position'].value = light.position
-            shader_program[f'lights[{i}].color'].value = light.color
-            shader_program[f'lights[{i}].strength'].value = light.strength
-
-        # Send global_light from self.global_light
-        shader_program['m_view_global_light'].write(self.app.global_light.m_view_light)
-        shader_program['global_light.position'].value = self.app.global_light.position
-        shader_program['global_light.direction'].value = self.app.global_light.direction
-        shader_program['global_light.color'].value = self.app.global_light.color
-        shader_program['global_light.strength'].value = self.app.global_light.strength
-
-        # Send flash_light from self.flash_light
-        shader_program['flash_light.position'].value = self.app.flash_light.position
-        shader_program['flash_light.color'].value = self.app.flash_light.color
-        shader_program['flash_light.strength'].value = self.app.flash_light.strength
-        shader_program['flash_light.cutoff'].value = self.app.flash_light.cutoff
-        shader_program['flash_light.direction'].value = self.app.flash_light.direction
-        shader_program['flash_light.softness'].value = self.app.flash_light.softness
-
-        # Shadow Shader #
-        shadow_program = self.app.shader.get_shader('shadow')
-        shadow_program['m_proj'].write(self.app.camera.m_proj)
-        shadow_program['m_view_light'].write(self.app.global_light.m_view_light)
+        # shader_uniforms['u_resolution'] = glm.vec2(self.app.win_size)
 
         # Debug
-        shader_program["texture_blend"].value = self.app.texture_blend
-        shader_program["local_light_blend"].value = self.app.local_light
-
-        # Debug Light
-        light_program = self.app.shader.get_shader('light')
-        light_program['m_proj'].write(self.app.camera.m_proj)
-        light_program['m_view'].write(self.app.camera.m_view)
+        shader_uniforms["texture_blend"] = self.app.texture_blend
+        shader_uniforms["local_light_blend"] = self.app.local_light
 
         # Grass shader #
-        grass_program = self.app.shader.get_shader('grass')
-        # Position
-        grass_program['m_proj'].write(self.app.camera.m_proj)
-        grass_program['m_view'].write(self.app.camera.m_view)
-        grass_program['cam_pos'].write(self.app.camera.position)
-
-        # Send lights into uniform array of Light struct
-        grass_program['num_lights'].value = len(self.app.lights)
-        for i, light in enumerate(self.app.lights):
-            grass_program[f'lights[{i}].position'].value = light.position
-            grass_program[f'lights[{i}].color'].value = light.color
-            grass_program[f'lights[{i}].strength'].value = light.strength
-
-        # Send global_light from self.global_light
-        grass_program['m_view_global_light'].write(self.app.global_light.m_view_light)
-        grass_program['global_light.position'].value = self.app.global_light.position
-        grass_program['global_light.direction'].value = self.app.global_light.direction
-        grass_program['global_light.color'].value = self.app.global_light.color
-        grass_program['global_light.strength'].value = self.app.global_light.strength
-
-        # Send flash_light from self.flash_light
-        grass_program['flash_light.position'].value = self.app.flash_light.position
-        grass_program['flash_light.color'].value = self.app.flash_light.color
-        grass_program['flash_light.strength'].value = self.app.flash_light.strength
-        grass_program['flash_light.cutoff'].value = self.app.flash_light.cutoff
-        grass_program['flash_light.direction'].value = self.app.flash_light.direction
-        grass_program['flash_light.softness'].value = self.app.flash_light.softness
-
-        # Debug
-        grass_program["texture_blend"].value = self.app.texture_blend
-        grass_program["local_light_blend"].value = self.app.local_light
-
-        # Ground shader #
-        ground_program = self.app.shader.get_shader('ground')
-        # Position
-        ground_program['cam_pos'].write(self.app.camera.position)
-        ground_program['m_proj'].write(self.app.camera.m_proj)
-        ground_program['m_view'].write(self.app.camera.m_view)
-
-        # Send lights into uniform array of Light struct
-        ground_program['num_lights'].value = len(self.app.lights)
-        for i, light in enumerate(self.app.lights):
-            ground_program[f'lights[{i}].position'].value = light.position
-            ground_program[f'lights[{i}].color'].value = light.color
-            ground_program[f'lights[{i}].strength'].value = light.strength
-
-        # Send global_light from self.global_light
-        ground_program['m_view_global_light'].write(self.app.global_light.m_view_light)
-        ground_program['global_light.position'].value = self.app.global_light.position
-        ground_program['global_light.direction'].value = self.app.global_light.direction
-        ground_program['global_light.color'].value = self.app.global_light.color
-        ground_program['global_light.strength'].value = self.app.global_light.strength
-
-        # Send flash_light from self.flash_light
-        ground_program['flash_light.position'].value = self.app.flash_light.position
-        ground_program['flash_light.color'].value = self.app.flash_light.color
-        ground_program['flash_light.strength'].value = self.app.flash_light.strength
-        ground_program['flash_light.cutoff'].value = self.app.flash_light.cutoff
-        ground_program['flash_light.direction'].value = self.app.flash_light.direction
-        ground_program['flash_light.softness'].value = self.app.flash_light.softness
+        # Streamed grass tiles can arrive after the first frame, so this may be the first load
+        grass_uniforms = self.app.shader.get_uniforms(self.app.shader.get_shader('grass'))
 
         # Debug
-        ground_program["texture_blend"].value = self.app.texture_blend
-        ground_program["local_light_blend"].value = self.app.local_light
+        grass_uniforms["texture_blend"] = self.app.texture_blend
+        grass_uniforms["local_light_blend"] = self.app.local_light
+
+        # Ground shader, and the LOD and GPU ground shaders when they are loaded #
+        ground_programs = [self.app.shader.get_shader('ground')]
+        for name in ('ground_lod', 'ground_gpu'):
+            if name in self.app.shader.programs_map:
+                ground_programs.append(self.app.shader.get_shader(name))
+        for ground_program in ground_programs:
+            ground_uniforms = self.app.shader.get_uniforms(ground_program)
+            # Debug
+            ground_uniforms["texture_blend"] = self.app.texture_blend
+            ground_uniforms["local_light_blend"] = self.app.local_light
 
     def destroy(self):
         for obj in self.objects:
@@ -560,29 +1003,31 @@ class PrototypeCube:
                  shadow_name: str = 'shadow'):
         self.app = app
         self.ctx = app.ctx
-        self.vbo = self.get_vbo()
+        self.vbo, self.position_vbo = self.get_vbos()
+        self.bounds = get_vertex_bounds(self.get_vertex_data()[:, 2:5])
         self.shader_program = self.app.shader.get_shader(shader_name)
-        self.vao = self.get_vao(self.vbo, self.shader_program)
+        self.vao = self.get_vao(self.vbo, self.position_vbo, self.shader_program)
         self.shadow_program = self.app.shader.get_shader(shadow_name)
-        self.shadow_vao = self.get_shadow_vao(self.vbo, self.shadow_program)
+        self.shadow_vao = self.get_shadow_vao(self.position_vbo, self.shadow_program)
 
     def destroy(self):
         self.vao.release()
         self.shadow_vao.release()
         self.vbo.release()
+        self.position_vbo.release()
 
-    def get_vao(self, vbo, shader_program):
+    def get_vao(self, vbo, position_vbo, shader_program):
         vao = self.ctx.vertex_array(shader_program, [
-            (vbo, '2f 3f 3f', 'in_texcoord_0', 'in_position', 'in_normal'),
+            (vbo, '2f 3f', 'in_texcoord_0', 'in_normal'),
+            (position_vbo, '3f', 'in_position'),
         ])
         return vao
 
-    def get_shadow_vao(self, vbo, shadow_program):
+    def get_shadow_vao(self, position_vbo, shadow_program):
+        # The depth pass only fetches positions
         vao = self.ctx.vertex_array(shadow_program, [
-            (vbo, '2f 3f 3f', 'in_texcoord_0', 'in_position', 'in_normal'),
-        ], skip_errors=True)
-        # Temporary fix for the issue with the shadow program because we are not using texture coordinates
-        # So we set skip_errors=True to ignore the missing in_texcoord_0 attribute
+            (position_vbo, '3f', 'in_position'),
+        ])
         return vao
 
     def get_vertex_data(self):
@@ -632,8 +1077,11 @@ class PrototypeCube:
 
         return numpy.array(vertex_data, dtype='f4')
 
-    def get_vbo(self):
-        return self.ctx.buffer(self.get_vertex_data())
+    def get_vbos(self):
+        # Positions get a buffer of their own, so the depth pass reads nothing it does not use
+        vertex_data = self.get_vertex_data()
+        vbo = self.ctx.buffer(numpy.ascontiguousarray(vertex_data[:, [0, 1, 5, 6, 7]]))
+        return vbo, self.ctx.buffer(numpy.ascontiguousarray(vertex_data[:, 2:5]))
 
 
 class PrototypeLightSource():
@@ -697,8 +1145,11 @@ class Cube:
         self.position = glm.mat4(glm.translate(mat_4, self.pos))
         self.position = glm.scale(self.position, glm.vec3(scale))
         self.can_update = can_update
+        self.can_move = can_update  # Rotates in update, see Scene.moving_bvh
         self.can_render = True
         self.has_shadow = True
+        self.has_wind = False
+        self.cutout = False
 
         self.albedo = glm.vec3(albedo)
         self.roughness = roughness
@@ -709,28 +1160,34 @@ class Cube:
         self.shadow_vao = this_object.shadow_vao
         self.shader_program = this_object.shader_program
         self.shadow_program = this_object.shadow_program
+        self.uniforms = app.shader.get_uniforms(self.shader_program)
+        self.shadow_uniforms = app.shader.get_uniforms(self.shadow_program)
 
         self.tex_id = app.texture.get_texture(path=f'../textures/{texture}.png')
         self.m_model = self.position
+        # World space AABB, a row of Scene.bounds once the scene has stacked them
+        self.local_bounds = this_object.bounds
+        self.bounds = get_world_bounds(self.local_bounds, self.m_model)
 
     def update(self):
         self.m_model = glm.rotate(self.position, self.app.time, glm.vec3(0, 1, 0))
+        self.bounds[:] = get_world_bounds(self.local_bounds, self.m_model)
 
     def render(self):
         # Texture
-        self.shader_program['u_texture_0'] = self.tex_id
-        self.app.texture.textures[self.tex_id].use(location=self.tex_id)
+        self.uniforms['u_texture_0'] = self.tex_id
+        self.app.texture.use(self.tex_id)
         # Position
-        self.shader_program['m_model'].write(self.m_model)
+        self.uniforms['m_model'] = self.m_model
         # Material
-        self.shader_program['material.a'].value = self.albedo
-        self.shader_program['material.d'].value = self.roughness
-        self.shader_program['material.s'].value = self.metallic
+        self.uniforms['material.a'] = self.albedo
+        self.uniforms['material.d'] = self.roughness
+        self.uniforms['material.s'] = self.metallic
         # Render
         self.vao.render()
 
     def render_shadow(self):
-        self.shadow_program['m_model'].write(self.m_model)
+        self.shadow_uniforms['m_model'] = self.m_model
         self.shadow_vao.render()
 
 
@@ -740,6 +1197,7 @@ class Floor(Cube):
                  can_update=False):
         super().__init__(app, albedo, roughness, metallic, position,
                          scale, texture, name="floor", can_update=can_update)
+        self.can_move = False
 
     def update(self):
         self.m_model = self.position
@@ -756,37 +1214,103 @@ class LightSource:
         this_object = self.app.prototype.get_object(name)
         self.vao = this_object.vao
         self.light_program = this_object.light_program
+        self.light_uniforms = app.shader.get_uniforms(self.light_program)
 
     def render(self):
         self.m_model = glm.mat4(glm.translate(mat_4, self.light_source.position))
         self.m_model = glm.scale(self.m_model, glm.vec3(self.scale))
         # Position
-        self.light_program['m_model'].write(self.m_model)
-        self.light_program['light.color'].value = self.light_source.color
+        self.light_uniforms['m_model'] = self.m_model
+        self.light_uniforms['light.color'] = self.light_source.color
         # Render
         self.vao.render()
 
 
+class ProceduralHeightMap:
+    '''Endless height source from fBm value noise, in place of a height map image.
+
+    Heights only depend on the seed and the sample position, so any tile can be generated on its own
+    and neighbouring tiles match.'''
+
+    def __init__(self, seed=0, octaves=6, frequency=1 / 128, persistence=0.5, lacunarity=2.0):
+        self.seed = seed
+        self.octaves = octaves
+        self.frequency = frequency  # Noise cells per height map sample for the first octave
+        self.persistence = persistence
+        self.lacunarity = lacunarity
+
+    def __repr__(self):
+        return (f"ProceduralHeightMap(seed={self.seed}, octaves={self.octaves}, frequency={self.frequency}, "
+                f"persistence={self.persistence}, lacunarity={self.lacunarity})")
+
+    def sample(self, x, z):
+        '''Return the heights in [0, 1] at arrays of sample positions.'''
+        return fbm_noise(numpy.asarray(x) * self.frequency, numpy.asarray(z) * self.frequency, self.seed,
+                         self.octaves, self.persistence, self.lacunarity)
+
+    def get_heights(self, offset, width, depth):
+        '''Return the heights in [0, 1] of depth rows of width samples from the sample offset (x, z).'''
+        x = offset[0] + numpy.arange(width)
+        z = offset[1] + numpy.arange(depth)
+        return self.sample(x[None, :], z[:, None])
+
+    def get_image_data(self, offset, width, depth):
+        '''Same layout and range as Texture.get_image_data, as floats so there are no 8-bit steps.'''
+        image = self.get_heights(offset, width, depth)[:, :, None] * 255
+        return image, width, depth
+
+
+class CachedTerrain:
+    '''Built arrays of a tile read back from the TerrainChunk cache, in place of a Terrain.'''
+
+    def __init__(self, vertex_data, index_data, vertices_mesh):
+        self.vertex_data = vertex_data
+        self.index_data = index_data
+        self.vertices_mesh = vertices_mesh
+
+
 class TerrainChunk:
+    cache_version = 3  # Bump when the built arrays change, old cache files are then never read
 
-    def __init__(self, app):
+    def __init__(self, app, tile_size=64, view_radius=2, workers=2, upload_budget=8 * 1024 * 1024,
+                 cache_path='cache'):
         self.app = app
         self.ctx = app.ctx
         self.chunks = []
         self.chunks_count = -1
         self.chunks_map = {}
+        self.height_source = None  # ProceduralHeightMap streaming an endless terrain instead of height_map
+        # Streaming: tile_size quads per side, tiles within view_radius tiles of the camera are resident
+        self.tile_size = tile_size
+        self.view_radius = view_radius
+        self.upload_budget = upload_budget  # Bytes uploaded to the GPU per frame
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.building = {}  # (tile_x, tile_z): Future of Terrain
+        self.tiles = {}  # (tile_x, tile_z): [Ground, Grass]
+        self.height_map = None
+        self.ground_lod = None  # GroundLOD drawing the ground of the whole height map, tiles then only carry grass
+        self.ground_gpu = None  # PrototypeGroundGPU shared by the ground of every tile, displaced on the GPU
+        # Built tiles are kept in cache_path as .npy files and memory mapped on later runs, None turns this off
+        self.cache_path = None if cache_path is None else f'{app.base_path}/{cache_path}'
+        self.cache_key = None  # Hash of the height map, grass density map and tile settings
+        self.base_height = None  # Height of the center sample plus one, taken off every height like in Terrain
 
     def add_chunk(self, app, name: int, position=(0, 0, 0), width=40, depth=40, max_height=100.0,
-                  height_map_path="height_map", scale=1.0, rounding_factor=6):
-        # Note this is still an old method where I'm loading a file and creating the terrain from it,
-        # which isn't that useful for a chunked terrain system -- this needs to be moved to the scene builder
-        # where we can chunk up the map area and create each chunk ready to go in the scene objects.
+                  height_map_path="height_map", scale=1.0, rounding_factor=6, indexed=False,
+                  height_source=None, offset=(0, 0)):
+        # Single chunk built on the main thread, see stream for the tiled terrain
         if name in self.chunks_map:
             return self.chunks[self.chunks_map[name]]
 
-        terrain_chunk = Terrain(app=app, position=position, width=width, depth=depth,
-                                max_height=max_height, height_map_path=height_map_path,
-                                scale=scale, rounding_factor=rounding_factor)
+        if height_source is None:
+            terrain_chunk = Terrain(app=app, position=position, width=width, depth=depth,
+                                    max_height=max_height, height_map_path=height_map_path,
+                                    scale=scale, rounding_factor=rounding_factor, indexed=indexed, offset=offset)
+        else:
+            # Chunks from offset of the endless source line up, its sample (0, 0) is under the camera
+            terrain_chunk = self.build_procedural_terrain(height_source, offset, width, depth, max_height=max_height,
+                                                          scale=scale, rounding_factor=rounding_factor,
+                                                          indexed=indexed)
 
         self.chunks_count += 1
         self.chunks_map[name] = self.chunks_count
@@ -794,95 +1318,549 @@ class TerrainChunk:
         print(f"loaded terrain chunk: {name} at index: {self.chunks_count}")
         return terrain_chunk
 
+    def stream(self, app, max_height=100.0, height_map_path="height_map", scale=1.0, rounding_factor=6,
+               indexed=False, grass_density=10, grass_jitter=0.0, grass_density_map=None,
+               grass_slope_limit=None, grass_altitude=None, grass_budget=None, lod=False, gpu=False,
+               height_source=None):
+        '''Split a height map into tiles that update builds and releases around the camera.
+
+        The ground is drawn by one TerrainLOD with lod, which takes precedence over gpu, a shared grid displaced
+        per tile, and is built into every tile with neither.
+        With a height_source, such as ProceduralHeightMap, the tiles are generated without end instead.'''
+        if height_source is not None:
+            # LOD, GPU ground and density maps are laid over a whole height map image
+            if lod or gpu or grass_density_map is not None:
+                raise ValueError("an endless height source can not be used with lod, gpu or grass_density_map")
+            self.height_source = height_source
+            # Source sample (0, 0) is placed under the camera, tiles are not bounded
+            self.center = (0, 0)
+            self.tiles_w = self.tiles_d = None
+        else:
+            terrain_image_path = f'../textures/{height_map_path}.png'
+            self.height_map = self.load_image_data(terrain_image_path)
+            _, height_map_w, height_map_d = self.height_map
+            # Load the grass density map once, tiles are built on the worker pool
+            if isinstance(grass_density_map, str):
+                grass_density_map = self.load_image_data(f'../textures/{grass_density_map}.png')
+            # Middle of the height map is placed under the camera
+            self.center = (height_map_w // 2, height_map_d // 2)
+            # Neighbouring tiles share their edge samples
+            self.tiles_w = math.ceil((height_map_w - 1) / self.tile_size)
+            self.tiles_d = math.ceil((height_map_d - 1) / self.tile_size)
+        # Same placement as Terrain, the center sample sits one unit under the camera
+        if height_source is not None:
+            center_height = float(height_source.sample(*self.center)) * 255
+        else:
+            center_height = self.height_map[0][self.center[1]][self.center[0]][0]
+        self.base_height = round(center_height / 255 * max_height, rounding_factor) + 1
+        self.tile_settings = {"max_height": max_height, "scale": scale,
+                              "rounding_factor": rounding_factor, "indexed": indexed,
+                              "grass_density": grass_density, "grass_jitter": grass_jitter,
+                              "grass_density_map": grass_density_map, "grass_slope_limit": grass_slope_limit,
+                              "grass_altitude": grass_altitude, "grass_budget": grass_budget,
+                              "build_ground": not (lod or gpu)}
+        if self.cache_path is not None:
+            # Tile keys add the tile to this, so any change to the maps or settings misses the cache
+            settings = dict(self.tile_settings, grass_density_map=None)
+            key = hashlib.sha1(repr((self.cache_version, self.tile_size, self.center, settings)).encode())
+            if height_source is not None:
+                key.update(repr(height_source).encode())
+            else:
+                key.update(self.height_map[0].tobytes())
+            if grass_density_map is not None:
+                key.update(grass_density_map[0].tobytes())
+            self.cache_key = key.hexdigest()
+        if lod:
+            self.ground_lod = GroundLOD(app, TerrainLOD(self.height_map, self.center, max_height=max_height,
+                                                        scale=scale, rounding_factor=rounding_factor))
+        elif gpu:
+            self.ground_gpu = PrototypeGroundGPU(app, terrain_image_path, self.height_map, self.tile_size,
+                                                 self.center, max_height=max_height, scale=scale,
+                                                 rounding_factor=rounding_factor)
+        if height_source is not None:
+            print(f"streaming terrain: endless tiles of {self.tile_size} from {height_source}")
+        else:
+            print(f"streaming terrain: {self.tiles_w}x{self.tiles_d} tiles of {self.tile_size}")
+
+    def build_tile(self, tile):
+        '''Build the CPU side of a tile, runs on the worker pool.'''
+        if self.cache_key is not None:
+            tile_path = f'{self.cache_path}/{self.cache_key[:16]}_{tile[0]}_{tile[1]}'
+            cached = self.load_cached_tile(tile_path)
+            if cached is not None:
+                return cached
+        offset = (tile[0] * self.tile_size, tile[1] * self.tile_size)
+        if self.height_source is not None:
+            terrain = self.build_procedural_terrain(self.height_source, offset, self.tile_size + 1,
+                                                    self.tile_size + 1, **self.tile_settings)
+        else:
+            terrain = Terrain(app=self.app, width=self.tile_size + 1, depth=self.tile_size + 1,
+                              height_map=self.height_map, center=self.center, offset=offset, **self.tile_settings)
+        if self.cache_key is not None:
+            self.save_cached_tile(tile_path, terrain)
+        return terrain
+
+    def build_procedural_terrain(self, height_source, offset, width, depth, max_height=100.0, rounding_factor=6,
+                                 **settings):
+        '''Build a Terrain of the source samples from offset (x, z), with source sample (0, 0) under the camera.'''
+        # One extra sample around the terrain, so smooth normals match the neighbouring terrain
+        height_map = height_source.get_image_data((offset[0] - 1, offset[1] - 1), width + 2, depth + 2)
+        origin, _, _ = height_source.get_image_data((0, 0), 1, 1)
+        base_height = round(origin[0][0][0] / 255 * max_height, rounding_factor) + 1
+        # Offsets can be negative, wrap them for the grass seed
+        grass_seed = (offset[0] & 0xffffffff, offset[1] & 0xffffffff)
+        return Terrain(app=self.app, width=width, depth=depth, max_height=max_height,
+                       rounding_factor=rounding_factor, height_map=height_map, offset=(1, 1),
+                       center=(1 - offset[0], 1 - offset[1]), base_height=base_height, grass_seed=grass_seed,
+                       **settings)
+
+    def load_image_data(self, path):
+        '''Texture.get_image_data, memory mapped from the cache when the image file has not changed.'''
+        if self.cache_path is None:
+            return self.app.texture.get_image_data(path)
+        with open(path, 'rb') as f:
+            file_hash = hashlib.sha1(f.read()).hexdigest()[:16]
+        cache_file = f'{self.cache_path}/{file_hash}_image.npy'
+        if os.path.exists(cache_file):
+            image = numpy.load(cache_file, mmap_mode='r')
+            return image, image.shape[0], image.shape[1]
+        image, width, height = self.app.texture.get_image_data(path)
+        self.save_cached_array(cache_file, image)
+        return image, width, height
+
+    def load_cached_tile(self, tile_path):
+        # The grass array is written last, so a tile is complete once it exists
+        if not os.path.exists(f'{tile_path}_grass.npy'):
+            return None
+        arrays = []
+        for name in ('vertex', 'index', 'grass'):
+            path = f'{tile_path}_{name}.npy'
+            arrays.append(numpy.load(path, mmap_mode='r') if os.path.exists(path) else None)
+        return CachedTerrain(*arrays)
+
+    def save_cached_tile(self, tile_path, terrain):
+        if terrain.vertex_data is not None:
+            self.save_cached_array(f'{tile_path}_vertex.npy', terrain.vertex_data)
+        if terrain.index_data is not None:
+            self.save_cached_array(f'{tile_path}_index.npy', terrain.index_data)
+        self.save_cached_array(f'{tile_path}_grass.npy', terrain.vertices_mesh)
+
+    def save_cached_array(self, path, array):
+        # Write then rename, so a run stopped half way never leaves a broken file behind
+        os.makedirs(self.cache_path, exist_ok=True)
+        with open(f'{path}.tmp', 'wb') as f:
+            numpy.save(f, array)
+        os.replace(f'{path}.tmp', path)
+
+    def lookup_heights(self, x, z):
+        '''Heights of arrays of whole samples, past the edge of a height map the edge samples repeat.'''
+        max_height = self.tile_settings["max_height"]
+        if self.height_source is not None:
+            return self.height_source.sample(x, z) * max_height - self.base_height
+        image = self.height_map[0]
+        x = numpy.clip(x, 0, image.shape[1] - 1)
+        z = numpy.clip(z, 0, image.shape[0] - 1)
+        return image[z, x, 0] / 255 * max_height - self.base_height
+
+    def get_ground(self, x, z):
+        '''Return the ground heights and (..., 3) normals under world space x and z, floats or arrays.
+
+        Heights are bilinear between height map samples, so they do not depend on which tiles are loaded.'''
+        scale = self.tile_settings["scale"]
+        sample_x = numpy.asarray(x) / scale + self.center[0] - 0.5
+        sample_z = numpy.asarray(z) / scale + self.center[1] - 0.5
+        return bilinear_ground(self.lookup_heights, sample_x, sample_z, scale)
+
+    def get_height(self, x, z):
+        '''Return the ground heights under world space x and z, see get_ground.'''
+        return self.get_ground(x, z)[0]
+
+    def tile_distance(self, tile, camera_tile):
+        return math.hypot(tile[0] - camera_tile[0], tile[1] - camera_tile[1])
+
+    def update(self):
+        if self.height_map is None and self.height_source is None:
+            return
+        # Tile under the camera, in height map samples
+        scale = self.tile_settings["scale"]
+        sample_x = self.app.camera.position.x / scale + self.center[0] - 0.5
+        sample_z = self.app.camera.position.z / scale + self.center[1] - 0.5
+        camera_tile = (math.floor(sample_x / self.tile_size), math.floor(sample_z / self.tile_size))
+
+        # Evict tiles and cancel builds that left the radius; one extra tile avoids thrashing on the border
+        for tile in list(self.tiles):
+            if self.tile_distance(tile, camera_tile) > self.view_radius + 1:
+                self.release_tile(tile)
+        for tile in list(self.building):
+            if self.tile_distance(tile, camera_tile) > self.view_radius + 1:
+                self.building.pop(tile).cancel()
+
+        # Queue builds for tiles entering the radius
+        radius = math.ceil(self.view_radius)
+        tiles_x = range(camera_tile[0] - radius, camera_tile[0] + radius + 1)
+        tiles_z = range(camera_tile[1] - radius, camera_tile[1] + radius + 1)
+        if self.height_source is None:
+            # Only the tiles of the height map
+            tiles_x = range(max(tiles_x.start, 0), min(tiles_x.stop, self.tiles_w))
+            tiles_z = range(max(tiles_z.start, 0), min(tiles_z.stop, self.tiles_d))
+        for tile_z in tiles_z:
+            for tile_x in tiles_x:
+                tile = (tile_x, tile_z)
+                if tile in self.tiles or tile in self.building:
+                    continue
+                if self.tile_distance(tile, camera_tile) <= self.view_radius:
+                    self.building[tile] = self.pool.submit(self.build_tile, tile)
+
+        # Upload finished tiles, nearest first, until the frame budget is spent
+        uploaded = 0
+        ready = [tile for tile, future in self.building.items() if future.done()]
+        for tile in sorted(ready, key=lambda tile: self.tile_distance(tile, camera_tile)):
+            if uploaded >= self.upload_budget:
+                break
+            terrain = self.building.pop(tile).result()
+            uploaded += self.upload_tile(tile, terrain)
+
+    def upload_tile(self, tile, terrain):
+        '''Create the GPU buffers and scene objects of a built tile, returns the bytes uploaded.'''
+        objects = []
+        size = 0
+        if self.ground_gpu is not None:
+            # Nothing to upload, the tile only moves the shared grid
+            objects.append(GroundGPU(self.app, self.ground_gpu,
+                                     offset=(tile[0] * self.tile_size, tile[1] * self.tile_size)))
+        elif self.ground_lod is None:
+            objects.append(Ground(self.app, terrain_chunk=terrain, prototype=PrototypeGround(self.app)))
+            size += terrain.vertex_data.nbytes
+            if terrain.index_data is not None:
+                size += terrain.index_data.nbytes
+        # Steep or bare tiles can end up without any grass
+        if len(terrain.vertices_mesh):
+            size += terrain.vertices_mesh.nbytes
+            objects.append(Grass(self.app, terrain_chunk=terrain, prototype=PrototypeGrass(self.app)))
+        # Vertices are in world space, pos is only the tile center for visibility
+        scale = self.tile_settings["scale"]
+        tile_center = glm.vec3(((tile[0] + 0.5) * self.tile_size + 0.5 - self.center[0]) * scale, 0,
+                               ((tile[1] + 0.5) * self.tile_size + 0.5 - self.center[1]) * scale)
+        for obj in objects:
+            obj.pos = tile_center
+            self.app.scene.add_object(obj)
+        self.tiles[tile] = objects
+        print(f"loaded terrain tile: {tile} ({size / 1024 / 1024:.2f} MB, {len(terrain.vertices_mesh)} grass points)")
+        return size
+
+    def release_tile(self, tile):
+        for obj in self.tiles.pop(tile):
+            self.app.scene.remove_object(obj)
+            if obj.prototype is not self.ground_gpu:
+                obj.prototype.destroy()
+        print(f"released terrain tile: {tile}")
+
+    def destroy(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        for tile in list(self.tiles):
+            self.release_tile(tile)
+        if self.ground_lod is not None:
+            self.ground_lod.prototype.destroy()
+        if self.ground_gpu is not None:
+            self.ground_gpu.destroy()
+
 
 class Terrain:
 
     def __init__(self, app, position=(0, 0, 0), width=40, depth=40, max_height=100.0,
-                 height_map_path="height_map", scale=1.0, rounding_factor=6):
+                 height_map_path="height_map", scale=1.0, rounding_factor=6, indexed=False,
+                 height_map=None, offset=(0, 0), center=None, grass_density=10, grass_jitter=0.0,
+                 grass_density_map=None, grass_slope_limit=None, grass_altitude=None, grass_budget=None,
+                 build_ground=True, base_height=None, grass_seed=None):
         self.app = app
         self.ctx = app.ctx
         self.position = glm.mat4(glm.translate(glm.mat4(1), glm.vec3(position)))
         self.rounding_factor = rounding_factor
         self.max_height = max_height
+        # Indexed: one vertex per height sample with smooth normals, else six per quad with flat normals
+        self.indexed = indexed
+        # Without build_ground only the heights and grass are built, the ground is drawn by GroundLOD or GroundGPU
+        self.build_ground = build_ground
+        # Grass points per triangle edge, jitter breaks up the lattice in fractions of a lattice cell
+        self.grass_density = grass_density
+        self.grass_jitter = grass_jitter
+        # Grass distribution: density map covering the whole height map, steepest slope in degrees,
+        # (min, max) altitude in height map units and the most grass points this terrain may keep
+        if isinstance(grass_density_map, str):
+            grass_density_map = app.texture.get_image_data(f'../textures/{grass_density_map}.png')
+        self.grass_density_map = grass_density_map
+        self.grass_slope_limit = grass_slope_limit
+        self.grass_altitude = grass_altitude
+        self.grass_budget = grass_budget
 
         self.scale = scale
         self.half_scale = self.scale * 0.5
-        terrain_image_path = f'../textures/{height_map_path}.png'
-        self.height_map, self.height_map_w, self.height_map_d = app.texture.get_image_data(terrain_image_path)
-
+        # A height map already loaded by TerrainChunk can be shared between chunks
+        if height_map is None:
+            terrain_image_path = f'../textures/{height_map_path}.png'
+            height_map = app.texture.get_image_data(terrain_image_path)
+        self.height_map, self.height_map_w, self.height_map_d = height_map
+
+        # Offset is the first height map sample (x, z) used by this terrain
+        self.offset_x, self.offset_z = offset
         # Temporary limit for terrain size
-        if width != self.height_map_w and width <= self.height_map_w:
-            self.height_map_w = width
-        if depth != self. height_map_d and depth <= self.height_map_d:
-            self.height_map_d = depth
-        self.half_width = math.floor(self.height_map_w / 2 * self.scale)
-        self.half_depth = math.floor(self.height_map_d / 2 * self.scale)
-
-        # Get value at 0,0 i.e. half_width, half_depth; use this to place the terrain under the camera
-        self.base_height = self.lookup_height(self.half_width, self.half_depth) + 1
+        self.height_map_w = min(width, self.height_map_w - self.offset_x)
+        self.height_map_d = min(depth, self.height_map_d - self.offset_z)
+        # Center is the height map sample (x, z) placed under the camera, the middle of this terrain by default
+        if center is None:
+            center = (self.offset_x + math.floor(self.height_map_w / 2 * self.scale),
+                      self.offset_z + math.floor(self.height_map_d / 2 * self.scale))
+        self.half_width = center[0] - self.offset_x
+        self.half_depth = center[1] - self.offset_z
+
+        # Get value at 0,0 i.e. half_width, half_depth; use this to place the terrain under the camera.
+        # Height maps covering only part of the world pass it in, as the center can be outside of them
+        if base_height is None:
+            base_height = self.lookup_height(*center) + 1
+        self.base_height = base_height
+        # Grass is seeded by the chunk offset unless the height map is only this chunk's part of the world
+        self.grass_seed = grass_seed or (self.offset_x, self.offset_z)
         self.vertices = self.get_vertices(self.height_map_w, self.height_map_d, self.max_height,
-                                          self.base_height, self.height_map,
+                                          self.base_height, self.height_map[self.offset_z:, self.offset_x:],
                                           self.half_width, self.half_depth, self.rounding_factor)
         self.vertex_data = self.generate_vertex_data(self.vertices)
 
+    def get_edge_normals(self):
+        '''Smooth normals including the samples around this terrain, so neighbouring chunks match.'''
+        x0, z0 = max(self.offset_x - 1, 0), max(self.offset_z - 1, 0)
+        x1 = min(self.offset_x + self.height_map_w + 1, self.height_map.shape[1])
+        z1 = min(self.offset_z + self.height_map_d + 1, self.height_map.shape[0])
+        heights = get_terrain_heights(self.height_map[z0:, x0:], x1 - x0, z1 - z0, self.max_height,
+                                      self.base_height, self.rounding_factor)
+        grid = get_terrain_grid(heights, self.scale, (self.half_width + self.offset_x - x0) * self.scale,
+                                (self.half_depth + self.offset_z - z0) * self.scale)
+        normals = get_smooth_normals(grid)
+        return normals[self.offset_z - z0:][:self.height_map_d, self.offset_x - x0:][:, :self.height_map_w]
+
+    def distribute_grass(self, points, normals):
+        '''Keep the (count, points, 3) grass seeds allowed by slope, altitude, density and budget, as (n, 3).'''
+        keep = numpy.ones(points.shape[:2], dtype=bool)
+        if self.grass_slope_limit is not None:
+            # Triangle normals are unit length, so y is the cosine of the slope
+            keep &= (normals[:, 1] >= math.cos(math.radians(self.grass_slope_limit)))[:, None]
+        if self.grass_altitude is not None:
+            altitude = points[:, :, 1] + self.base_height
+            keep &= (altitude >= self.grass_altitude[0]) & (altitude <= self.grass_altitude[1])
+        if keep.all():
+            points = points.reshape(-1, 3)
+        else:
+            points = points[keep]
+        # A different stream than the jitter, seeded by the chunk offset too
+        rng = numpy.random.default_rng((*self.grass_seed, 1))
+        if self.grass_density_map is not None:
+            points = points[rng.random(len(points)) < self.lookup_grass_density(points)]
+        if self.grass_budget is not None and len(points) > self.grass_budget:
+            # Thin out evenly, keeping the row by row order
+            points = points[numpy.sort(rng.choice(len(points), self.grass_budget, replace=False))]
+        return points
+
+    def lookup_grass_density(self, points):
+        '''Grass density in [0, 1] under (n, 3) points, the density map is stretched over the whole height map.'''
+        density_map, _, _ = self.grass_density_map
+        # World position back to a height map sample, then to a density map texel
+        sample_x = points[:, 0] / self.scale + self.half_width - 0.5 + self.offset_x
+        sample_z = points[:, 2] / self.scale + self.half_depth - 0.5 + self.offset_z
+        texel_x = numpy.rint(sample_x / (self.height_map.shape[1] - 1) * (density_map.shape[1] - 1)).astype(int)
+        texel_z = numpy.rint(sample_z / (self.height_map.shape[0] - 1) * (density_map.shape[0] - 1)).astype(int)
+        texel_x = numpy.clip(texel_x, 0, density_map.shape[1] - 1)
+        texel_z = numpy.clip(texel_z, 0, density_map.shape[0] - 1)
+        return density_map[texel_z, texel_x, 0] / 255
+
     def lookup_height(self, x, z):
         height = round(self.height_map[z][x][0] / 255 * self.max_height, self.rounding_factor)
         return height
 
+    def lookup_heights(self, x, z):
+        '''Heights of arrays of whole samples of this terrain, its edge samples repeat past it.'''
+        depth, width = self.heights.shape
+        return self.heights[numpy.clip(z, 0, depth - 1), numpy.clip(x, 0, width - 1)]
+
+    def get_ground(self, x, z):
+        '''Return the ground heights and (..., 3) normals under world space x and z, floats or arrays.'''
+        sample_x = numpy.asarray(x) / self.scale + self.half_width - 0.5
+        sample_z = numpy.asarray(z) / self.scale + self.half_depth - 0.5
+        return bilinear_ground(self.lookup_heights, sample_x, sample_z, self.scale)
+
+    def get_height(self, x, z):
+        '''Return the ground heights under world space x and z, see get_ground.'''
+        return self.get_ground(x, z)[0]
+
     def get_vertices(self, height_map_w: int, height_map_d: int, max_h: float, offset_h: int,
-                     height_map: list, half_width: int, half_depth: int, r_factor=5):
-        vertices = []
-        offset_w = half_width * self.scale
-        offset_d = half_depth * self.scale
-        for z in range(1, height_map_d):
-            for x in range(1, height_map_w):
-                y1 = round((height_map[z][x-1][0] / 255) * max_h - offset_h, r_factor)
-                y2 = round((height_map[z][x][0] / 255) * max_h - offset_h, r_factor)
-                y3 = round((height_map[z-1][x][0] / 255) * max_h - offset_h, r_factor)
-                y4 = round((height_map[z-1][x-1][0] / 255) * max_h - offset_h, r_factor)
-                x_pos = x * self.scale
-                z_pos = z * self.scale
-                vertices.append((x_pos-self.half_scale-offset_w, y1, z_pos+self.half_scale-offset_d))
-                vertices.append((x_pos+self.half_scale-offset_w, y2, z_pos+self.half_scale-offset_d))
-                vertices.append((x_pos+self.half_scale-offset_w, y3, z_pos-self.half_scale-offset_d))
-                vertices.append((x_pos-self.half_scale-offset_w, y4, z_pos-self.half_scale-offset_d))
-        return vertices
+                     height_map: numpy.ndarray, half_width: int, half_depth: int, r_factor=5):
+        self.heights = get_terrain_heights(height_map, height_map_w, height_map_d, max_h, offset_h, r_factor)
+        return get_terrain_quads(self.heights, self.scale, half_width * self.scale, half_depth * self.scale)
 
     def generate_vertex_data(self, vertices):
-        grass_density = 10
-        grass_vertices = []
-        indices = []
-        texture_coords = []
-        texture_indices = []
-        normals = []
-        for i in range(0, len(vertices) - 1, 4):
-            v1 = vertices[i]
-            v2 = vertices[i + 1]
-            v3 = vertices[i + 2]
-            v4 = vertices[i + 3]
-            indices.append((i, i + 2, i + 3))  # Triangle 1
-            indices.append((i, i + 1, i + 2))  # Triangle 2
-            texture_coords.extend(self.app.texture.random_quad())
-            texture_indices.append((0, 2, 3))
-            texture_indices.append((0, 1, 2))
-            # Normals of the terrain triangles
-            normal_1 = glm.normalize(glm.cross(delta_ab(v1, v3), delta_ab(v1, v4)))
-            new_normals = [[normal_1] * 3]
-            normal_2 = glm.normalize(glm.cross(delta_ab(v1, v2), delta_ab(v1, v3)))
-            new_normals.extend([[normal_2] * 3])
-            normals.append(new_normals)
-            # Add grass blade points along each triangle of this piece
-            grass_vertices.append(uniform_points_in_3d_triangle(v1, v2, v3, grass_density))
-            grass_vertices.append(uniform_points_in_3d_triangle(v1, v3, v4, grass_density))
-        self.vertices_mesh = numpy.array(grass_vertices, dtype='f4')
+        # Add grass blade points along both triangles (v1, v2, v3) and (v1, v3, v4) of every quad
+        p1 = numpy.repeat(vertices[:, 0], 2, axis=0)
+        p2 = vertices[:, [1, 2]].reshape(-1, 3)
+        p3 = vertices[:, [2, 3]].reshape(-1, 3)
+        # Seeded by the chunk offset so a chunk always grows the same grass
+        points = uniform_points_in_3d_triangles(p1, p2, p3, self.grass_density, self.grass_jitter,
+                                                seed=self.grass_seed)
+        points = self.distribute_grass(points, get_flat_normals(p1, p2, p3))
+        # The random shape of each blade is drawn once here, not from noise in the shaders every frame
+        self.vertices_mesh = get_grass_blades(points, seed=(*self.grass_seed, 2))
 
         # Pack vertex data
-        texture_coord_data = generate_vertex_data(texture_coords, texture_indices)
-        vertex_data = generate_vertex_data(vertices, indices)
-        vertex_data = numpy.hstack([texture_coord_data, vertex_data])
-        normals = numpy.array(normals, dtype='f4').reshape(int(len(normals * 6)), 3)
-        vertex_data = numpy.hstack([vertex_data, normals])
-        return numpy.array(vertex_data, dtype='f4')
+        if not self.build_ground:
+            self.index_data = None
+            return None
+        if self.indexed:
+            grid = get_terrain_grid(self.heights, self.scale,
+                                    self.half_width * self.scale, self.half_depth * self.scale)
+            vertex_data, self.index_data = generate_terrain_indexed_data(grid, self.get_edge_normals())
+            return vertex_data
+        self.index_data = None
+        # Every quad shares the first random texture orientation, as the loop did
+        return generate_terrain_vertex_data(vertices, self.app.texture.random_quad())
+
+
+class TerrainLOD:
+    '''Quadtree of terrain patches for continuous distance-dependent level of detail (CDLOD).
+
+    Every patch has patch_size quads per side; a level l patch samples every 2^l height map samples.
+    Patches are picked each frame from the camera, and their odd vertices morph onto the even ones
+    near the end of a level's range, so a patch matches its coarser neighbour without popping.'''
+
+    def __init__(self, height_map, center, max_height=100.0, scale=1.0, rounding_factor=6,
+                 patch_size=16, lod_distance=32.0):
+        image, self.height_map_w, self.height_map_d = height_map
+        self.center = center
+        self.scale = scale
+        self.patch_size = patch_size  # A multiple of 4, so half size patches start on an even sample too
+        # Same placement as Terrain, the center sample sits one unit under the camera
+        base_height = round(image[center[1]][center[0]][0] / 255 * max_height, rounding_factor) + 1
+        self.heights = get_terrain_heights(image, self.height_map_w, self.height_map_d, max_height,
+                                           base_height, rounding_factor)
+
+        # Levels needed for the root patch to cover the whole height map
+        quads = max(self.height_map_w, self.height_map_d) - 1
+        self.levels = max(math.ceil(math.log2(quads / patch_size)), 0) + 1
+        self.root_size = patch_size * 2 ** (self.levels - 1)
+        self.min_heights, self.max_heights = self.get_height_bounds()
+        # Distance where the first level hands over to the next, doubling every level. A patch must fit
+        # within its level's range, else it can border a patch two levels coarser and open a crack
+        self.min_lod_distance = max(
+            math.sqrt(2 * (patch_size * 2 ** level * scale) ** 2 + (high - low).max() ** 2) / 2 ** level
+            for level, (low, high) in enumerate(zip(self.min_heights, self.max_heights)))
+        self.lod_distance = max(lod_distance, self.min_lod_distance)
+        print(f"terrain lod: {self.levels} levels of {patch_size} quad patches")
+
+    def get_height_bounds(self):
+        '''Min and max height of every patch of every level, from the finest level up.'''
+        # Pad to the root size by repeating the last sample, patches past the map edge are clamped to it
+        padded = numpy.pad(self.heights, ((0, self.root_size + 1 - self.height_map_d),
+                                          (0, self.root_size + 1 - self.height_map_w)), mode='edge')
+        corners = (padded[1:, :-1], padded[1:, 1:], padded[:-1, 1:], padded[:-1, :-1])
+        blocks = self.root_size // self.patch_size
+        low = numpy.minimum.reduce(corners).reshape(blocks, self.patch_size, blocks, self.patch_size).min(axis=(1, 3))
+        high = numpy.maximum.reduce(corners).reshape(blocks, self.patch_size, blocks, self.patch_size).max(axis=(1, 3))
+        min_heights, max_heights = [low], [high]
+        for _ in range(1, self.levels):
+            blocks //= 2
+            low = low.reshape(blocks, 2, blocks, 2).min(axis=(1, 3))
+            high = high.reshape(blocks, 2, blocks, 2).max(axis=(1, 3))
+            min_heights.append(low)
+            max_heights.append(high)
+        return min_heights, max_heights
+
+    def get_ranges(self, fov):
+        '''Distance covered by each level; a narrower field of view magnifies, so it pushes the levels out.'''
+        zoom = math.tan(math.radians(Camera.fov) / 2) / math.tan(math.radians(fov) / 2)
+        lod_distance = max(self.lod_distance * zoom, self.min_lod_distance)
+        return [lod_distance * 2 ** level for level in range(self.levels)]
+
+    def get_morph_range(self, ranges, level):
+        # Morph over the last third of the level's range
+        start = ranges[level - 1] if level > 0 else 0.0
+        return start + (ranges[level] - start) * 0.66, ranges[level]
+
+    def get_bounds(self, level, x, z):
+        '''World space AABB (min, max) of a patch.'''
+        size = self.patch_size * 2 ** level
+        sample_x, sample_z = x * size, z * size
+        low = glm.vec3((sample_x - self.center[0] + 0.5) * self.scale, self.min_heights[level][z][x],
+                       (sample_z - self.center[1] + 0.5) * self.scale)
+        high = glm.vec3((min(sample_x + size, self.height_map_w - 1) - self.center[0] + 0.5) * self.scale,
+                        self.max_heights[level][z][x],
+                        (min(sample_z + size, self.height_map_d - 1) - self.center[1] + 0.5) * self.scale)
+        return low, high
+
+    def select(self, position, forward, fov, aspect_ratio, far):
+        '''Return the (level, x, z, quads) patches to draw for a camera, and the range of every level.
+
+        x and z count patches of quads quads at that level, quads is patch_size or half of it.'''
+        ranges = self.get_ranges(fov)
+        # Half angle of the view cone around the frustum corners
+        half_fov = math.atan(math.tan(math.radians(fov) / 2) * math.sqrt(1 + aspect_ratio ** 2))
+        patches = []
+        self.select_patch(self.levels - 1, 0, 0, glm.vec3(position), glm.vec3(forward), half_fov, far,
+                          ranges, patches)
+        return patches, ranges
+
+    def select_patch(self, level, x, z, position, forward, half_fov, far, ranges, patches):
+        low, high = self.get_bounds(level, x, z)
+        if low.x >= high.x or low.z >= high.z:
+            return True  # Past the edge of the height map
+        distance = glm.distance(position, glm.clamp(position, low, high))
+        if distance > far or not self.in_view(low, high, position, forward, half_fov):
+            return True
+        if distance > ranges[level]:
+            return False  # The parent draws this area
+        if level == 0 or distance > ranges[level - 1]:
+            patches.append((level, x, z, self.patch_size))
+            return True
+        for child_z in (z * 2, z * 2 + 1):
+            for child_x in (x * 2, x * 2 + 1):
+                if not self.select_patch(level - 1, child_x, child_z, position, forward, half_fov, far,
+                                         ranges, patches):
+                    # Out of the child's range, so this level draws that quarter with a half size patch
+                    patches.append((level, child_x, child_z, self.patch_size // 2))
+        return True
+
+    def in_view(self, low, high, position, forward, half_fov):
+        # Bounding sphere against the view cone
+        center = (low + high) * 0.5
+        radius = glm.distance(low, high) * 0.5
+        to_center = center - position
+        distance = glm.length(to_center)
+        if distance <= radius:
+            return True
+        angle = math.acos(max(-1.0, min(1.0, glm.dot(to_center / distance, forward))))
+        return angle - math.asin(radius / distance) <= half_fov
+
+    def get_patch_data(self, level, x, z, quads):
+        '''Interleaved 3f 3f 3f position, normal and morph offset of a patch, in world space.'''
+        stride = 2 ** level
+        steps = numpy.arange(quads + 1)
+        sample_x = numpy.minimum((x * quads + steps) * stride, self.height_map_w - 1)
+        sample_z = numpy.minimum((z * quads + steps) * stride, self.height_map_d - 1)
+        positions = numpy.empty((len(steps), len(steps), 3))
+        positions[:, :, 0] = (sample_x - self.center[0] + 0.5) * self.scale
+        positions[:, :, 1] = self.heights[sample_z[:, None], sample_x]
+        positions[:, :, 2] = ((sample_z - self.center[1] + 0.5) * self.scale)[:, None]
+
+        # Normals from the full resolution heights, so shading does not change between levels
+        left, right = numpy.maximum(sample_x - 1, 0), numpy.minimum(sample_x + 1, self.height_map_w - 1)
+        back, front = numpy.maximum(sample_z - 1, 0), numpy.minimum(sample_z + 1, self.height_map_d - 1)
+        normals = numpy.empty_like(positions)
+        normals[:, :, 0] = -(self.heights[sample_z[:, None], right] - self.heights[sample_z[:, None], left]) \
+            / ((right - left) * self.scale)
+        normals[:, :, 1] = 1.0
+        normals[:, :, 2] = -(self.heights[front[:, None], sample_x] - self.heights[back[:, None], sample_x]) \
+            / ((front - back) * self.scale)[:, None]
+        normals /= numpy.linalg.norm(normals, axis=2, keepdims=True)
+
+        # Odd vertices morph onto their even neighbour, giving the next level's grid (patches start on even samples)
+        even = steps - steps % 2
+        morph = positions[even[:, None], even] - positions
+        return numpy.concatenate([positions, normals, morph], axis=2).reshape(-1, 9).astype('f4')
 
 
 class PrototypeGround():
@@ -894,184 +1872,577 @@ class PrototypeGround():
 
     def build(self, terrain_chunk: int = None):
         self.terrain_chunk = terrain_chunk
-        self.vbo = self.get_vbo()
+        self.vbo, self.position_vbo = self.get_vbos()
+        self.ibo = self.get_ibo()
         self.vao = self.get_vao()
         self.shadow_vao = self.get_shadow_vao()
 
     def destroy(self):
-        self.shader_program.release()
+        # Shader programs are shared and released by Shader.destroy
         self.vao.release()
         self.shadow_vao.release()
         self.vbo.release()
+        self.position_vbo.release()
+        if self.ibo is not None:
+            self.ibo.release()
 
     def get_vao(self):
         vao = self.ctx.vertex_array(self.shader_program, [
-            (self.vbo, '2f 3f 3f', 'in_texcoord_0', 'in_position', 'in_normal'),
-        ])
+            (self.vbo, '2f 3f', 'in_texcoord_0', 'in_normal'),
+            (self.position_vbo, '3f', 'in_position'),
+        ], index_buffer=self.ibo, index_element_size=4)
         return vao
 
     def get_shadow_vao(self):
+        # The depth pass only fetches positions
         vao = self.ctx.vertex_array(self.shadow_program, [
-            (self.vbo, '2f 3f 3f', 'in_texcoord_0', 'in_position', 'in_normal'),
-        ], skip_errors=True)
-        # Temporary fix for the issue with the shadow program because we are not using texture coordinates
-        # So we set skip_errors=True to ignore the missing in_texcoord_0 attribute
+            (self.position_vbo, '3f', 'in_position'),
+        ], index_buffer=self.ibo, index_element_size=4)
         return vao
 
-    def get_vbo(self):
-        return self.ctx.buffer(self.terrain_chunk.vertex_data)
+    def get_vbos(self):
+        # Positions get a buffer of their own, so the depth pass reads nothing it does not use
+        vertex_data = self.terrain_chunk.vertex_data
+        vbo = self.ctx.buffer(numpy.ascontiguousarray(vertex_data[:, [0, 1, 5, 6, 7]]))
+        return vbo, self.ctx.buffer(numpy.ascontiguousarray(vertex_data[:, 2:5]))
+
+    def get_ibo(self):
+        # Only indexed terrain shares vertices between triangles
+        if self.terrain_chunk.index_data is None:
+            return None
+        return self.ctx.buffer(self.terrain_chunk.index_data)
 
     def render_shadow(self):
-        self.shadow_program['m_model'].write(self.position)
+        self.app.shader.get_uniforms(self.shadow_program)['m_model'] = self.position
         self.shadow_vao.render(moderngl.TRIANGLES)
 
 
 class Ground():
     def __init__(self, app, position=(0, 0, 0), texture: str = 'dirt',
                  terrain_chunk: Terrain = None,
-                 albedo=(1.0, 1.0, 1.0), roughness=0.75, metallic=0.25):
+                 albedo=(1.0, 1.0, 1.0), roughness=0.75, metallic=0.25,
+                 prototype: PrototypeGround = None):
         self.app = app
         self.ctx = app.ctx
         self.terrain_chunk = terrain_chunk
         self.pos = glm.vec3(position)
         self.position = glm.mat4(glm.translate(glm.mat4(1), glm.vec3(position)))
         self.m_model = self.position
-        self.can_update = True
+        self.can_update = False  # Camera matrices come from the UniformBuffer
+        self.can_move = False
         self.can_render = True
         self.has_shadow = False  # Not sure if this is rendering completely correctly -- return to this.
+        self.cutout = False
 
         self.albedo = glm.vec3(albedo)
         self.roughness = roughness
         self.metallic = metallic
 
-        this_object = self.app.prototype.get_object("ground")
+        # Streamed tiles own their prototype so its buffers can be released with the tile
+        this_object = prototype or self.app.prototype.get_object("ground")
         this_object.build(terrain_chunk)
+        self.prototype = this_object
         self.vao = this_object.vao
+        self.shadow_vao = this_object.shadow_vao
         self.shader_program = this_object.shader_program
+        self.shadow_program = this_object.shadow_program
+        self.uniforms = app.shader.get_uniforms(self.shader_program)
+        self.shadow_uniforms = app.shader.get_uniforms(self.shadow_program)
 
         self.tex_id = app.texture.get_texture(path=f'../textures/{texture}.png')
-
-    def update(self):
-        self.shader_program['m_view'].write(self.app.camera.m_view)
+        self.bounds = get_world_bounds(get_vertex_bounds(terrain_chunk.vertex_data[:, 2:5]), self.m_model)
 
     def render(self):
         # Texture
-        self.shader_program['u_texture_0'] = self.tex_id
-        self.app.texture.textures[self.tex_id].use(location=self.tex_id)
+        self.uniforms['u_texture_0'] = self.tex_id
+        self.app.texture.use(self.tex_id)
 
         # Position
-        self.shader_program['m_model'].write(self.m_model)
+        self.uniforms['m_model'] = self.m_model
 
         # Material
-        self.shader_program['material.a'].value = self.albedo
-        self.shader_program['material.d'].value = self.roughness
-        self.shader_program['material.s'].value = self.metallic
+        self.uniforms['material.a'] = self.albedo
+        self.uniforms['material.d'] = self.roughness
+        self.uniforms['material.s'] = self.metallic
 
         self.vao.render(moderngl.TRIANGLES)
 
     def render_shadow(self):
-        self.shadow_program['m_model'].write(self.position)
+        self.shadow_uniforms['m_model'] = self.position
         self.shadow_vao.render(moderngl.TRIANGLES)
 
 
+class PrototypeGroundLOD:
+    def __init__(self, app, terrain_lod: TerrainLOD, cache_size=512):
+        self.app = app
+        self.ctx = app.ctx
+        self.terrain_lod = terrain_lod
+        self.shader_program = app.shader.get_shader('ground_lod', fragment_name='ground')
+        # Every full and half size patch has the same grid, so they share one index buffer each
+        self.ibos = {}
+        for quads in (terrain_lod.patch_size, terrain_lod.patch_size // 2):
+            self.ibos[quads] = self.ctx.buffer(get_terrain_indices(quads + 1, quads + 1))
+        # Patches built so far, least recently drawn first
+        self.cache_size = cache_size
+        self.patches = {}  # (level, x, z, quads): (vbo, vao)
+
+    def get_vao(self, patch):
+        if patch in self.patches:
+            # Move to the back of the least recently drawn order
+            self.patches[patch] = self.patches.pop(patch)
+            return self.patches[patch][1]
+        vbo = self.ctx.buffer(self.terrain_lod.get_patch_data(*patch))
+        vao = self.ctx.vertex_array(self.shader_program, [
+            (vbo, '3f 3f 3f', 'in_position', 'in_normal', 'in_morph'),
+        ], index_buffer=self.ibos[patch[3]], index_element_size=4)
+        self.patches[patch] = (vbo, vao)
+        while len(self.patches) > self.cache_size:
+            old_patch = next(iter(self.patches))
+            for buffer in self.patches.pop(old_patch):
+                buffer.release()
+        return vao
+
+    def destroy(self):
+        # Shader programs are shared and released by Shader.destroy
+        for vbo, vao in self.patches.values():
+            vao.release()
+            vbo.release()
+        for ibo in self.ibos.values():
+            ibo.release()
+
+
+class GroundLOD():
+    def __init__(self, app, terrain_lod: TerrainLOD, texture: str = 'dirt',
+                 albedo=(1.0, 1.0, 1.0), roughness=0.75, metallic=0.25):
+        self.app = app
+        self.ctx = app.ctx
+        self.terrain_lod = terrain_lod
+        self.pos = glm.vec3(0)
+        self.m_model = glm.mat4(1)  # Patches are built in world space
+        self.can_update = True
+        self.can_move = False
+        self.can_render = True
+        self.has_shadow = False  # Same as Ground
+        self.cutout = False
+
+        self.albedo = glm.vec3(albedo)
+        self.roughness = roughness
+        self.metallic = metallic
+
+        self.prototype = PrototypeGroundLOD(app, terrain_lod)
+        self.shader_program = self.prototype.shader_program
+        self.vao = None  # One per patch, see PrototypeGroundLOD
+        self.uniforms = app.shader.get_uniforms(self.shader_program)
+        # Changes every patch, so written straight to the uniform
+        self.morph_uniform = self.uniforms.get_uniform('u_morph')
+        self.patches, self.ranges = [], []
+
+        self.tex_id = app.texture.get_texture(path=f'../textures/{texture}.png')
+        # Patches are culled in TerrainLOD.select, the scene only tests the whole height map
+        low, high = terrain_lod.get_bounds(terrain_lod.levels - 1, 0, 0)
+        self.bounds = numpy.array([low, high], dtype='f4')
+
+    def update(self):
+        camera = self.app.camera
+        # Any point in front of the camera, only used to sort the render queue
+        self.pos = camera.position + camera.forward
+        self.patches, self.ranges = self.terrain_lod.select(camera.position, camera.forward, camera.fov,
+                                                            camera.aspect_ratio, camera.far)
+
+    def render(self):
+        # Texture
+        self.uniforms['u_texture_0'] = self.tex_id
+        self.app.texture.use(self.tex_id)
+
+        # Position, texture repeats once per height map sample like Ground
+        self.uniforms['m_model'] = self.m_model
+        self.uniforms['u_texture_scale'] = 1 / self.terrain_lod.scale
+
+        # Material
+        self.uniforms['material.a'] = self.albedo
+        self.uniforms['material.d'] = self.roughness
+        self.uniforms['material.s'] = self.metallic
+
+        for patch in self.patches:
+            self.morph_uniform.value = self.terrain_lod.get_morph_range(self.ranges, patch[0])
+            self.prototype.get_vao(patch).render(moderngl.TRIANGLES)
+
+
+class PrototypeGroundGPU:
+    '''One flat grid of tile_size quads shared by every ground tile, displaced in ground_gpu.vert.
+
+    Heights and normals are read from the height map texture, so a tile costs no vertex data.'''
+
+    def __init__(self, app, height_map_path, height_map, tile_size, center, max_height=100.0, scale=1.0,
+                 rounding_factor=6):
+        self.app = app
+        self.ctx = app.ctx
+        self.shader_program = app.shader.get_shader('ground_gpu', fragment_name='ground')
+        image, _, _ = height_map
+        self.height_tex_id = app.texture.get_height_texture(height_map_path, image)
+        # Same placement as Terrain, the center sample sits one unit under the camera
+        base_height = round(image[center[1]][center[0]][0] / 255 * max_height, rounding_factor) + 1
+        self.tile_size = tile_size
+        self.center = center
+        self.scale = scale
+        # Heights as ground_gpu.vert reads them, for the tile bounds
+        self.heights = image[:, :, 0] / 255 * max_height - base_height
+
+        # Grid positions are in height map samples, the tile offset is added in the shader
+        steps = numpy.arange(tile_size + 1, dtype='f4')
+        grid = numpy.empty((tile_size + 1, tile_size + 1, 2), dtype='f4')
+        grid[:, :, 0] = steps
+        grid[:, :, 1] = steps[:, None]
+        self.vbo = self.ctx.buffer(grid)
+        self.ibo = self.ctx.buffer(get_terrain_indices(tile_size + 1, tile_size + 1))
+        self.vao = self.ctx.vertex_array(self.shader_program, [
+            (self.vbo, '2f', 'in_position'),
+        ], index_buffer=self.ibo, index_element_size=4)
+
+        # Shared by every tile
+        uniforms = app.shader.get_uniforms(self.shader_program)
+        uniforms['u_height_map'] = self.height_tex_id
+        uniforms['u_center'] = tuple(center)
+        uniforms['u_scale'] = float(scale)
+        uniforms['u_max_height'] = float(max_height)
+        uniforms['u_base_height'] = float(base_height)
+
+    def get_bounds(self, offset):
+        '''World space AABB (2, 3) of the tile starting at the height map sample offset (x, z).'''
+        # Samples past the edge of the height map repeat the last one, like the shader
+        heights = self.heights[min(offset[1], len(self.heights) - 1):offset[1] + self.tile_size + 1,
+                               min(offset[0], len(self.heights[0]) - 1):offset[0] + self.tile_size + 1]
+        low = (numpy.array(offset) - self.center + 0.5) * self.scale
+        high = low + self.tile_size * self.scale
+        return numpy.array([(low[0], heights.min(), low[1]), (high[0], heights.max(), high[1])], dtype='f4')
+
+    def destroy(self):
+        # Shader programs are shared and released by Shader.destroy
+        self.vao.release()
+        self.ibo.release()
+        self.vbo.release()
+
+
+class GroundGPU():
+    def __init__(self, app, prototype: PrototypeGroundGPU, offset=(0, 0), texture: str = 'dirt',
+                 albedo=(1.0, 1.0, 1.0), roughness=0.75, metallic=0.25):
+        self.app = app
+        self.ctx = app.ctx
+        self.pos = glm.vec3(0)
+        self.m_model = glm.mat4(1)  # The shader places the grid in world space
+        self.can_update = False
+        self.can_move = False
+        self.can_render = True
+        self.has_shadow = False  # Same as Ground
+        self.cutout = False
+
+        # First height map sample (x, z) of this tile
+        self.offset = offset
+        self.bounds = prototype.get_bounds(offset)
+
+        self.albedo = glm.vec3(albedo)
+        self.roughness = roughness
+        self.metallic = metallic
+
+        self.prototype = prototype
+        self.vao = prototype.vao
+        self.shader_program = prototype.shader_program
+        self.uniforms = app.shader.get_uniforms(self.shader_program)
+
+        self.tex_id = app.texture.get_texture(path=f'../textures/{texture}.png')
+
+    def render(self):
+        # Texture
+        self.uniforms['u_texture_0'] = self.tex_id
+        self.app.texture.use(self.tex_id)
+        self.app.texture.use(self.prototype.height_tex_id)
+
+        # Position
+        self.uniforms['m_model'] = self.m_model
+        self.uniforms['u_offset'] = self.offset
+
+        # Material
+        self.uniforms['material.a'] = self.albedo
+        self.uniforms['material.d'] = self.roughness
+        self.uniforms['material.s'] = self.metallic
+
+        self.vao.render(moderngl.TRIANGLES)
+
+
 class PrototypeGrass:
+    # Vertex count, instance count, first vertex and first instance of a blade list's indirect draw
+    draw_command = numpy.array([4, 0, 0, 0], dtype='u4').tobytes()
+
     def __init__(self, app):
         self.app = app
         self.ctx = app.ctx
-        self.shader_program = app.shader.get_shader('grass', geometry=True)
-        self.shadow_program = app.shader.get_shader("shadow")
+        self.shader_program = app.shader.get_shader('grass')
+        # Same blades with fewer quads, alpha tested into the depth map
+        self.shadow_program = app.shader.get_shader("grass_shadow", vertex_name="grass", defines=("SHADOW",))
+        self.cull_program = app.shader.get_compute_shader("grass_cull")
+        self.cull_uniforms = app.shader.get_uniforms(self.cull_program)
 
     def build(self, terrain_chunk: int = None):
         self.terrain_chunk = terrain_chunk
+        self.points = len(terrain_chunk.vertices_mesh)
+        # Grass points and their blades, see get_grass_blades, read by the shaders as a storage buffer
         self.vbo = self.get_vbo()
-        self.vao = self.get_vao()
-        self.shadow_vao = self.get_shadow_vao()
+        # Blade quads picked by cull for each pass, at most 3 per point in view and 2 in each shadow cascade
+        self.blade_vbo = self.ctx.buffer(reserve=self.points * 3 * 4)
+        cascades = range(self.app.shadow.cascades)
+        self.shadow_blade_vbos = [self.ctx.buffer(reserve=self.points * 2 * 4) for _ in cascades]
+        # Indirect draws of a 4 vertex strip per blade quad, their instance counts are written by cull
+        self.command = self.ctx.buffer(reserve=4 * 4)
+        self.shadow_commands = [self.ctx.buffer(reserve=4 * 4) for _ in cascades]
+        self.vao = self.get_vao(self.blade_vbo, self.shader_program)
+        self.shadow_vaos = [self.get_vao(blade_vbo, self.shadow_program) for blade_vbo in self.shadow_blade_vbos]
 
     def destroy(self):
-        self.shader_program.release()
+        # Shader programs are shared and released by Shader.destroy
         self.vao.release()
-        self.shadow_vao.release()
         self.vbo.release()
-
-    def get_vao(self):
-        vao = self.ctx.vertex_array(self.shader_program, [
-            (self.vbo, '3f', 'in_position'),
+        self.blade_vbo.release()
+        self.command.release()
+        for vao, blade_vbo, command in zip(self.shadow_vaos, self.shadow_blade_vbos, self.shadow_commands):
+            vao.release()
+            blade_vbo.release()
+            command.release()
+
+    def get_vao(self, blade_vbo, shader_program):
+        vao = self.ctx.vertex_array(shader_program, [
+            (blade_vbo, '1u/i', 'in_blade'),
         ])
         return vao
 
-    def get_shadow_vao(self):
-        vao = self.ctx.vertex_array(self.shadow_program, [
-            (self.vbo, '3f', 'in_position'),
-        ], skip_errors=True)
-        # Temporary fix for the issue with the shadow program because we are not using texture coordinates
-        # So we set skip_errors=True to ignore the missing in_texcoord_0 attribute
-        return vao
-
     def get_vbo(self):
         return self.ctx.buffer(self.terrain_chunk.vertices_mesh)
 
+    def cull(self, planes: bytes, cascade: int = None):
+        '''Pick the blades inside the planes and their levels of detail into the blade list of a pass, on the GPU.
+
+        The planes are the camera's for the view, or those of the cascade's light projection for its shadows.
+        Needs a memory barrier before the blades are drawn, see Scene.render.'''
+        if cascade is None:
+            blade_vbo, command = self.blade_vbo, self.command
+        else:
+            blade_vbo, command = self.shadow_blade_vbos[cascade], self.shadow_commands[cascade]
+        command.write(self.draw_command)
+        self.vbo.bind_to_storage_buffer(0)
+        blade_vbo.bind_to_storage_buffer(1)
+        command.bind_to_storage_buffer(2)
+        self.cull_uniforms['u_points'] = self.points
+        self.cull_uniforms['u_shadow'] = cascade is not None
+        self.cull_uniforms.get_uniform('u_planes').write(planes)
+        self.cull_program.run(group_x=(self.points + 63) // 64)
+
+    def render(self, cascade: int = None):
+        if cascade is None:
+            vao, command = self.vao, self.command
+        else:
+            vao, command = self.shadow_vaos[cascade], self.shadow_commands[cascade]
+        # The points are read by the vertex shaders too
+        self.vbo.bind_to_storage_buffer(0)
+        vao.render_indirect(command, moderngl.TRIANGLE_STRIP, count=1)
+
 
 class Grass:
     def __init__(self, app, position=(0, 0, 0), texture: str = 'grass_0',
-                 terrain_chunk: Terrain = None, albedo=(1.0, 1.0, 1.0), roughness=0.6, metallic=0.1):
+                 terrain_chunk: Terrain = None, albedo=(1.0, 1.0, 1.0), roughness=0.6, metallic=0.1,
+                 prototype: PrototypeGrass = None):
         self.app = app
         self.ctx = app.ctx
         self.pos = glm.vec3(position)
         self.position = glm.mat4(glm.translate(glm.mat4(1), glm.vec3(position)))
         self.m_model = self.position
         self.can_update = True
+        self.can_move = False
         self.can_render = True
-        self.has_shadow = False  # To correctly cast grass shadows from the billboards into the shadow map..
-        # We need to create a new shadow shader just for billboards, which uses a geom shader.
-        # I will add this soon.
+        self.has_shadow = True
+        self.has_wind = True  # The blades and their shadows move with u_time
+        self.cutout = True  # Alpha tested, drawn after the opaque objects
 
         self.albedo = glm.vec3(albedo)
         self.roughness = roughness
         self.metallic = metallic
 
-        this_object = self.app.prototype.get_object("grass")
+        this_object = prototype or self.app.prototype.get_object("grass")
         this_object.build(terrain_chunk)
+        self.prototype = this_object
         self.vao = this_object.vao
+        self.shadow_vao = this_object.shadow_vaos[0]  # Sorts the tile in the depth passes, see render_shadow
         self.shader_program = this_object.shader_program
+        self.shadow_program = this_object.shadow_program
+        self.uniforms = app.shader.get_uniforms(self.shader_program)
+        self.shadow_uniforms = app.shader.get_uniforms(self.shadow_program)
 
         self.tex_id = app.texture.get_alpha_texture(path=f'../textures/{texture}.png')
         self.tex_id_wind = app.texture.get_basic_texture(path=f'../textures/flow_map.png')
-
-        # Texture
-        self.shader_program['u_texture_0'] = self.tex_id
-        self.shader_program['u_wind'] = self.tex_id_wind
-        self.app.texture.textures[self.tex_id].use(location=self.tex_id)
-        self.app.texture.textures[self.tex_id_wind].use(location=self.tex_id_wind)
+        # Blades grow from their points in grass.vert, up to grass_scale (2.0) in any direction with the wind
+        self.bounds = get_vertex_bounds(terrain_chunk.vertices_mesh['position']) + ((-2, -2, -2), (2, 2, 2))
 
     def update(self):
-        self.shader_program['u_time'].value = self.app.time
+        # Every tile shares the programs, so only the first tile's write of the frame is sent
+        self.uniforms['u_time'] = self.app.time
+        self.shadow_uniforms['u_time'] = self.app.time
 
     def render(self):
         # Position
-        # self.shader_program['m_model'].write(self.m_model)
+        # self.uniforms['m_model'] = self.m_model
 
         # Material
-        self.shader_program['material.a'].value = self.albedo
-        self.shader_program['material.d'].value = self.roughness
-        self.shader_program['material.s'].value = self.metallic
+        self.uniforms['material.a'] = self.albedo
+        self.uniforms['material.d'] = self.roughness
+        self.uniforms['material.s'] = self.metallic
 
         # Texture
-        self.shader_program['u_texture_0'] = self.tex_id
-        self.shader_program['u_wind'] = self.tex_id_wind
-        self.app.texture.textures[self.tex_id].use(location=self.tex_id)
-        self.app.texture.textures[self.tex_id_wind].use(location=self.tex_id_wind)
+        self.uniforms['u_texture_0'] = self.tex_id
+        self.uniforms['u_wind'] = self.tex_id_wind
+        self.app.texture.use(self.tex_id)
+        self.app.texture.use(self.tex_id_wind)
+
+        self.prototype.render()
+
+    def render_shadow(self):
+        self.shadow_uniforms['u_texture_0'] = self.tex_id
+        self.shadow_uniforms['u_wind'] = self.tex_id_wind
+        self.app.texture.use(self.tex_id)
+        self.app.texture.use(self.tex_id_wind)
+        # Each cascade draws the blades picked inside its own light projection
+        self.prototype.render(cascade=self.app.shadow.cascade)
+
+
+class BoundingVolumeHierarchy:
+    '''Binary tree of AABBs over some rows of a bounds (n, 2, 3) array, split at the median of the longest axis.
+
+    Every node covers a contiguous range of the objects in tree order, so a refit is one reduce per level and
+    queries walk down one level at a time with NumPy, only opening the nodes that pass the test.'''
+    leaf_size = 4
+
+    def __init__(self, bounds, items):
+        self.bounds = bounds
+        self.order = numpy.array(items, dtype='i8')  # Object indices, in tree order after build
+        self.levels = []  # (starts, counts, first children, bounds) of the nodes of each level
+        self.build()
+
+    def build(self):
+        centers = self.bounds[self.order].sum(axis=1)  # Twice the centers, only compared
+        nodes = [(0, len(self.order))] if len(self.order) else []
+        while nodes:
+            first_child = numpy.full(len(nodes), -1)
+            children = []
+            for node, (start, count) in enumerate(nodes):
+                if count <= self.leaf_size:
+                    continue
+                axis = numpy.ptp(centers[start:start + count], axis=0).argmax()
+                half = count // 2
+                split = numpy.argpartition(centers[start:start + count, axis], half) + start
+                self.order[start:start + count] = self.order[split]
+                centers[start:start + count] = centers[split]
+                first_child[node] = len(children)
+                children += [(start, half), (start + half, count - half)]
+            starts, counts = numpy.array(nodes).T
+            self.levels.append((starts, counts, first_child, numpy.empty((len(nodes), 2, 3), dtype='f4')))
+            nodes = children
+        self.refit()
+
+    def refit(self):
+        '''Grow or shrink every node around the current bounds of its objects.'''
+        if not self.levels:
+            return
+        # Bounds in tree order, with a spare row so the end of the last node is a valid index
+        bounds = numpy.empty((len(self.order) + 1, 2, 3), dtype='f4')
+        bounds[:-1] = self.bounds[self.order]
+        for starts, counts, _, node_bounds in self.levels:
+            ranges = numpy.stack([starts, starts + counts], axis=1).ravel()
+            node_bounds[:, 0] = numpy.minimum.reduceat(bounds[:, 0], ranges)[::2]
+            node_bounds[:, 1] = numpy.maximum.reduceat(bounds[:, 1], ranges)[::2]
+
+    def query(self, test):
+        '''Indices of the objects whose bounds pass test, a function of bounds (n, 2, 3) to a bool mask.'''
+        items = []
+        nodes = numpy.arange(len(self.levels[0][0])) if self.levels else []
+        for starts, counts, first_child, node_bounds in self.levels:
+            if not len(nodes):
+                break
+            nodes = nodes[test(node_bounds[nodes])]
+            children = first_child[nodes]
+            leaves = nodes[children < 0]
+            # Positions in tree order of every object in the leaves, range by range
+            leaf_counts = counts[leaves]
+            offsets = numpy.repeat(starts[leaves] - numpy.cumsum(leaf_counts) + leaf_counts, leaf_counts)
+            items.append(self.order[offsets + numpy.arange(len(offsets))])
+            nodes = (children[children >= 0, None] + (0, 1)).ravel()
+        if not items:
+            return numpy.empty(0, dtype='i8')
+        # Leaves passed as a whole, test their objects on their own
+        items = numpy.concatenate(items)
+        return items[test(self.bounds[items])]
+
+
+class RenderQueue:
+    '''Draws of one frame, sorted by pass, shader program, texture and VAO, then front to back.
+
+    Runs of the same program, texture and material only send what changed through the UniformCache
+    and Texture.use, and drawing near objects first lets the depth test reject hidden fragments early.'''
+    opaque_pass = 0
+    cutout_pass = 1  # Alpha tested, after the opaque objects have filled the depth buffer
+    shadow_pass = 2  # Two passes per shadow cascade from here, opaque then alpha tested casters, see Shadow
 
-        self.vao.render(moderngl.POINTS)
+    def __init__(self, app):
+        self.app = app
+        self.clear()
+
+    def clear(self):
+        self.objects = []
+        self.keys = []
+        self.positions = []
+        self.order = []
+        self.passes = []
+
+    def submit(self, obj, render_pass):
+        if render_pass >= self.shadow_pass:
+            program, vao = obj.shadow_program, obj.shadow_vao
+        else:
+            program, vao = obj.shader_program, obj.vao
+        self.objects.append(obj)
+        self.keys.append((render_pass, program.glo, obj.tex_id, -1 if vao is None else vao.glo))
+        self.positions.append(obj.pos)
+
+    def sort(self):
+        if not self.objects:
+            return
+        keys = numpy.array(self.keys, dtype='i8')
+        depth = numpy.square(numpy.array(self.positions, dtype='f4') - self.app.camera.position).sum(axis=1)
+        # The last key is the primary one
+        self.order = numpy.lexsort((depth, keys[:, 3], keys[:, 2], keys[:, 1], keys[:, 0]))
+        self.passes = keys[self.order, 0]
+
+    def render(self, render_pass):
+        start, end = numpy.searchsorted(self.passes, (render_pass, render_pass + 1))
+        for index in self.order[start:end]:
+            if render_pass >= self.shadow_pass:
+                self.objects[index].render_shadow()
+            else:
+                self.objects[index].render()
 
 
 class Scene():
     objects = []
     update_list = []
     moved = True
+    bounds_changed = True
+    visible_objects = []
+    shadow_casters = []
+    shadow_cascades = []  # Tiles of the depth map to draw this frame, see Shadow.is_current
+    light_planes = []  # Frustum planes of each cascade's light projection, the grass shadows are culled to them
+    casters_version = 0  # Counts the moves of the moving objects
 
     def __init__(self, app):
         self.app = app
         self.ctx = app.ctx
+        self.render_queue = RenderQueue(app)
+        # GPU time of the grass shadows of each cascade
+        self.grass_shadow_queries = [self.ctx.query(time=True) for _ in range(self.app.shadow.cascades)]
 
         # Global Light
         self.app.global_light = DirectionalLight(position=(10, 10, -10),
@@ -1117,10 +2488,14 @@ class Scene():
         self.objects.append(Cube(app, position=(_g*3, 0, 0), texture="metal_1",
                                  albedo=(1.00, 0.71, 0.29), roughness=0.35, metallic=0.95))
 
-        # Terrain, Ground, and Grass
-        terrain_chunk_0 = self.app.terrain.add_chunk(self.app, name=0)
-        self.objects.append(Grass(self.app, terrain_chunk=terrain_chunk_0))
-        self.objects.append(Ground(self.app, terrain_chunk=terrain_chunk_0))
+        # Terrain, Ground, and Grass tiles are added by TerrainChunk.update around the camera
+        self.app.terrain.stream(self.app, indexed=self.app.indexed_terrain,
+                                grass_density_map=self.app.grass_density_map,
+                                grass_slope_limit=self.app.grass_slope_limit, grass_budget=self.app.grass_budget,
+                                lod=self.app.lod_terrain, gpu=self.app.gpu_terrain,
+                                height_source=self.app.height_source)
+        if self.app.terrain.ground_lod is not None:
+            self.objects.append(self.app.terrain.ground_lod)
 
         # Debug lights
         self.light_source_global = LightSource(app, light_source=self.app.global_light)
@@ -1133,49 +2508,145 @@ class Scene():
             if obj.can_update:
                 self.update_list.append(obj)
 
+    def add_object(self, obj):
+        self.objects.append(obj)
+        if obj.can_update:
+            self.update_list.append(obj)
+        self.bounds_changed = True
+
+    def remove_object(self, obj):
+        self.objects.remove(obj)
+        if obj in self.update_list:
+            self.update_list.remove(obj)
+        self.bounds_changed = True
+
+    def get_bounds(self):
+        '''Stack the bounds of every object into one (n, 2, 3) array, in the order of objects, and index them.'''
+        self.bounds = numpy.array([obj.bounds for obj in self.objects], dtype='f4').reshape(-1, 2, 3)
+        # Each object keeps a view of its row, so moving objects update the stacked bounds in place
+        for obj, bounds in zip(self.objects, self.bounds):
+            obj.bounds = bounds
+            obj.can_render = False
+        # Static objects are indexed once, the few moving ones get their own tree refit every frame
+        moving = [obj.can_move for obj in self.objects]
+        self.static_bvh = BoundingVolumeHierarchy(self.bounds, [i for i, can_move in enumerate(moving) if not can_move])
+        self.moving_bvh = BoundingVolumeHierarchy(self.bounds, [i for i, can_move in enumerate(moving) if can_move])
+        self.visible_objects = []
+        self.bounds_changed = False
+
+    def get_objects(self, test):
+        '''Objects whose bounds pass test, a function of bounds (n, 2, 3) to a bool mask.'''
+        items = numpy.concatenate([self.static_bvh.query(test), self.moving_bvh.query(test)])
+        return [self.objects[i] for i in items.tolist()]
+
+    def get_objects_in_frustum(self, planes):
+        return self.get_objects(lambda bounds: boxes_in_frustum(planes, bounds))
+
+    def get_objects_in_radius(self, position, radius):
+        return self.get_objects(lambda bounds: boxes_in_sphere(position, radius, bounds))
+
+    def get_grass_shadow_time(self):
+        '''Milliseconds the GPU spent on the grass shadows of the last frame, waits for them to finish.'''
+        if not self.app.show_global_light:
+            return 0.0
+        return sum(self.grass_shadow_queries[cascade].elapsed for cascade in self.shadow_cascades) / 1e6
+
     def update(self):
-        if self.moved == False:
-            for obj in self.update_list:
-                obj.update()
-            return
-        camera_pos = self.app.camera.position
-        for obj in self.objects:
-            if obj.can_update:
-                obj.update()
-            angle_from_camera = glm.degrees(glm.acos(glm.dot(glm.normalize(obj.pos - camera_pos),
-                                                             self.app.camera.forward)))
-            if angle_from_camera <= 120.0:  # View frustum
-                obj.can_render = True
-                continue
-            distance = glm.distance(camera_pos, obj.pos)
-            if distance <= 10.0:
-                obj.can_render = True
-                continue
+        self.app.terrain.update()
+        for obj in self.update_list:
+            m_model = obj.m_model
+            obj.update()
+            if obj.can_move and obj.m_model != m_model:
+                self.casters_version += 1
+        if self.bounds_changed:
+            self.get_bounds()
+        else:
+            self.moving_bvh.refit()
+        if self.moved:
+            camera = self.app.camera
+            self.frustum_planes = get_frustum_planes(camera.m_proj * camera.m_view)
+            self.moved = False
+        # Only the objects that were or are now visible are touched
+        visible_objects = self.get_objects_in_frustum(self.frustum_planes)
+        for obj in self.visible_objects:
             obj.can_render = False
-        self.moved = False
+        for obj in visible_objects:
+            obj.can_render = True
+        self.visible_objects = visible_objects
+
+        # Shadow casters of each cascade, whose shadow can fall into the view
+        if self.app.show_global_light:
+            shadow = self.app.shadow
+            shadow.update()
+            light = self.app.global_light
+            light_direction = light.position - light.direction
+            self.shadow_casters = []
+            self.shadow_cascades = []
+            self.light_planes = []
+            for cascade, m_shadow in enumerate(shadow.m_shadow):
+                light_planes = get_frustum_planes(m_shadow)
+                self.light_planes.append(light_planes)
+                casters = self.get_objects(lambda bounds: boxes_in_frustum(light_planes, bounds)
+                                           & boxes_cast_into_frustum(self.frustum_planes, bounds, light_direction))
+                casters = [obj for obj in casters if obj.has_shadow]
+                self.shadow_casters.append(casters)
+                # A tile is drawn again only once its projection, its casters or their matrices change,
+                # or the time when it holds grass
+                moving = any(obj.can_move for obj in casters)
+                windy = any(obj.has_wind for obj in casters)
+                stamp = (light.version, m_shadow, casters, self.casters_version if moving else None,
+                         self.app.time if windy else None)
+                if not shadow.is_current(cascade, stamp):
+                    self.shadow_cascades.append(cascade)
 
     def render(self):
         self.app.prototype.common_render_update()
 
-        # Clear buffers
-        self.app.shadow.depth_fbo.clear()
+        # Queue the visible objects of both passes, sorted once
+        self.render_queue.clear()
+        for obj in self.visible_objects:
+            self.render_queue.submit(obj, RenderQueue.cutout_pass if obj.cutout else RenderQueue.opaque_pass)
+        if self.app.show_global_light:
+            for cascade in self.shadow_cascades:
+                for obj in self.shadow_casters[cascade]:
+                    self.render_queue.submit(obj, RenderQueue.shadow_pass + 2 * cascade + obj.cutout)
+        self.render_queue.sort()
+
+        # Pick the grass blades of the view and of each cascade to draw, and their levels of detail, on the GPU,
+        # see PrototypeGrass.cull
+        planes = self.frustum_planes.astype('f4').tobytes()
+        for obj in self.visible_objects:
+            if isinstance(obj, Grass):
+                obj.prototype.cull(planes)
+        if self.app.show_global_light:
+            for cascade in self.shadow_cascades:
+                planes = self.light_planes[cascade].astype('f4').tobytes()
+                for obj in self.shadow_casters[cascade]:
+                    if isinstance(obj, Grass):
+                        obj.prototype.cull(planes, cascade=cascade)
+        self.ctx.memory_barrier(moderngl.VERTEX_ATTRIB_ARRAY_BARRIER_BIT | moderngl.COMMAND_BARRIER_BIT)
+
+        # Clear buffers, the tiles of the depth map are cleared as they are drawn
         self.app.ctx.clear(color=(0.08, 0.16, 0.18))
 
-        # Pass 1 - Render the depth map for the global light shadows
+        # Pass 1 - Render the depth map for the global light shadows, only the tiles that changed
         if self.app.show_global_light:
             # Enable front face culling in ctx to remove peter-panning flying shadows
             self.ctx.cull_face = "front"
-            self.app.shadow.depth_fbo.use()
-            for obj in self.objects:
-                if obj.can_render and obj.has_shadow:
-                    obj.render_shadow()
+            for cascade in self.shadow_cascades:
+                self.app.shadow.use(cascade)
+                self.render_queue.render(RenderQueue.shadow_pass + 2 * cascade)
+                # Both sides of the grass billboards cast, timed on their own for get_grass_shadow_time
+                self.ctx.disable(moderngl.CULL_FACE)
+                with self.grass_shadow_queries[cascade]:
+                    self.render_queue.render(RenderQueue.shadow_pass + 2 * cascade + 1)
+                self.ctx.enable(moderngl.CULL_FACE)
             self.ctx.cull_face = "back"
 
-        # Pass 2 - Render the scene
+        # Pass 2 - Render the scene, opaque objects then the alpha tested grass
         self.app.ctx.screen.use()  # Switch back to the screen
-        for obj in self.objects:
-            if obj.can_render:
-                obj.render()
+        self.render_queue.render(RenderQueue.opaque_pass)
+        self.render_queue.render(RenderQueue.cutout_pass)
 
         # Render debug lights
         if self.app.show_light_sources:
@@ -1187,6 +2658,7 @@ class Scene():
 
         # Swap buffers
         pygame.display.flip()
+        self.app.shader.count_uniform_writes()
 
     def destroy(self):
         pass
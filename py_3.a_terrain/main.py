@@ -5,7 +5,7 @@ import pygame
 import moderngl
 import sys
 
-from core import Camera, Prototype, Shadow, TerrainChunk, Texture, Shader, Scene
+from core import Camera, Prototype, Shadow, TerrainChunk, Texture, Shader, Scene, UniformBuffer
 
 
 class Engine:
@@ -28,6 +28,18 @@ class Engine:
     show_flash_light = False
     show_global_light = True
     show_light_sources = True
+    indexed_terrain = True
+    lod_terrain = False  # Quadtree ground over the whole height map instead of the tiles', see TerrainLOD
+    gpu_terrain = False  # Tiles share one grid displaced on the GPU, lod_terrain wins, see TerrainChunk.stream
+    height_source = None  # ProceduralHeightMap(seed=1) streams an endless terrain, with lod and gpu terrain off
+    # Grass distribution per terrain tile, see Terrain.distribute_grass
+    grass_density_map = None
+    grass_slope_limit = 40.0
+    grass_budget = 150000
+    # Shadow map of the global light, split along the view into cascades of shadow_size texels, see Shadow.
+    # shadow_cascades = 1 with shadow_size = 4096 is the single map from before the cascades
+    shadow_cascades = 4
+    shadow_size = 1024
 
     texture_blend = 1.0
     local_light = 1.0
@@ -69,10 +81,11 @@ class Engine:
         pygame.time.set_timer(pygame.USEREVENT, 1000 // self.target_fps)
         # Camera
         self.camera = Camera(self, position=(0, 0, 5))
-        # Texture, Shader, Shadow, Prototype
+        # Texture, Shader, UniformBuffer, Shadow, Prototype
         self.texture = Texture(self)
         self.shader = Shader(self)
-        self.shadow = Shadow(self)
+        self.uniform_buffer = UniformBuffer(self)
+        self.shadow = Shadow(self, depth_size=[self.shadow_size, self.shadow_size], cascades=self.shadow_cascades)
         self.prototype = Prototype(self)
         self.terrain = TerrainChunk(self)
         # Scene of objects (after lights)
@@ -84,8 +97,10 @@ class Engine:
         for event in pygame.event.get():
             if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
                 self.scene.destroy()
+                self.terrain.destroy()
                 self.prototype.destroy()
                 self.shader.destroy()
+                self.uniform_buffer.destroy()
                 self.shadow.destroy()
                 self.texture.destroy()
                 pygame.quit()
@@ -113,6 +128,8 @@ class Engine:
                     self.texture_blend = 0.0
             elif event.type == pygame.KEYDOWN and event.key == pygame.K_F6:
                 self.show_light_sources = not self.show_light_sources
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F7:
+                self.camera.follow_ground = not self.camera.follow_ground
             elif event.type == pygame.KEYDOWN and event.key == pygame.K_F11:
                 self.full_screen = not self.full_screen
                 self.toggle_full_screen()
@@ -170,7 +187,9 @@ class Engine:
             self.fps = self.clock.get_fps()
             self.second_count = self.second_count + self.raw_delta_time
             if self.second_count >= 1000:
-                print(f'dt: {self.delta_time:.2f}, fps: {self.fps:.2f}, time: {self.time:.2f}')
+                print(f'dt: {self.delta_time:.2f}, fps: {self.fps:.2f}, time: {self.time:.2f}, '
+                      f'uniforms: {self.shader.uniform_writes} written, {self.shader.uniform_elided} skipped, '
+                      f'grass shadows: {self.scene.get_grass_shadow_time():.2f}ms')
                 self.second_count = self.second_count - 1000
 
 
@@ -5,7 +5,6 @@ layout (location = 0) out vec4 fragColor;
 in vec2 uv_0;
 in vec3 normal;
 in vec3 fragPos;
-in vec4 shadow_coord;
 
 struct Light {
   vec3 position;
@@ -36,14 +35,25 @@ struct Material {
 };
 
 const int max_lights = 99;
+const int max_cascades = 4;  // Same as Shadow.max_cascades
 
 // uniform vec2 u_resolution;
-uniform vec3 cam_pos;
-uniform PointLight lights[max_lights];
-uniform float num_lights;
+// Shared by every program, see UniformBuffer
+layout (std140, binding = 0) uniform Camera {
+  mat4 m_proj;
+  mat4 m_view;
+  mat4 m_shadow[max_cascades];
+  vec4 cascade_splits;
+  vec3 cam_pos;
+  float num_cascades;
+};
 
-uniform Light global_light;
-uniform SpotLight flash_light;
+layout (std140, binding = 1) uniform Lights {
+  float num_lights;
+  Light global_light;
+  SpotLight flash_light;
+  PointLight lights[max_lights];
+};
 
 uniform float texture_blend;
 uniform float local_light_blend;
@@ -85,6 +95,28 @@ const vec3 i_gamma = vec3(1 / 2.2);
 //   return shadow * 0.0625;
 // }
 
+// Bias offset to remove shadow acne
+const float tiny = -0.0005;
+
+// Bias matrix to convert the coordinates from [-1, 1] to [0, 1] from clip space to texture space
+const mat4 m_shadow_bias = mat4(0.5, 0.0, 0.0, 0.0, 0.0, 0.5, 0.0, 0.0, 0.0, 0.0, 0.5, 0.0, 0.5, 0.5, 0.5, 1.0);
+
+float get_shadow(vec3 position) {
+  // Cascade of the split holding the view depth, past the last split there is no shadow
+  const float depth = -(m_view * vec4(position, 1.0)).z;
+  const int cascade = int(dot(step(cascade_splits, vec4(depth)), vec4(1.0)));
+  if (cascade >= int(num_cascades)) {
+    return 1.0;
+  }
+  vec4 shadow_coord = m_shadow_bias * m_shadow[cascade] * vec4(position, 1.0);
+  // The single map without cascades is a perspective projection
+  shadow_coord.xyz /= shadow_coord.w;
+  // The cascades sit side by side in the depth texture
+  shadow_coord.x = (shadow_coord.x + cascade) / num_cascades;
+  // Force shadow off if z is outside the far plane of the cascade
+  return mix(texture(shadow_map_tex, vec3(shadow_coord.xy, shadow_coord.z + tiny)), 1.0, step(1.0, shadow_coord.z));
+}
+
 vec3 fresnelSchlick(float cosTheta, vec3 F0) {
   return F0 + (1.0 - F0) * pow(clamp(1.0 - cosTheta, 0.0, 1.0), 5.0);
 }
@@ -108,16 +140,8 @@ vec3 directional_light(vec3 N, vec3 V, Light light, vec3 F0) {
   const vec3 D = normalize(light.position - light.direction);
   const vec3 H = normalize(V + D);
 
-  // Shadow mapping - find the closest and current depth for this fragment
-  const float current_depth = shadow_coord.z;
-  const float closest_depth = textureProj(shadow_map_tex, shadow_coord);
-  // Force shadow off if z is outside the far plane of the frustum
-  const float shadow = mix(closest_depth, 1.0, 1.0 - step(1.0, current_depth));
-  // ... equivalent of: 
-  // float shadow = closest_depth;
-  // if (current_depth < 0.0) {
-  //   shadow = 1.0;
-  // }
+  // Shadow mapping, from the cascade holding this fragment
+  const float shadow = get_shadow(fragPos);
 
   // Radiance for directional lights is the color of the light times its strength
   const vec3 radiance = light.color * light.strength;
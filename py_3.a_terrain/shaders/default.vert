@@ -7,18 +7,20 @@ layout (location = 2) in vec3 in_normal;
 out vec2 uv_0;
 out vec3 normal;
 out vec3 fragPos;
-out vec4 shadow_coord;
 
-uniform mat4 m_proj;
-uniform mat4 m_view;
-uniform mat4 m_model;
-uniform mat4 m_view_global_light;
+const int max_cascades = 4;  // Same as Shadow.max_cascades
 
-// Bias offset to remove shadow acne
-const float tiny = -0.0005;
+// Shared by every program, see UniformBuffer
+layout (std140, binding = 0) uniform Camera {
+    mat4 m_proj;
+    mat4 m_view;
+    mat4 m_shadow[max_cascades];
+    vec4 cascade_splits;
+    vec3 cam_pos;
+    float num_cascades;
+};
 
-// Bias matrix to convert the coordinates from [-1, 1] to [0, 1] from clip space to texture space
-const mat4 m_shadow_bias = mat4(0.5, 0.0, 0.0, 0.0, 0.0, 0.5, 0.0, 0.0, 0.0, 0.0, 0.5, 0.0, 0.5, 0.5, 0.5, 1.0);
+uniform mat4 m_model;
 
 void main() {
     const vec4 in_position4 = vec4(in_position, 1.0);
@@ -27,8 +29,4 @@ void main() {
     normal = mat3(transpose(inverse(m_model))) * in_normal;
     fragPos = vec3(m_model * in_position4);
     gl_Position = m_proj * m_view * m_model * in_position4;
-
-    const mat4 shadow_mvp = m_proj * m_view_global_light * m_model;
-    shadow_coord = m_shadow_bias * shadow_mvp * in_position4;
-    shadow_coord.z += tiny;
 }
\ No newline at end of file
@@ -1,7 +1,118 @@
 #version 460 core
 
-layout (location = 0) in vec3 in_position;
+// One billboard quad of a grass blade per instance, picked by grass_cull.comp, drawn as a 4 vertex strip
+// With SHADOW defined, the depth only quads of the shadow blade list for grass_shadow.frag, see PrototypeGrass
+layout (location = 0) in uint in_blade;  // point << 4 | level << 2 | quad
+
+out VS_OUT {
+	vec2 uv_0;
+#ifndef SHADOW
+	float color_variation;
+	vec3 normal;
+	vec3 fragPos;
+#endif
+} vs_out;
+
+const int max_cascades = 4;  // Same as Shadow.max_cascades
+
+// Shared by every program, see UniformBuffer
+layout (std140, binding = 0) uniform Camera {
+    mat4 m_proj;
+    mat4 m_view;
+    mat4 m_shadow[max_cascades];
+    vec4 cascade_splits;
+    vec3 cam_pos;
+    float num_cascades;
+};
+
+// A row of the grass buffer, see grass_blade in core.py
+struct Blade {
+    float x, y, z;
+    uint shape;  // Normalized bytes of size, yaw and colour variation, see get_grass_blades
+};
+layout (std430, binding = 0) readonly buffer Grass {
+    Blade grass[];
+};
+uniform sampler2D u_wind;
+uniform float u_time;
+#ifdef SHADOW
+uniform int u_cascade;  // Drawn by this pass, see Shadow.use
+#endif
+
+const mat4 model_wind = mat4(1);
+const vec2 windDirection = vec2(1.0, 1.0);
+const float windStrength = 0.15;
+const float wind_pos_scale = 0.1; // Pulled this out because it's interesting to modify it
+
+const float grass_scale = 2.0;  // Same as grass_cull.comp
+const float grass_min = 0.5;
+
+const float PI = 3.141592653589793;
+
+// Constants
+const vec4 v_pos[4] = vec4[](
+	vec4(-0.25, 0.0, 0.0, 0.0), // Down left
+	vec4(0.25, 0.0, 0.0, 0.0), // Down right
+	vec4(-0.25, 0.5, 0.0, 0.0), // Up left
+	vec4(0.25, 0.5, 0.0, 0.0) // Up right
+);
+const vec2 t_coord[4] = vec2[](vec2(0.0, 0.0), vec2(1.0, 0.0), vec2(0.0, 1.0), vec2(1.0, 1.0));
+const float rot_45 = radians(45);
+const mat4 model_45 = mat4(cos(rot_45), 0, sin(rot_45), 0, 0, 1.0, 0, 0, -sin(rot_45), 0, cos(rot_45), 0, 0, 0, 0, 1);
+const mat4 model_neg_45 = mat4(cos(-rot_45), 0, sin(-rot_45), 0, 0, 1.0, 0, 0, -sin(-rot_45), 0, cos(-rot_45), 0, 0, 0, 0, 1);
+const mat4 quad_models[3] = mat4[](mat4(1.0), model_45, model_neg_45);
+
+// Functions
+mat4 rotationX(in float angle);
+mat4 rotationY(in float angle);
+mat4 rotationZ(in float angle);
 
 void main() {
-    gl_Position = vec4(in_position, 1.0);
+	const uint point = in_blade >> 4;
+	const uint detail_level = (in_blade >> 2) & 3;
+	const mat4 x_model = quad_models[in_blade & 3];
+	const vec4 in_gl_pos = vec4(grass[point].x, grass[point].y, grass[point].z, 1.0);
+	const vec4 shape = unpackUnorm4x8(grass[point].shape);
+	const float grass_size = shape.x * grass_scale * (1.0 - grass_min) + grass_min;
+
+	// Diminish the wind based on LOD levels
+	const float wind_scale = 0.6 + (detail_level > 2 ? 0.25 : 0.0) + (detail_level > 1 ? 0.15 : 0.0);
+
+	// The back of the quad will be invisible to the camera, so we rotate the quad with a random amount to create a complete scene.
+	const mat4 rand_y = rotationY(shape.y * PI);
+
+	// The top of the quad bends with the wind, the bottom stays on the ground
+	const int corner = gl_VertexID;
+	mat4 bend = model_wind;
+	if (corner >= 2) {
+		// Wind calculation using the flow map texture and time, from the blade's place on the flow map
+		vec2 uv = in_gl_pos.xz * wind_pos_scale + windDirection * windStrength * u_time * wind_scale;
+		uv.x = mod(uv.x, 1.0);
+		uv.y = mod(uv.y, 1.0);
+		const vec4 wind = texture(u_wind, uv);
+		bend = rotationX(wind.x * PI * 0.75 - PI * 0.25) * rotationZ(wind.y * PI * 0.75 - PI * 0.25);
+	}
+	const vec4 vert = in_gl_pos + bend * rand_y * x_model * v_pos[corner] * grass_size;
+
+	vs_out.uv_0 = t_coord[corner];
+#ifdef SHADOW
+	gl_Position = m_shadow[u_cascade] * vert;
+#else
+	gl_Position = m_proj * m_view * vert;
+	vs_out.fragPos = vec3(vert);
+	vs_out.normal = vec3(model_wind * rand_y * x_model * vec4(0.0, 1.0, 0.0, 0.0));
+	vs_out.color_variation = shape.z;
+#endif
+}
+
+mat4 rotationX(in float angle) {
+	return mat4(1.0, 0, 0, 0, 0, cos(angle), -sin(angle), 0, 0, sin(angle), cos(angle), 0, 0, 0, 0, 1);
+}
+
+mat4 rotationY(in float angle) {
+	return mat4(cos(angle), 0, sin(angle), 0, 0, 1.0, 0, 0, -sin(angle), 0, cos(angle), 0, 0, 0, 0, 1);
+}
+
+mat4 rotationZ(in float angle) {
+	return mat4(cos(angle), -sin(angle), 0, 0, sin(angle), cos(angle), 0, 0, 0, 0, 1, 0, 0, 0, 0, 1);
 }
\ No newline at end of file
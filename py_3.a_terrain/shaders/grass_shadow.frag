@@ -0,0 +1,16 @@
+#version 460 core
+
+in VS_OUT {
+  vec2 uv_0;
+} fs_in;
+
+uniform sampler2D u_texture_0;
+
+const float alpha_discard_level = 0.25; // Same as grass.frag
+
+void main() {
+  // Only the blades cast, not the clear parts of the billboard
+  if (texture(u_texture_0, fs_in.uv_0).a < alpha_discard_level) {
+    discard;
+  }
+}
\ No newline at end of file
@@ -0,0 +1,91 @@
+#version 460 core
+
+layout (location = 0) in vec2 in_position;
+
+out vec2 uv_0;
+out vec3 normal;
+out vec3 fragPos;
+out float color_variation;
+
+const int max_cascades = 4;  // Same as Shadow.max_cascades
+
+// Shared by every program, see UniformBuffer
+layout (std140, binding = 0) uniform Camera {
+    mat4 m_proj;
+    mat4 m_view;
+    mat4 m_shadow[max_cascades];
+    vec4 cascade_splits;
+    vec3 cam_pos;
+    float num_cascades;
+};
+
+uniform mat4 m_model;
+uniform sampler2D u_height_map; // Red channel of the height map in [0, 1], one texel per sample
+uniform vec2 u_offset; // First height map sample of this tile
+uniform vec2 u_center; // Height map sample placed under the camera
+uniform float u_scale;
+uniform float u_max_height;
+uniform float u_base_height;
+
+float random(vec2 st);
+float noise(in vec2 st);
+float fbm(in vec2 _st);
+
+float height(ivec2 sample_xz) {
+    // Samples past the edge of the height map repeat the last one
+    const ivec2 clamped = clamp(sample_xz, ivec2(0), textureSize(u_height_map, 0) - 1);
+    return texelFetch(u_height_map, clamped, 0).r * u_max_height - u_base_height;
+}
+
+void main() {
+    const ivec2 sample_xz = ivec2(in_position + u_offset);
+    const vec2 world_xz = (vec2(sample_xz) - u_center + 0.5) * u_scale;
+    const vec3 position = vec3(world_xz.x, height(sample_xz), world_xz.y);
+
+    // Smooth normal from the neighbouring samples, central differences
+    const float left = height(sample_xz - ivec2(1, 0));
+    const float right = height(sample_xz + ivec2(1, 0));
+    const float back = height(sample_xz - ivec2(0, 1));
+    const float front = height(sample_xz + ivec2(0, 1));
+    const vec3 terrain_normal = normalize(vec3((left - right) / (2.0 * u_scale), 1.0, (back - front) / (2.0 * u_scale)));
+
+    // Texture repeats once per height map sample, like the indexed Ground
+    uv_0 = vec2(sample_xz.x, -sample_xz.y);
+    normal = mat3(transpose(inverse(m_model))) * terrain_normal;
+    fragPos = vec3(m_model * vec4(position, 1.0));
+    color_variation = fbm(position.xz);
+    gl_Position = m_proj * m_view * m_model * vec4(position, 1.0);
+}
+
+float random(vec2 st) {
+    return fract(sin(dot(st.xy, vec2(12.9898, 78.233))) * 43758.5453123);
+}
+
+float noise(in vec2 st) {
+    const vec2 i = floor(st);
+    const vec2 f = fract(st);
+	// Four corners in 2D of a tile
+    const float a = random(i);
+    const float b = random(i + vec2(1.0, 0.0));
+    const float c = random(i + vec2(0.0, 1.0));
+    const float d = random(i + vec2(1.0, 1.0));
+	// Smooth Interpolation
+    const vec2 u = smoothstep(0.0, 1.0, f);
+	// Mix 4 percentages
+    return mix(a, b, u.x) + (c - a) * u.y * (1.0 - u.x) + (d - b) * u.x * u.y;
+}
+
+const vec2 fbm_shift = vec2(100.0);
+const mat2 fbm_rot = mat2(cos(0.5), sin(0.5), -sin(0.5), cos(0.50));
+const int num_octaves = 4;
+float fbm(in vec2 _st) {
+	// Craete variation with Fractal Brownian Motion (between 0 and 1)
+    float v = 0.0;
+    float a = 0.5;
+    for (int i = 0; i < num_octaves; ++i) {
+        v += a * noise(_st);
+        _st = fbm_rot * _st * 2.0 + fbm_shift;
+        a *= 0.5;
+    }
+    return v;
+}
\ No newline at end of file
@@ -0,0 +1,75 @@
+#version 460 core
+
+layout (location = 0) in vec3 in_position;
+layout (location = 1) in vec3 in_normal;
+layout (location = 2) in vec3 in_morph;
+
+out vec2 uv_0;
+out vec3 normal;
+out vec3 fragPos;
+out float color_variation;
+
+const int max_cascades = 4;  // Same as Shadow.max_cascades
+
+// Shared by every program, see UniformBuffer
+layout (std140, binding = 0) uniform Camera {
+    mat4 m_proj;
+    mat4 m_view;
+    mat4 m_shadow[max_cascades];
+    vec4 cascade_splits;
+    vec3 cam_pos;
+    float num_cascades;
+};
+
+uniform mat4 m_model;
+uniform vec2 u_morph; // Distance where this patch starts and ends morphing into the next level
+uniform float u_texture_scale;
+
+float random(vec2 st);
+float noise(in vec2 st);
+float fbm(in vec2 _st);
+
+void main() {
+    // Odd vertices slide onto their even neighbour towards the end of the patch's range
+    float morph = clamp((distance(cam_pos, in_position) - u_morph.x) / (u_morph.y - u_morph.x), 0.0, 1.0);
+    vec3 position = in_position + in_morph * morph;
+
+    uv_0 = vec2(position.x, -position.z) * u_texture_scale;
+    normal = mat3(transpose(inverse(m_model))) * in_normal;
+    fragPos = vec3(m_model * vec4(position, 1.0));
+    color_variation = fbm(position.xz);
+    gl_Position = m_proj * m_view * m_model * vec4(position, 1.0);
+}
+
+float random(vec2 st) {
+    return fract(sin(dot(st.xy, vec2(12.9898, 78.233))) * 43758.5453123);
+}
+
+float noise(in vec2 st) {
+    const vec2 i = floor(st);
+    const vec2 f = fract(st);
+	// Four corners in 2D of a tile
+    const float a = random(i);
+    const float b = random(i + vec2(1.0, 0.0));
+    const float c = random(i + vec2(0.0, 1.0));
+    const float d = random(i + vec2(1.0, 1.0));
+	// Smooth Interpolation
+    const vec2 u = smoothstep(0.0, 1.0, f);
+	// Mix 4 percentages
+    return mix(a, b, u.x) + (c - a) * u.y * (1.0 - u.x) + (d - b) * u.x * u.y;
+}
+
+const vec2 fbm_shift = vec2(100.0);
+const mat2 fbm_rot = mat2(cos(0.5), sin(0.5), -sin(0.5), cos(0.50));
+const int num_octaves = 4;
+float fbm(in vec2 _st) {
+	// Craete variation with Fractal Brownian Motion (between 0 and 1)
+    float v = 0.0;
+    float a = 0.5;
+    for (int i = 0; i < num_octaves; ++i) {
+        v += a * noise(_st);
+        _st = fbm_rot * _st * 2.0 + fbm_shift;
+        a *= 0.5;
+    }
+    return v;
+}
\ No newline at end of file
@@ -2,8 +2,18 @@
 
 layout (location = 0) in vec3 in_position;
 
-uniform mat4 m_proj;
-uniform mat4 m_view;
+const int max_cascades = 4;  // Same as Shadow.max_cascades
+
+// Shared by every program, see UniformBuffer
+layout (std140, binding = 0) uniform Camera {
+    mat4 m_proj;
+    mat4 m_view;
+    mat4 m_shadow[max_cascades];
+    vec4 cascade_splits;
+    vec3 cam_pos;
+    float num_cascades;
+};
+
 uniform mat4 m_model;
 
 void main() {
@@ -2,10 +2,21 @@
 
 layout (location = 1) in vec3 in_position;
 
-uniform mat4 m_proj;
-uniform mat4 m_view_light;
+const int max_cascades = 4;  // Same as Shadow.max_cascades
+
+// Shared by every program, see UniformBuffer
+layout (std140, binding = 0) uniform Camera {
+    mat4 m_proj;
+    mat4 m_view;
+    mat4 m_shadow[max_cascades];
+    vec4 cascade_splits;
+    vec3 cam_pos;
+    float num_cascades;
+};
+
 uniform mat4 m_model;
+uniform int u_cascade;  // Drawn by this pass, see Shadow.use
 
 void main() {
-    gl_Position = m_proj * m_view_light * m_model * vec4(in_position, 1.0);
+    gl_Position = m_shadow[u_cascade] * m_model * vec4(in_position, 1.0);
 }
\ No newline at end of file
@@ -5,7 +5,7 @@ import pygame
 import moderngl
 import sys
 
-from core import AA, Camera, Prototype, Shadow, Texture, Shader, Scene
+from core import AA, Camera, Prototype, Shadow, Texture, Shader, Scene, UniformBuffer
 
 
 class Engine:
@@ -69,9 +69,10 @@ class Engine:
         pygame.time.set_timer(pygame.USEREVENT, 1000 // self.target_fps)
         # Camera
         self.camera = Camera(self, position=(0, 0, 5))
-        # Texture, Shader, Shadow, Prototype, AA
+        # Texture, Shader, UniformBuffer, Shadow, Prototype, AA
         self.texture = Texture(self)
         self.shader = Shader(self)
+        self.uniform_buffer = UniformBuffer(self)
         self.shadow = Shadow(self)
         self.prototype = Prototype(self)
         self.aa = AA(self)
@@ -86,6 +87,7 @@ class Engine:
                 self.scene.destroy()
                 self.prototype.destroy()
                 self.shader.destroy()
+                self.uniform_buffer.destroy()
                 self.shadow.destroy()
                 self.texture.destroy()
                 pygame.quit()
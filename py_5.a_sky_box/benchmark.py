@@ -0,0 +1,90 @@
+import os
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"  # noqa: E402
+
+import sys
+import time
+import moderngl
+import pygame
+
+from core import Camera, Prototype, Shadow, Texture, Shader, Scene, UniformBuffer
+from main import Engine
+
+repeats = 50
+
+
+class Headless(Engine):
+    '''The Engine's settings and scene on a standalone context, without a window or main loop.'''
+
+    def __init__(self, win_size=(1600, 900), backend=None):
+        pygame.init()
+        # Textures are converted to the display format, a hidden window is enough
+        pygame.display.set_mode((1, 1), flags=pygame.HIDDEN)
+        self.win_size = win_size
+        # Any 3.3 core context to start with, the shaders then need a driver taking GLSL 4.60.
+        # backend='egl' runs without a display server
+        self.ctx = moderngl.create_standalone_context(require=330, **({'backend': backend} if backend else {}))
+        self.ctx.enable(flags=moderngl.DEPTH_TEST | moderngl.CULL_FACE)
+        self.camera = Camera(self, position=(0, 0, 5))
+        self.texture = Texture(self)
+        self.shader = Shader(self)
+        self.uniform_buffer = UniformBuffer(self)
+        self.shadow = Shadow(self)
+        self.prototype = Prototype(self)
+        self.scene = Scene(self)
+
+
+def get_interleaved_shadow_vao(app, batch):
+    '''The depth pass VAO before the position-only buffers, fetching the whole 2f 3f 3f vertex.'''
+    vbo = app.ctx.buffer(batch.prototype.get_vertex_data())
+    vao = app.ctx.vertex_array(batch.prototype.shadow_program, [
+        (vbo, '2f 3f 3f', 'in_texcoord_0', 'in_position', 'in_normal'),
+        (batch.instance_vbo, '16f 24x/i', 'in_model'),
+    ], skip_errors=True)
+    return vbo, vao
+
+
+def time_shadow_pass(app):
+    '''Mean time of the scene's depth pass, waiting for the GPU to finish.'''
+    app.ctx.cull_face = "front"
+    app.shadow.depth_fbo.use()
+    app.ctx.finish()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        app.shadow.depth_fbo.clear()
+        for batch in app.prototype.batches:
+            batch.render_shadow()
+    app.ctx.finish()
+    app.ctx.cull_face = "back"
+    return (time.perf_counter() - start) / repeats
+
+
+def bench_shadow_pass(app):
+    app.scene.update()
+    app.prototype.common_render_update()
+    batches = app.prototype.batches
+    for batch in batches:
+        batch.update()
+    instances = sum(batch.instance_count for batch in batches)
+    print(f"shadow pass ({app.shadow.depth_texture.size[0]}^2 depth map, {instances} instances, "
+          f"{len(batches)} batches)")
+    # Once first, the first pass also pays for the driver's setup
+    time_shadow_pass(app)
+    position_time = time_shadow_pass(app)
+    position_vaos = [batch.shadow_vao for batch in batches]
+    interleaved = [get_interleaved_shadow_vao(app, batch) for batch in batches]
+    for batch, (_, vao) in zip(batches, interleaved):
+        batch.shadow_vao = vao
+    time_shadow_pass(app)
+    interleaved_time = time_shadow_pass(app)
+    for batch, vao, (vbo, interleaved_vao) in zip(batches, position_vaos, interleaved):
+        batch.shadow_vao = vao
+        interleaved_vao.release()
+        vbo.release()
+    print(f"  position only (3f) {position_time * 1000:7.2f}ms, interleaved (2f 3f 3f) "
+          f"{interleaved_time * 1000:7.2f}ms, x{interleaved_time / position_time:5.2f}")
+
+
+if __name__ == '__main__':
+    # python benchmark.py [repeats] [backend]
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else repeats
+    bench_shadow_pass(Headless(backend=sys.argv[2] if len(sys.argv) > 2 else None))
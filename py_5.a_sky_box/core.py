@@ -123,13 +123,17 @@ class DirectionalLight:
         self.color = glm.vec3(color)
         self.strength = strength
         self.m_view_light = self.get_view_matrix()
+        self.version = 0  # Counts the turns, see Shadow.is_current
 
     def get_view_matrix(self):
         return glm.lookAt(self.position, self.direction, glm.vec3(0, 1, 0))
 
     def rotate(self, time):
+        if time == 0:
+            return
         self.position = glm.rotateY(self.position, time)
         self.m_view_light = self.get_view_matrix()
+        self.version += 1
 
 
 class SpotLight:
@@ -165,6 +169,71 @@ class CameraSpotLight:
         self.direction = self.camera.forward
 
 
+class UniformBuffer:
+    '''Camera and Lights uniform blocks, packed once per frame and bound to every shader program.
+
+    The structured arrays follow the std140 layout of the blocks declared in the shaders.'''
+    camera_binding = 0
+    lights_binding = 1
+    max_lights = 99  # Same as max_lights in the fragment shaders
+
+    point_light = numpy.dtype({'names': ['position', 'color', 'strength'],
+                               'formats': [('f4', 3), ('f4', 3), 'f4'],
+                               'offsets': [0, 16, 28], 'itemsize': 32})
+    directional_light = numpy.dtype({'names': ['position', 'direction', 'color', 'strength'],
+                                     'formats': [('f4', 3), ('f4', 3), ('f4', 3), 'f4'],
+                                     'offsets': [0, 16, 32, 44], 'itemsize': 48})
+    spot_light = numpy.dtype({'names': ['position', 'direction', 'color', 'strength', 'cutoff', 'softness'],
+                              'formats': [('f4', 3), ('f4', 3), ('f4', 3), 'f4', 'f4', 'f4'],
+                              'offsets': [0, 16, 32, 44, 48, 52], 'itemsize': 64})
+    camera_block = numpy.dtype({'names': ['m_proj', 'm_view', 'm_view_global_light', 'cam_pos'],
+                                'formats': [('f4', (4, 4)), ('f4', (4, 4)), ('f4', (4, 4)), ('f4', 3)],
+                                'offsets': [0, 64, 128, 192], 'itemsize': 208})
+    lights_block = numpy.dtype({'names': ['num_lights', 'global_light', 'flash_light', 'lights'],
+                                'formats': ['f4', directional_light, spot_light, (point_light, max_lights)],
+                                'offsets': [0, 16, 64, 128], 'itemsize': 128 + 32 * max_lights})
+
+    def __init__(self, app):
+        self.app = app
+        self.ctx = app.ctx
+        self.camera_data = numpy.zeros((), dtype=self.camera_block)
+        self.lights_data = numpy.zeros((), dtype=self.lights_block)
+        self.camera_ubo = self.ctx.buffer(reserve=self.camera_block.itemsize)
+        self.lights_ubo = self.ctx.buffer(reserve=self.lights_block.itemsize)
+        # Programs pick the blocks up by the binding points in their layout qualifiers
+        self.camera_ubo.bind_to_uniform_block(self.camera_binding)
+        self.lights_ubo.bind_to_uniform_block(self.lights_binding)
+
+    def update(self):
+        # glm matrices convert to NumPy row by row, GLSL reads them column by column
+        camera = self.camera_data
+        camera['m_proj'] = numpy.asarray(self.app.camera.m_proj).T
+        camera['m_view'] = numpy.asarray(self.app.camera.m_view).T
+        camera['m_view_global_light'] = numpy.asarray(self.app.global_light.m_view_light).T
+        camera['cam_pos'] = self.app.camera.position
+        self.camera_ubo.write(camera)
+
+        lights = self.lights_data
+        lights['num_lights'] = len(self.app.lights)
+        if self.app.lights:
+            # One assignment per member for all the point lights, not one per light
+            point_lights = lights['lights'][:len(self.app.lights)]
+            point_lights['position'] = [light.position for light in self.app.lights]
+            point_lights['color'] = [light.color for light in self.app.lights]
+            point_lights['strength'] = [light.strength for light in self.app.lights]
+        global_light = self.app.global_light
+        lights['global_light'] = (global_light.position, global_light.direction, global_light.color,
+                                  global_light.strength)
+        flash_light = self.app.flash_light
+        lights['flash_light'] = (flash_light.position, flash_light.direction, flash_light.color,
+                                 flash_light.strength, flash_light.cutoff, flash_light.softness)
+        self.lights_ubo.write(lights)
+
+    def destroy(self):
+        self.camera_ubo.release()
+        self.lights_ubo.release()
+
+
 class Shader():
     def __init__(self, app):
         self.app = app
@@ -214,6 +283,7 @@ class Texture:
         self.textures = []
         self.texture_count = -1
         self.texture_map = {}
+        self.layer_maps = {}
 
     def get_texture(self, path):
         if path in self.texture_map:
@@ -238,6 +308,45 @@ class Texture:
         print(f"loaded texture: {path} at index: {self.texture_count}")
         return self.texture_count
 
+    def get_texture_layer(self, path, name='material_array', layers=8):
+        '''Get a material texture as a layer of one texture array, returns the array index and the layer.
+
+        The array takes its size from the first texture, and holds up to layers textures of that size.'''
+        layer_map = self.layer_maps.setdefault(name, {})
+        if path in layer_map:
+            return self.texture_map[name], layer_map[path]
+
+        texture = pygame.image.load(path).convert()
+        texture = pygame.transform.flip(texture, flip_x=False, flip_y=True)  # Flip Pygame -> OpenGL
+        width, height = texture.get_size()
+        if name not in self.texture_map:
+            texture_array = self.ctx.texture_array(size=(width, height, layers), components=3)
+            # Mipmaps
+            texture_array.filter = (moderngl.LINEAR_MIPMAP_LINEAR, moderngl.LINEAR)
+            texture_array.min_lod = -1000
+            texture_array.max_lod = 1000
+            # AF
+            texture_array.anisotropy = 32.0
+            # Add to list
+            self.texture_count += 1
+            self.texture_map[name] = self.texture_count
+            self.textures.append(texture_array)
+            print(f"loaded texture array: {name} of {layers} layers at index: {self.texture_count}")
+        texture_array = self.textures[self.texture_map[name]]
+        if (width, height) != texture_array.size[:2]:
+            raise ValueError(f"{path} is {width}x{height}, the layers of {name} are "
+                             f"{texture_array.size[0]}x{texture_array.size[1]}")
+        layer = len(layer_map)
+        if layer == texture_array.size[2]:
+            raise ValueError(f"{name} is full at {layer} layers")
+
+        texture_array.write(pygame.image.tostring(texture, 'RGB'), viewport=(0, 0, layer, width, height, 1))
+        # Set levels of mipmaps
+        texture_array.build_mipmaps(base=0, max_level=1000)
+        layer_map[path] = layer
+        print(f"loaded texture: {path} at layer: {layer} of {name}")
+        return self.texture_map[name], layer
+
     def get_depth_texture(self, size, name='depth_texture'):
         if name in self.texture_map:
             return self.texture_map[name]
@@ -326,6 +435,15 @@ class Shadow():
         self.shader_program = app.shader.get_shader("default")
         self.shader_program['shadow_map_tex'] = self.depth_tex_id
         self.app.texture.textures[self.depth_tex_id].use(location=self.depth_tex_id)
+        # What the depth map was last drawn for, see is_current
+        self.stamp = None
+
+    def is_current(self, stamp):
+        '''Whether the depth map was drawn for the same stamp, else keep the stamp to draw it again.'''
+        if self.stamp == stamp:
+            return True
+        self.stamp = stamp
+        return False
 
     def destroy(self):
         self.depth_fbo.release()
@@ -339,6 +457,9 @@ class Prototype:
         self.objects = []
         self.object_count = -1
         self.object_map = {}
+        self.batches = []
+        self.batch_count = -1
+        self.batch_map = {}
 
     def get_object(self, name):
         if name in self.object_map:
@@ -363,53 +484,35 @@ class Prototype:
         print(f"loaded proto-object: {name} at index: {self.object_count}")
         return base_object
 
+    def get_batch(self, name, tex_id):
+        key = (name, tex_id)
+        if key in self.batch_map:
+            return self.batches[self.batch_map[key]]
+
+        batch = InstanceBatch(self.app, self.get_object(name), tex_id)
+
+        # Add to list
+        self.batch_count += 1
+        self.batch_map[key] = self.batch_count
+        self.batches.append(batch)
+        print(f"loaded batch: {name} with texture: {tex_id} at index: {self.batch_count}")
+        return batch
+
     def common_render_update(self):
+        # Camera and lights for every shader program
+        self.app.uniform_buffer.update()
+
         shader_program = self.app.shader.get_shader('default')
         # Resolution
         # shader_program['u_resolution'].write(glm.vec2(self.app.win_size))
 
-        # Position
-        shader_program['num_lights'].value = len(self.app.lights)
-        shader_program['cam_pos'].write(self.app.camera.position)
-        shader_program['m_proj'].write(self.app.camera.m_proj)
-        shader_program['m_view'].write(self.app.camera.m_view)
-
-        # Send lights into uniform array of Light struct
-        for i, light in enumerate(self.app.lights):
-            shader_program[f'lights[{i}].position'].value = light.position
-            shader_program[f'lights[{i}].color'].value = light.color
-            shader_program[f'lights[{i}].strength'].value = light.strength
-
-        # Send global_light from self.global_light
-        shader_program['m_view_global_light'].write(self.app.global_light.m_view_light)
-        shader_program['global_light.position'].value = self.app.global_light.position
-        shader_program['global_light.direction'].value = self.app.global_light.direction
-        shader_program['global_light.color'].value = self.app.global_light.color
-        shader_program['global_light.strength'].value = self.app.global_light.strength
-
-        # Send flash_light from self.flash_light
-        shader_program['flash_light.position'].value = self.app.flash_light.position
-        shader_program['flash_light.color'].value = self.app.flash_light.color
-        shader_program['flash_light.strength'].value = self.app.flash_light.strength
-        shader_program['flash_light.cutoff'].value = self.app.flash_light.cutoff
-        shader_program['flash_light.direction'].value = self.app.flash_light.direction
-        shader_program['flash_light.softness'].value = self.app.flash_light.softness
-
-        # Shadow
-        shadow_program = self.app.shader.get_shader('shadow')
-        shadow_program['m_proj'].write(self.app.camera.m_proj)
-        shadow_program['m_view_light'].write(self.app.global_light.m_view_light)
-
         # Debug
         shader_program["texture_blend"].value = self.app.texture_blend
         shader_program["local_light_blend"].value = self.app.local_light
 
-        # Debug Light
-        light_program = self.app.shader.get_shader('light')
-        light_program['m_proj'].write(self.app.camera.m_proj)
-        light_program['m_view'].write(self.app.camera.m_view)
-
     def destroy(self):
+        for batch in self.batches:
+            batch.destroy()
         for obj in self.objects:
             obj.destroy()
 
@@ -420,29 +523,30 @@ class PrototypeCube:
                  shadow_name: str = 'shadow'):
         self.app = app
         self.ctx = app.ctx
-        self.vbo = self.get_vbo()
+        self.vbo, self.position_vbo = self.get_vbos()
         self.shader_program = self.app.shader.get_shader(shader_name)
-        self.vao = self.get_vao(self.vbo, self.shader_program)
+        self.vao = self.get_vao(self.vbo, self.position_vbo, self.shader_program)
         self.shadow_program = self.app.shader.get_shader(shadow_name)
-        self.shadow_vao = self.get_shadow_vao(self.vbo, self.shadow_program)
+        self.shadow_vao = self.get_shadow_vao(self.position_vbo, self.shadow_program)
 
     def destroy(self):
         self.vao.release()
         self.shadow_vao.release()
         self.vbo.release()
+        self.position_vbo.release()
 
-    def get_vao(self, vbo, shader_program):
+    def get_vao(self, vbo, position_vbo, shader_program):
         vao = self.ctx.vertex_array(shader_program, [
-            (vbo, '2f 3f 3f', 'in_texcoord_0', 'in_position', 'in_normal'),
+            (vbo, '2f 3f', 'in_texcoord_0', 'in_normal'),
+            (position_vbo, '3f', 'in_position'),
         ])
         return vao
 
-    def get_shadow_vao(self, vbo, shadow_program):
+    def get_shadow_vao(self, position_vbo, shadow_program):
+        # The depth pass only fetches positions
         vao = self.ctx.vertex_array(shadow_program, [
-            (vbo, '2f 3f 3f', 'in_texcoord_0', 'in_position', 'in_normal'),
-        ], skip_errors=True)
-        # Temporary fix for the issue with the shadow program because we are not using texture coordinates
-        # So we set skip_errors=True to ignore the missing in_texcoord_0 attribute
+            (position_vbo, '3f', 'in_position'),
+        ])
         return vao
 
     def get_vertex_data(self):
@@ -492,8 +596,94 @@ class PrototypeCube:
 
         return numpy.array(vertex_data, dtype='f4')
 
-    def get_vbo(self):
-        return self.ctx.buffer(self.get_vertex_data())
+    def get_vbos(self):
+        # Positions get a buffer of their own, so the depth pass reads nothing it does not use
+        vertex_data = self.get_vertex_data()
+        vbo = self.ctx.buffer(numpy.ascontiguousarray(vertex_data[:, [0, 1, 5, 6, 7]]))
+        return vbo, self.ctx.buffer(numpy.ascontiguousarray(vertex_data[:, 2:5]))
+
+
+class InstanceBatch:
+    '''Objects sharing a prototype and texture array, drawn with one instanced call in each pass.
+
+    Each object owns a row of the instance data: model matrix (by column), albedo, roughness, metallic,
+    and its layer of the texture array.'''
+    instance_size = 16 + 3 + 2 + 1
+
+    def __init__(self, app, prototype: PrototypeCube, tex_id: int):
+        self.app = app
+        self.ctx = app.ctx
+        self.prototype = prototype
+        self.tex_id = tex_id
+        self.objects = []
+        # Rows of the objects at the front, the capacity doubles when it runs out
+        self.instance_data = numpy.zeros((16, self.instance_size), dtype='f4')
+        self.instance_count = 0
+        self.instance_vbo = None
+        self.vao = None
+        self.shadow_vao = None
+
+    def add(self, obj):
+        obj.instance = len(self.objects)
+        self.objects.append(obj)
+        if obj.instance == len(self.instance_data):
+            self.instance_data = numpy.concatenate([self.instance_data, numpy.zeros_like(self.instance_data)])
+        self.instance_data[obj.instance, 16:19] = obj.albedo
+        self.instance_data[obj.instance, 19] = obj.roughness
+        self.instance_data[obj.instance, 20] = obj.metallic
+        self.instance_data[obj.instance, 21] = obj.layer
+        self.set_model(obj)
+
+    def set_model(self, obj):
+        self.instance_data[obj.instance, :16] = numpy.frombuffer(obj.m_model.to_bytes(), dtype='f4')
+
+    def get_vaos(self):
+        # Sized for the capacity of every object, the visible ones are packed at the front each frame
+        self.release()
+        self.instance_vbo = self.ctx.buffer(reserve=self.instance_data.nbytes)
+        self.vao = self.ctx.vertex_array(self.prototype.shader_program, [
+            (self.prototype.vbo, '2f 3f', 'in_texcoord_0', 'in_normal'),
+            (self.prototype.position_vbo, '3f', 'in_position'),
+            (self.instance_vbo, '16f 3f 2f 1f/i', 'in_model', 'in_albedo', 'in_material', 'in_layer'),
+        ])
+        # Positions and model matrices only
+        self.shadow_vao = self.ctx.vertex_array(self.prototype.shadow_program, [
+            (self.prototype.position_vbo, '3f', 'in_position'),
+            (self.instance_vbo, '16f 24x/i', 'in_model'),
+        ])
+
+    def update(self):
+        visible = numpy.fromiter((obj.can_render for obj in self.objects), dtype=bool, count=len(self.objects))
+        instances = self.instance_data[:len(self.objects)][visible]
+        self.instance_count = len(instances)
+        if self.instance_count == 0:
+            return
+        if self.instance_vbo is None or self.instance_vbo.size < self.instance_data.nbytes:
+            self.get_vaos()
+        self.instance_vbo.write(instances)
+
+    def render(self):
+        if self.instance_count == 0:
+            return
+        # Texture array, the layer is picked per instance
+        self.prototype.shader_program['u_texture_array'] = self.tex_id
+        self.app.texture.textures[self.tex_id].use(location=self.tex_id)
+        # Render
+        self.vao.render(instances=self.instance_count)
+
+    def render_shadow(self):
+        if self.instance_count == 0:
+            return
+        self.shadow_vao.render(instances=self.instance_count)
+
+    def release(self):
+        if self.instance_vbo is not None:
+            self.vao.release()
+            self.shadow_vao.release()
+            self.instance_vbo.release()
+
+    def destroy(self):
+        self.release()
 
 
 class PrototypeLightSource():
@@ -563,34 +753,17 @@ class Cube:
         self.roughness = roughness
         self.metallic = metallic
 
-        this_object = self.app.prototype.get_object(name)
-        self.vao = this_object.vao
-        self.shadow_vao = this_object.shadow_vao
-        self.shader_program = this_object.shader_program
-        self.shadow_program = this_object.shadow_program
-
-        self.tex_id = app.texture.get_texture(path=f'../textures/{texture}.png')
+        # Layer of the material texture array, instead of a texture unit of its own
+        self.tex_id, self.layer = app.texture.get_texture_layer(path=f'../textures/{texture}.png')
         self.m_model = self.position
 
+        # Drawn by the batch of every object with this prototype and texture array
+        self.batch = self.app.prototype.get_batch(name, self.tex_id)
+        self.batch.add(self)
+
     def update(self):
         self.m_model = glm.rotate(self.position, self.app.time, glm.vec3(0, 1, 0))
-
-    def render(self):
-        # Texture
-        self.shader_program['u_texture_0'] = self.tex_id
-        self.app.texture.textures[self.tex_id].use(location=self.tex_id)
-        # Position
-        self.shader_program['m_model'].write(self.m_model)
-        # Material
-        self.shader_program['material.a'].value = self.albedo
-        self.shader_program['material.d'].value = self.roughness
-        self.shader_program['material.s'].value = self.metallic
-        # Render
-        self.vao.render()
-
-    def render_shadow(self):
-        self.shadow_program['m_model'].write(self.m_model)
-        self.shadow_vao.render()
+        self.batch.set_model(self)
 
 
 class Floor(Cube):
@@ -602,6 +775,7 @@ class Floor(Cube):
 
     def update(self):
         self.m_model = self.position
+        self.batch.set_model(self)
 
 
 class LightSource:
@@ -630,6 +804,7 @@ class Scene():
     objects = []
     update_list = []
     moved = True
+    casters_version = 0  # Counts the changes to the shadow casters, see Shadow.is_current
 
     def __init__(self, app):
         self.app = app
@@ -709,47 +884,46 @@ class Scene():
                 self.update_list.append(obj)
 
     def update(self):
+        for obj in self.update_list:
+            m_model = obj.m_model
+            obj.update()
+            if obj.m_model != m_model:
+                self.casters_version += 1
         if self.moved == False:
-            for obj in self.update_list:
-                obj.update()
             return
         camera_pos = self.app.camera.position
         for obj in self.objects:
-            if obj.can_update:
-                obj.update()
             angle_from_camera = glm.degrees(glm.acos(glm.dot(glm.normalize(obj.pos - camera_pos), self.app.camera.forward)))
-            if angle_from_camera <= 120.0:  # View frustum
-                obj.can_render = True
-                continue
-            distance = glm.distance(camera_pos, obj.pos)
-            if distance <= 10.0:
-                obj.can_render = True
-                continue
-            obj.can_render = False
+            # View frustum, or close to the camera
+            can_render = angle_from_camera <= 120.0 or glm.distance(camera_pos, obj.pos) <= 10.0
+            if obj.can_render != can_render:
+                obj.can_render = can_render
+                self.casters_version += 1
         self.moved = False
 
     def render(self):
         self.app.prototype.common_render_update()
+        for batch in self.app.prototype.batches:
+            batch.update()
 
-        # Clear buffers
-        self.app.shadow.depth_fbo.clear()
+        # Clear buffers, the depth map only when it is drawn again
         self.app.ctx.clear(color=(0.08, 0.16, 0.18))
 
-        # Pass 1 - Render the depth map for the global light shadows
-        if self.app.show_global_light:
+        # Pass 1 - Render the depth map for the global light shadows, kept while the light and casters are still
+        stamp = (self.app.global_light.version, self.casters_version)
+        if self.app.show_global_light and not self.app.shadow.is_current(stamp):
             # Enable front face culling in ctx to remove peter-panning flying shadows
             self.ctx.cull_face = "front"
+            self.app.shadow.depth_fbo.clear()
             self.app.shadow.depth_fbo.use()
-            for obj in self.objects:
-                if obj.can_render:
-                    obj.render_shadow()
+            for batch in self.app.prototype.batches:
+                batch.render_shadow()
             self.ctx.cull_face = "back"
 
-        # Pass 2 - Render the scene
+        # Pass 2 - Render the scene, one instanced draw per batch of visible objects
         self.app.ctx.screen.use()  # Switch back to the screen
-        for obj in self.objects:
-            if obj.can_render:
-                obj.render()
+        for batch in self.app.prototype.batches:
+            batch.render()
 
         # Render debug lights
         if self.app.show_light_sources:
@@ -38,17 +38,26 @@ struct Material {
 const int max_lights = 99;
 
 // uniform vec2 u_resolution;
-uniform vec3 cam_pos;
-uniform PointLight lights[max_lights];
-uniform float num_lights;
+// Shared by every program, see UniformBuffer
+layout (std140, binding = 0) uniform Camera {
+  mat4 m_proj;
+  mat4 m_view;
+  mat4 m_view_global_light;
+  vec3 cam_pos;
+};
 
-uniform Light global_light;
-uniform SpotLight flash_light;
+layout (std140, binding = 1) uniform Lights {
+  float num_lights;
+  Light global_light;
+  SpotLight flash_light;
+  PointLight lights[max_lights];
+};
 
 uniform float texture_blend;
 uniform float local_light_blend;
-uniform Material material;
-uniform sampler2D u_texture_0;
+flat in Material material; // Per instance, see InstanceBatch
+flat in float layer;
+uniform sampler2DArray u_texture_array;
 uniform sampler2DShadow shadow_map_tex;
 
 const float PI = 3.14159265359;
@@ -254,7 +263,7 @@ vec3 light_colors(vec3 tex_color) {
 }
 
 void main() {
-  vec3 color = texture(u_texture_0, uv_0).rgb;
+  vec3 color = texture(u_texture_array, vec3(uv_0, layer)).rgb;
   color = pow(color, gamma);
   color = light_colors(color);
 
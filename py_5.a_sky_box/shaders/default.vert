@@ -3,16 +3,32 @@
 layout (location = 0) in vec3 in_texcoord_0;
 layout (location = 1) in vec3 in_position;
 layout (location = 2) in vec3 in_normal;
+// Per instance, see InstanceBatch
+layout (location = 3) in mat4 in_model;
+layout (location = 7) in vec3 in_albedo;
+layout (location = 8) in vec2 in_material; // Roughness and metallic
+layout (location = 9) in float in_layer; // Of the material texture array
+
+struct Material {
+    vec3 a;
+    float d;
+    float s;
+};
 
 out vec2 uv_0;
 out vec3 normal;
 out vec3 fragPos;
 out vec4 shadow_coord;
+flat out Material material;
+flat out float layer;
 
-uniform mat4 m_proj;
-uniform mat4 m_view;
-uniform mat4 m_model;
-uniform mat4 m_view_global_light;
+// Shared by every program, see UniformBuffer
+layout (std140, binding = 0) uniform Camera {
+    mat4 m_proj;
+    mat4 m_view;
+    mat4 m_view_global_light;
+    vec3 cam_pos;
+};
 
 // Bias offset to remove shadow acne
 const float tiny = -0.0005;
@@ -24,11 +40,13 @@ void main() {
     const vec4 in_position4 = vec4(in_position, 1.0);
 
     uv_0 = in_texcoord_0.xy;
-    normal = mat3(transpose(inverse(m_model))) * in_normal;
-    fragPos = vec3(m_model * in_position4);
-    gl_Position = m_proj * m_view * m_model * in_position4;
+    material = Material(in_albedo, in_material.x, in_material.y);
+    layer = in_layer;
+    normal = mat3(transpose(inverse(in_model))) * in_normal;
+    fragPos = vec3(in_model * in_position4);
+    gl_Position = m_proj * m_view * in_model * in_position4;
 
-    const mat4 shadow_mvp = m_proj * m_view_global_light * m_model;
+    const mat4 shadow_mvp = m_proj * m_view_global_light * in_model;
     shadow_coord = m_shadow_bias * shadow_mvp * in_position4;
     shadow_coord.z += tiny;
 }
\ No newline at end of file
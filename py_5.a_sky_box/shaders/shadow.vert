@@ -1,11 +1,16 @@
 #version 460 core
 
 layout (location = 1) in vec3 in_position;
+layout (location = 3) in mat4 in_model; // Per instance, see InstanceBatch
 
-uniform mat4 m_proj;
-uniform mat4 m_view_light;
-uniform mat4 m_model;
+// Shared by every program, see UniformBuffer
+layout (std140, binding = 0) uniform Camera {
+    mat4 m_proj;
+    mat4 m_view;
+    mat4 m_view_global_light;
+    vec3 cam_pos;
+};
 
 void main() {
-    gl_Position = m_proj * m_view_light * m_model * vec4(in_position, 1.0);
+    gl_Position = m_proj * m_view_global_light * in_model * vec4(in_position, 1.0);
 }
\ No newline at end of file
@@ -0,0 +1,112 @@
+import os
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"  # noqa: E402
+
+import sys
+import time
+import moderngl
+import pygame
+
+from core import (Camera, CameraSpotLight, DirectionalLight, Floor, Obj, Prototype, Shadow, Texture, Shader,
+                  UniformBuffer)
+from main import Engine
+
+repeats = 50
+
+
+class Headless(Engine):
+    '''The Engine's settings and parts on a standalone context, without a window, scene or main loop.'''
+
+    def __init__(self, win_size=(1600, 900), backend=None):
+        pygame.init()
+        # Textures are converted to the display format, a hidden window is enough
+        pygame.display.set_mode((1, 1), flags=pygame.HIDDEN)
+        self.win_size = win_size
+        # Any 3.3 core context to start with, the shaders then need a driver taking GLSL 4.60.
+        # backend='egl' runs without a display server
+        self.ctx = moderngl.create_standalone_context(require=330, **({'backend': backend} if backend else {}))
+        self.ctx.enable(flags=moderngl.DEPTH_TEST | moderngl.CULL_FACE)
+        self.camera = Camera(self, position=(0, 0, 5))
+        self.texture = Texture(self)
+        self.shader = Shader(self)
+        self.uniform_buffer = UniformBuffer(self)
+        self.shadow = Shadow(self)
+        self.prototype = Prototype(self)
+        # Same global light as Scene, the depth pass only reads its view
+        self.global_light = DirectionalLight(position=(10, 10, -10), direction=(0, 0, 0))
+        self.flash_light = CameraSpotLight(camera=self.camera, strength=0.0)
+        self.lights = []
+
+
+def get_interleaved_shadow_vao(app, prototype, *attributes):
+    '''The depth pass VAO before the position-only buffers, fetching the whole 2f 3f 3f vertex.'''
+    vbo = app.ctx.buffer(prototype.get_vertex_data())
+    vao = app.ctx.vertex_array(prototype.shadow_program, [
+        (vbo, '2f 3f 3f', *attributes),
+    ], skip_errors=True)
+    return vbo, vao
+
+
+def get_casters(app):
+    '''The shadow casters of Scene, each with its depth pass VAO from before the position-only buffers.'''
+    casters = []
+    floor_vbo, floor_vao = get_interleaved_shadow_vao(app, app.prototype.get_object("floor"),
+                                                      'in_texcoord_0', 'in_position', 'in_normal')
+    for i in range(-10, 10):
+        for j in range(-10, 10):
+            casters.append((Floor(app, position=(i * 2.0, -1, j * 2.0), scale=(1, 0.1, 1)), floor_vao))
+    buffers = [floor_vbo, floor_vao]
+    # cat_1_diffuse is not in the repository, the depth pass does not sample the textures anyway
+    for model, position, scale in (("cat_1/20430_Cat_v1_NEW", (-3, -0.84, 0), (0.5, 0.5, 0.5)),
+                                   ("cat_2/12221_Cat_v1_l3", (3, -0.84, 0), (0.1, 0.1, 0.1))):
+        cat = Obj(app, position=position, model=model, texture="cat_2_diffuse", scale=scale)
+        # The prototype was just built for this model, OBJ vertices are texture coordinates, normal then position
+        vbo, vao = get_interleaved_shadow_vao(app, app.prototype.get_object("obj"),
+                                              'in_texcoord_0', 'in_normal', 'in_position')
+        casters.append((cat, vao))
+        buffers += [vbo, vao]
+    return casters, buffers
+
+
+def time_shadow_pass(app, casters):
+    '''Mean time of the depth pass over the casters, waiting for the GPU to finish.'''
+    app.ctx.cull_face = "front"
+    app.shadow.depth_fbo.use()
+    app.ctx.finish()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        app.shadow.depth_fbo.clear()
+        for obj in casters:
+            obj.render_shadow()
+    app.ctx.finish()
+    app.ctx.cull_face = "back"
+    return (time.perf_counter() - start) / repeats
+
+
+def bench_shadow_pass(app):
+    app.uniform_buffer.update()
+    casters, buffers = get_casters(app)
+    floors = [obj for obj, _ in casters if isinstance(obj, Floor)]
+    cats = [obj for obj, _ in casters if isinstance(obj, Obj)]
+    interleaved_vaos = {id(obj): vao for obj, vao in casters}
+    print(f"shadow pass ({app.shadow.depth_texture.size[0]}^2 depth map)")
+    for name, objects in (("floor tiles", floors), ("cats", cats), ("scene", floors + cats)):
+        # Once first, the first pass also pays for the driver's setup
+        time_shadow_pass(app, objects)
+        position_time = time_shadow_pass(app, objects)
+        position_vaos = [obj.shadow_vao for obj in objects]
+        for obj in objects:
+            obj.shadow_vao = interleaved_vaos[id(obj)]
+        time_shadow_pass(app, objects)
+        interleaved_time = time_shadow_pass(app, objects)
+        for obj, vao in zip(objects, position_vaos):
+            obj.shadow_vao = vao
+        print(f"  {name:>11} ({len(objects):>3}): position only (3f) {position_time * 1000:7.2f}ms, "
+              f"interleaved (2f 3f 3f) {interleaved_time * 1000:7.2f}ms, x{interleaved_time / position_time:5.2f}")
+    for buffer in buffers:
+        buffer.release()
+
+
+if __name__ == '__main__':
+    # python benchmark.py [repeats] [backend]
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else repeats
+    bench_shadow_pass(Headless(backend=sys.argv[2] if len(sys.argv) > 2 else None))
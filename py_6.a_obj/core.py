@@ -123,13 +123,17 @@ class DirectionalLight:
         self.color = glm.vec3(color)
         self.strength = strength
         self.m_view_light = self.get_view_matrix()
+        self.version = 0  # Counts the turns, see Shadow.is_current
 
     def get_view_matrix(self):
         return glm.lookAt(self.position, self.direction, glm.vec3(0, 1, 0))
 
     def rotate(self, time):
+        if time == 0:
+            return
         self.position = glm.rotateY(self.position, time)
         self.m_view_light = self.get_view_matrix()
+        self.version += 1
 
 
 class SpotLight:
@@ -165,6 +169,71 @@ class CameraSpotLight:
         self.direction = self.camera.forward
 
 
+class UniformBuffer:
+    '''Camera and Lights uniform blocks, packed once per frame and bound to every shader program.
+
+    The structured arrays follow the std140 layout of the blocks declared in the shaders.'''
+    camera_binding = 0
+    lights_binding = 1
+    max_lights = 99  # Same as max_lights in the fragment shaders
+
+    point_light = numpy.dtype({'names': ['position', 'color', 'strength'],
+                               'formats': [('f4', 3), ('f4', 3), 'f4'],
+                               'offsets': [0, 16, 28], 'itemsize': 32})
+    directional_light = numpy.dtype({'names': ['position', 'direction', 'color', 'strength'],
+                                     'formats': [('f4', 3), ('f4', 3), ('f4', 3), 'f4'],
+                                     'offsets': [0, 16, 32, 44], 'itemsize': 48})
+    spot_light = numpy.dtype({'names': ['position', 'direction', 'color', 'strength', 'cutoff', 'softness'],
+                              'formats': [('f4', 3), ('f4', 3), ('f4', 3), 'f4', 'f4', 'f4'],
+                              'offsets': [0, 16, 32, 44, 48, 52], 'itemsize': 64})
+    camera_block = numpy.dtype({'names': ['m_proj', 'm_view', 'm_view_global_light', 'cam_pos'],
+                                'formats': [('f4', (4, 4)), ('f4', (4, 4)), ('f4', (4, 4)), ('f4', 3)],
+                                'offsets': [0, 64, 128, 192], 'itemsize': 208})
+    lights_block = numpy.dtype({'names': ['num_lights', 'global_light', 'flash_light', 'lights'],
+                                'formats': ['f4', directional_light, spot_light, (point_light, max_lights)],
+                                'offsets': [0, 16, 64, 128], 'itemsize': 128 + 32 * max_lights})
+
+    def __init__(self, app):
+        self.app = app
+        self.ctx = app.ctx
+        self.camera_data = numpy.zeros((), dtype=self.camera_block)
+        self.lights_data = numpy.zeros((), dtype=self.lights_block)
+        self.camera_ubo = self.ctx.buffer(reserve=self.camera_block.itemsize)
+        self.lights_ubo = self.ctx.buffer(reserve=self.lights_block.itemsize)
+        # Programs pick the blocks up by the binding points in their layout qualifiers
+        self.camera_ubo.bind_to_uniform_block(self.camera_binding)
+        self.lights_ubo.bind_to_uniform_block(self.lights_binding)
+
+    def update(self):
+        # glm matrices convert to NumPy row by row, GLSL reads them column by column
+        camera = self.camera_data
+        camera['m_proj'] = numpy.asarray(self.app.camera.m_proj).T
+        camera['m_view'] = numpy.asarray(self.app.camera.m_view).T
+        camera['m_view_global_light'] = numpy.asarray(self.app.global_light.m_view_light).T
+        camera['cam_pos'] = self.app.camera.position
+        self.camera_ubo.write(camera)
+
+        lights = self.lights_data
+        lights['num_lights'] = len(self.app.lights)
+        if self.app.lights:
+            # One assignment per member for all the point lights, not one per light
+            point_lights = lights['lights'][:len(self.app.lights)]
+            point_lights['position'] = [light.position for light in self.app.lights]
+            point_lights['color'] = [light.color for light in self.app.lights]
+            point_lights['strength'] = [light.strength for light in self.app.lights]
+        global_light = self.app.global_light
+        lights['global_light'] = (global_light.position, global_light.direction, global_light.color,
+                                  global_light.strength)
+        flash_light = self.app.flash_light
+        lights['flash_light'] = (flash_light.position, flash_light.direction, flash_light.color,
+                                 flash_light.strength, flash_light.cutoff, flash_light.softness)
+        self.lights_ubo.write(lights)
+
+    def destroy(self):
+        self.camera_ubo.release()
+        self.lights_ubo.release()
+
+
 class Shader():
     def __init__(self, app):
         self.app = app
@@ -295,6 +364,15 @@ class Shadow():
         self.shader_program = app.shader.get_shader("default")
         self.shader_program['shadow_map_tex'] = self.depth_tex_id
         self.app.texture.textures[self.depth_tex_id].use(location=self.depth_tex_id)
+        # What the depth map was last drawn for, see is_current
+        self.stamp = None
+
+    def is_current(self, stamp):
+        '''Whether the depth map was drawn for the same stamp, else keep the stamp to draw it again.'''
+        if self.stamp == stamp:
+            return True
+        self.stamp = stamp
+        return False
 
     def destroy(self):
         self.depth_fbo.release()
@@ -337,51 +415,17 @@ class Prototype:
         return base_object
 
     def common_render_update(self):
+        # Camera and lights for every shader program
+        self.app.uniform_buffer.update()
+
         shader_program = self.app.shader.get_shader('default')
         # Resolution
         # shader_program['u_resolution'].write(glm.vec2(self.app.win_size))
 
-        # Position
-        shader_program['num_lights'].value = len(self.app.lights)
-        shader_program['cam_pos'].write(self.app.camera.position)
-        shader_program['m_proj'].write(self.app.camera.m_proj)
-        shader_program['m_view'].write(self.app.camera.m_view)
-
-        # Send lights into uniform array of Light struct
-        for i, light in enumerate(self.app.lights):
-            shader_program[f'lights[{i}].position'].value = light.position
-            shader_program[f'lights[{i}].color'].value = light.color
-            shader_program[f'lights[{i}].strength'].value = light.strength
-
-        # Send global_light from self.global_light
-        shader_program['m_view_global_light'].write(self.app.global_light.m_view_light)
-        shader_program['global_light.position'].value = self.app.global_light.position
-        shader_program['global_light.direction'].value = self.app.global_light.direction
-        shader_program['global_light.color'].value = self.app.global_light.color
-        shader_program['global_light.strength'].value = self.app.global_light.strength
-
-        # Send flash_light from self.flash_light
-        shader_program['flash_light.position'].value = self.app.flash_light.position
-        shader_program['flash_light.color'].value = self.app.flash_light.color
-        shader_program['flash_light.strength'].value = self.app.flash_light.strength
-        shader_program['flash_light.cutoff'].value = self.app.flash_light.cutoff
-        shader_program['flash_light.direction'].value = self.app.flash_light.direction
-        shader_program['flash_light.softness'].value = self.app.flash_light.softness
-
-        # Shadow
-        shadow_program = self.app.shader.get_shader('shadow')
-        shadow_program['m_proj'].write(self.app.camera.m_proj)
-        shadow_program['m_view_light'].write(self.app.global_light.m_view_light)
-
         # Debug
         shader_program["texture_blend"].value = self.app.texture_blend
         shader_program["local_light_blend"].value = self.app.local_light
 
-        # Debug Light
-        light_program = self.app.shader.get_shader('light')
-        light_program['m_proj'].write(self.app.camera.m_proj)
-        light_program['m_view'].write(self.app.camera.m_view)
-
     def destroy(self):
         for obj in self.objects:
             obj.destroy()
@@ -393,29 +437,30 @@ class PrototypeCube:
                  shadow_name: str = 'shadow'):
         self.app = app
         self.ctx = app.ctx
-        self.vbo = self.get_vbo()
+        self.vbo, self.position_vbo = self.get_vbos()
         self.shader_program = self.app.shader.get_shader(shader_name)
-        self.vao = self.get_vao(self.vbo, self.shader_program)
+        self.vao = self.get_vao(self.vbo, self.position_vbo, self.shader_program)
         self.shadow_program = self.app.shader.get_shader(shadow_name)
-        self.shadow_vao = self.get_shadow_vao(self.vbo, self.shadow_program)
+        self.shadow_vao = self.get_shadow_vao(self.position_vbo, self.shadow_program)
 
     def destroy(self):
         self.vao.release()
         self.shadow_vao.release()
         self.vbo.release()
+        self.position_vbo.release()
 
-    def get_vao(self, vbo, shader_program):
+    def get_vao(self, vbo, position_vbo, shader_program):
         vao = self.ctx.vertex_array(shader_program, [
-            (vbo, '2f 3f 3f', 'in_texcoord_0', 'in_position', 'in_normal'),
+            (vbo, '2f 3f', 'in_texcoord_0', 'in_normal'),
+            (position_vbo, '3f', 'in_position'),
         ])
         return vao
 
-    def get_shadow_vao(self, vbo, shadow_program):
+    def get_shadow_vao(self, position_vbo, shadow_program):
+        # The depth pass only fetches positions
         vao = self.ctx.vertex_array(shadow_program, [
-            (vbo, '2f 3f 3f', 'in_texcoord_0', 'in_position', 'in_normal'),
-        ], skip_errors=True)
-        # Temporary fix for the issue with the shadow program because we are not using texture coordinates
-        # So we set skip_errors=True to ignore the missing in_texcoord_0 attribute
+            (position_vbo, '3f', 'in_position'),
+        ])
         return vao
 
     def get_vertex_data(self):
@@ -465,8 +510,11 @@ class PrototypeCube:
 
         return numpy.array(vertex_data, dtype='f4')
 
-    def get_vbo(self):
-        return self.ctx.buffer(self.get_vertex_data())
+    def get_vbos(self):
+        # Positions get a buffer of their own, so the depth pass reads nothing it does not use
+        vertex_data = self.get_vertex_data()
+        vbo = self.ctx.buffer(numpy.ascontiguousarray(vertex_data[:, [0, 1, 5, 6, 7]]))
+        return vbo, self.ctx.buffer(numpy.ascontiguousarray(vertex_data[:, 2:5]))
 
 
 class PrototypeObj:
@@ -480,31 +528,35 @@ class PrototypeObj:
 
     def build(self, name: str = "cat/20430_Cat_v1_NEW"):
         self.name = name
-        self.vbo = self.get_vbo()
-        self.vao = self.get_vao(self.vbo, self.shader_program)
-        self.shadow_vao = self.get_shadow_vao(self.vbo, self.shadow_program)
+        self.vbo, self.position_vbo = self.get_vbos()
+        self.vao = self.get_vao(self.vbo, self.position_vbo, self.shader_program)
+        self.shadow_vao = self.get_shadow_vao(self.position_vbo, self.shadow_program)
 
     def destroy(self):
         self.vao.release()
         self.shadow_vao.release()
         self.vbo.release()
+        self.position_vbo.release()
 
-    def get_vao(self, vbo, shader_program):
+    def get_vao(self, vbo, position_vbo, shader_program):
         vao = self.ctx.vertex_array(shader_program, [
-            (vbo, '2f 3f 3f', 'in_texcoord_0', 'in_normal', 'in_position'),
+            (vbo, '2f 3f', 'in_texcoord_0', 'in_normal'),
+            (position_vbo, '3f', 'in_position'),
         ])
         return vao
 
-    def get_shadow_vao(self, vbo, shadow_program):
+    def get_shadow_vao(self, position_vbo, shadow_program):
+        # The depth pass only fetches positions
         vao = self.ctx.vertex_array(shadow_program, [
-            (vbo, '2f 3f 3f', 'in_texcoord_0', 'in_normal', 'in_position'),
-        ], skip_errors=True)
-        # Temporary fix for the issue with the shadow program because we are not using texture coordinates
-        # So we set skip_errors=True to ignore the missing in_texcoord_0 attribute
+            (position_vbo, '3f', 'in_position'),
+        ])
         return vao
 
-    def get_vbo(self):
-        return self.ctx.buffer(self.get_vertex_data())
+    def get_vbos(self):
+        # Positions get a buffer of their own, the OBJ vertices are texture coordinates, normal then position
+        vertex_data = self.get_vertex_data().reshape(-1, 8)
+        vbo = self.ctx.buffer(numpy.ascontiguousarray(vertex_data[:, :5]))
+        return vbo, self.ctx.buffer(numpy.ascontiguousarray(vertex_data[:, 5:]))
 
     def get_vertex_data(self):
         file_path = f"../assets/{self.name}.obj"
@@ -704,6 +756,7 @@ class Scene():
     objects = []
     update_list = []
     moved = True
+    casters_version = 0  # Counts the changes to the shadow casters, see Shadow.is_current
 
     def __init__(self, app):
         self.app = app
@@ -773,36 +826,35 @@ class Scene():
                 self.update_list.append(obj)
 
     def update(self):
+        for obj in self.update_list:
+            m_model = obj.m_model
+            obj.update()
+            if obj.m_model != m_model:
+                self.casters_version += 1
         if self.moved == False:
-            for obj in self.update_list:
-                obj.update()
             return
         camera_pos = self.app.camera.position
         for obj in self.objects:
-            if obj.can_update:
-                obj.update()
             angle_from_camera = glm.degrees(glm.acos(glm.dot(glm.normalize(obj.pos - camera_pos), self.app.camera.forward)))
-            if angle_from_camera <= 120.0:  # View frustum
-                obj.can_render = True
-                continue
-            distance = glm.distance(camera_pos, obj.pos)
-            if distance <= 10.0:
-                obj.can_render = True
-                continue
-            obj.can_render = False
+            # View frustum, or close to the camera
+            can_render = angle_from_camera <= 120.0 or glm.distance(camera_pos, obj.pos) <= 10.0
+            if obj.can_render != can_render:
+                obj.can_render = can_render
+                self.casters_version += 1
         self.moved = False
 
     def render(self):
         self.app.prototype.common_render_update()
 
-        # Clear buffers
-        self.app.shadow.depth_fbo.clear()
+        # Clear buffers, the depth map only when it is drawn again
         self.app.ctx.clear(color=(0.08, 0.16, 0.18))
 
-        # Pass 1 - Render the depth map for the global light shadows
-        if self.app.show_global_light:
+        # Pass 1 - Render the depth map for the global light shadows, kept while the light and casters are still
+        stamp = (self.app.global_light.version, self.casters_version)
+        if self.app.show_global_light and not self.app.shadow.is_current(stamp):
             # Enable front face culling in ctx to remove peter-panning flying shadows
             self.ctx.cull_face = "front"
+            self.app.shadow.depth_fbo.clear()
             self.app.shadow.depth_fbo.use()
             for obj in self.objects:
                 if obj.can_render:
@@ -38,12 +38,20 @@ struct Material {
 const int max_lights = 99;
 
 // uniform vec2 u_resolution;
-uniform vec3 cam_pos;
-uniform PointLight lights[max_lights];
-uniform float num_lights;
+// Shared by every program, see UniformBuffer
+layout (std140, binding = 0) uniform Camera {
+  mat4 m_proj;
+  mat4 m_view;
+  mat4 m_view_global_light;
+  vec3 cam_pos;
+};
 
-uniform Light global_light;
-uniform SpotLight flash_light;
+layout (std140, binding = 1) uniform Lights {
+  float num_lights;
+  Light global_light;
+  SpotLight flash_light;
+  PointLight lights[max_lights];
+};
 
 uniform float texture_blend;
 uniform float local_light_blend;
@@ -2,8 +2,14 @@
 
 layout (location = 0) in vec3 in_position;
 
-uniform mat4 m_proj;
-uniform mat4 m_view;
+// Shared by every program, see UniformBuffer
+layout (std140, binding = 0) uniform Camera {
+    mat4 m_proj;
+    mat4 m_view;
+    mat4 m_view_global_light;
+    vec3 cam_pos;
+};
+
 uniform mat4 m_model;
 
 void main() {